@@ -1,13 +1,22 @@
 from django.urls import reverse
 from django.shortcuts import redirect
 from django.contrib import messages
+from django.utils.deprecation import MiddlewareMixin
 
 
-class RedirectIfAuthenticatedMiddleware:
-    def __init__(self, get_response):
-        self.get_response = get_response
+# MiddlewareMixin makes these async-capable: under ASGI a sync-only
+# middleware would run everything after it, async views included, in a
+# thread. Their own hooks still run in a thread through sync_to_async; only
+# the rest of the chain stays on the event loop.
 
-    def __call__(self, request):
+
+class RedirectIfAuthenticatedMiddleware(MiddlewareMixin):
+    def process_request(self, request):
+        if request.path not in (
+            reverse("accounts:login_page"),
+            reverse("accounts:register_page"),
+        ):
+            return None
 
         if request.user.is_authenticated:  # check if user is logged in
             if request.path == reverse("accounts:login_page"):
@@ -16,25 +25,16 @@ class RedirectIfAuthenticatedMiddleware:
             elif request.path == reverse("accounts:register_page"):
                 messages.info(request, "Please logout first and then register")
                 return redirect(reverse("accounts:customer_profile"))
-
-        response = self.get_response(request)
-        # Code to be executed after the view
-        return response
+        return None
 
 
-class AdminRequiredMiddleware:
-    def __init__(self, get_response):
-        self.get_response = get_response
+class AdminRequiredMiddleware(MiddlewareMixin):
+    def process_request(self, request):
+        if request.path != reverse("accounts:admin_dashboard"):
+            return None
 
-    def __call__(self, request):
-
-        if request.user.is_authenticated and request.path == reverse(
-            "accounts:admin_dashboard"
-        ):
+        if request.user.is_authenticated:
             if not request.user.is_staff:  # check if user is logged in
                 messages.warning(request, "You are not authorized to access admin page")
                 return redirect(reverse("accounts:customer_profile"))
-
-        response = self.get_response(request)
-        # Code to be executed after the view
-        return response
+        return None
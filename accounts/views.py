@@ -6,6 +6,7 @@ from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.decorators import login_required
 from .models import ShippingAddress, CustomUser
 from store.models import Order
+from store import carts
 from django.views.decorators.http import require_POST
 
 import logging
@@ -36,6 +37,10 @@ def login_view(request):
         user = authenticate(request, email=email, password=password)
         if user is not None:
             login(request, user)
+            try:
+                carts.merge_anonymous_cart(request, user)
+            except Exception:
+                logger.exception(f"\nUser: {email}, cart from before login not merged")
 
             # Handle "Remember Me"
             if not remember_me:
@@ -26,6 +26,8 @@ CSRF_TRUSTED_ORIGINS = [
 # Application definition
 
 INSTALLED_APPS = [
+    # first, so runserver serves ASGI and async views hold no thread
+    "daphne",
     "jazzmin",
     "django.contrib.admin",
     "django.contrib.auth",
@@ -37,6 +39,7 @@ INSTALLED_APPS = [
     "store",
     "debug_toolbar",
     "background_task",
+    "rest_framework",
 ]
 
 MIDDLEWARE = [
@@ -50,6 +53,7 @@ MIDDLEWARE = [
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
     "accounts.middlewares.RedirectIfAuthenticatedMiddleware",
     "accounts.middlewares.AdminRequiredMiddleware",
+    "store.middlewares.AnonymousCartMiddleware",
 ]
 
 INTERNAL_IPS = [
@@ -71,12 +75,14 @@ TEMPLATES = [
                 "django.template.context_processors.request",
                 "django.contrib.auth.context_processors.auth",
                 "django.contrib.messages.context_processors.messages",
+                "store.context_processors.cart_summary",
             ],
         },
     },
 ]
 
 WSGI_APPLICATION = "project.wsgi.application"
+ASGI_APPLICATION = "project.asgi.application"
 
 
 # Database
@@ -99,6 +105,18 @@ DATABASES = {
     # }
 }
 
+# the cache every web and task process shares (carts, idempotency records,
+# ...); without REDIS_URL each process keeps its own local memory cache and
+# the features relying on a shared one fall back to the database
+REDIS_URL = config("REDIS_URL", default="")
+if REDIS_URL:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": REDIS_URL,
+        }
+    }
+
 
 # Password validation
 # https://docs.djangoproject.com/en/6.0/ref/settings/#auth-password-validators
@@ -143,8 +161,77 @@ MEDIA_URL = "/media/"
 
 KHALTI_BASE_URL = config("KHALTI_BASE_URL")
 KHALTI_SECRET_KEY = config("KHALTI_SECRET_KEY")
+# kept-alive connections to the gateway per event loop, see store.khalti
+KHALTI_POOL_SIZE = 10
+# gateway calls the async payment views may have in flight per event loop
+KHALTI_ASYNC_MAX_CONNECTIONS = 100
+KHALTI_TIMEOUT = 10
+# payment lookups are retried, waiting KHALTI_RETRY_BACKOFF seconds and then
+# twice as long each time
+KHALTI_LOOKUP_ATTEMPTS = 3
+KHALTI_RETRY_BACKOFF = 0.5
 SITE_URL = "http://localhost:8000"
 
+# product listing pagination: "offset" (numbered pages) or "keyset" (cursor based)
+PRODUCTS_PAGINATION = config("PRODUCTS_PAGINATION", default="offset")
+
+# lower bounds (Rs.) of the price histogram buckets shown with the product filters
+FACET_PRICE_BUCKETS = [0, 100, 250, 500, 1000, 2500, 5000]
+
+# serve home/products listings from an in-process, per worker catalog snapshot
+CATALOG_SNAPSHOT = config("CATALOG_SNAPSHOT", default=False, cast=bool)
+CATALOG_SNAPSHOT_MAX_BYTES = 64 * 1024 * 1024  # 64MB per worker
+
+# co-purchase pairs kept per product by the related products batch job
+RELATED_PRODUCTS_KEEP = 20
+
+# widths (px) of the responsive copies made of every product image
+PRODUCT_IMAGE_WIDTHS = [320, 640, 960, 1280]
+
+# where live carts are kept, see store.carts; the cache backend needs a shared
+# cache, so carts stay in the database without one
+CART_BACKEND = config(
+    "CART_BACKEND",
+    default=(
+        "store.carts.CacheCartBackend"
+        if REDIS_URL
+        else "store.carts.DatabaseCartBackend"
+    ),
+)
+# seconds a changed cart may wait before it is written to the database, when
+# the cache is shared with the task worker
+CART_WRITE_BEHIND_DELAY = 5
+CART_CACHE_TIMEOUT = 60 * 60 * 24 * 14  # 14 days
+# most products one cart batch request may change
+CART_BATCH_MAX_ITEMS = 100
+# carts of visitors who are not logged in live in a signed cookie
+CART_COOKIE_NAME = "cart"
+CART_COOKIE_AGE = 60 * 60 * 24 * 14  # 14 days
+CART_COOKIE_MAX_ITEMS = 50  # keeps the cookie well under 4 KB
+
+# every process making order ids leases its own worker id (0-1023) from the
+# database for this many seconds, renewed halfway through; see store.utils
+ORDER_ID_WORKER_LEASE = 60 * 60
+# seconds a checkout or payment response is replayed for a repeated request
+IDEMPOTENCY_TTL = 60 * 60 * 24
+
+# rows a tracked product's stock is split over, see store.inventory
+INVENTORY_SHARDS = 8
+# attempts at reserving stock when concurrent checkouts drain the shards
+INVENTORY_RETRIES = 5
+
+# write orders in the background during traffic spikes; orders are written by
+# `manage.py process_tasks --queue checkout`, one order at a time per process
+CHECKOUT_QUEUED = config("CHECKOUT_QUEUED", default=False, cast=bool)
+
+# the catalog API is public and read-only
+REST_FRAMEWORK = {
+    "DEFAULT_RENDERER_CLASSES": ["rest_framework.renderers.JSONRenderer"],
+    "DEFAULT_AUTHENTICATION_CLASSES": [],
+    "DEFAULT_PERMISSION_CLASSES": ["rest_framework.permissions.AllowAny"],
+    "UNAUTHENTICATED_USER": None,
+}
+
 
 ########### JAZZMIN settings #######################
 JAZZMIN_SETTINGS = {
@@ -265,6 +352,11 @@ LOGGING = {
             "level": "DEBUG",
             "propagate": False,
         },
+        "store": {
+            "handlers": ["file", "console"],
+            "level": "INFO",
+            "propagate": False,
+        },
     },
 }
 
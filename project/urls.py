@@ -4,11 +4,11 @@ from django.conf import settings
 from django.conf.urls.static import static
 from debug_toolbar.toolbar import debug_toolbar_urls
 
-
 urlpatterns = (
     [
         path("admin/", admin.site.urls),
         path("accounts/", include("accounts.urls")),
+        path("api/v1/", include("store.api.urls")),
         path("", include("store.urls")),
     ]
     + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
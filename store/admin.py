@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Product, Category, Cart, Payment, Order, Review
+from .models import Product, Category, Cart, Payment, Order, Review, StockShard
 from store.forms import OrderChangeForm
 
 
@@ -8,6 +8,7 @@ admin.site.register(Category)
 admin.site.register(Cart)
 admin.site.register(Payment)
 admin.site.register(Review)
+admin.site.register(StockShard)
 # admin.site.register(Order)
 
 
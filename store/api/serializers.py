@@ -0,0 +1,90 @@
+"""
+Serializers of the read-only catalog API.
+
+They serialize the dicts of ``QuerySet.values()`` rather than model
+instances. ``columns`` maps each field to the database columns it is read
+from (the field's own name by default), so the views select only the
+columns of the fields a client asked for with ``?fields=``.
+"""
+
+from django.core.files.storage import default_storage
+from rest_framework import serializers
+
+from ..ratings import STARS
+
+
+class MediaURLField(serializers.Field):
+    """URL of a file in media storage, from its stored name."""
+
+    def to_representation(self, name):
+        return default_storage.url(name) if name else None
+
+
+class SparseFieldsetSerializer(serializers.Serializer):
+    """A serializer narrowed to the fields named in ``fields``."""
+
+    columns = {}
+
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+    @classmethod
+    def field_names(cls):
+        return list(cls._declared_fields)
+
+    def projection(self):
+        """Columns to select for the remaining fields."""
+        columns = ["id"]
+        for name in self.fields:
+            for column in self.columns.get(name, (name,)):
+                if column not in columns:
+                    columns.append(column)
+        return columns
+
+
+class CategorySerializer(SparseFieldsetSerializer):
+    id = serializers.IntegerField()
+    name = serializers.CharField()
+
+
+class ProductSerializer(SparseFieldsetSerializer):
+    columns = {"categories": ()}
+
+    id = serializers.IntegerField()
+    sku = serializers.CharField(allow_null=True)
+    name = serializers.CharField()
+    price = serializers.DecimalField(max_digits=10, decimal_places=2)
+    featured = serializers.BooleanField()
+    image = MediaURLField()
+    rating_average = serializers.FloatField()
+    rating_count = serializers.IntegerField()
+    categories = serializers.ListField(child=serializers.IntegerField())
+    created_at = serializers.DateTimeField()
+    updated_at = serializers.DateTimeField()
+
+
+class ProductDetailSerializer(ProductSerializer):
+    columns = {
+        "categories": (),
+        "rating_histogram": tuple(f"rating_{stars}" for stars in STARS),
+    }
+
+    description = serializers.CharField(allow_null=True)
+    rating_histogram = serializers.SerializerMethodField()
+
+    def get_rating_histogram(self, product):
+        return {str(stars): product[f"rating_{stars}"] for stars in STARS}
+
+
+class ReviewSerializer(SparseFieldsetSerializer):
+    columns = {"author": ("user__first_name",)}
+
+    id = serializers.IntegerField()
+    rating = serializers.IntegerField()
+    text = serializers.CharField()
+    author = serializers.CharField(source="user__first_name")
+    created_at = serializers.DateTimeField()
+    updated_at = serializers.DateTimeField()
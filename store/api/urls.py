@@ -0,0 +1,18 @@
+from django.urls import path
+
+from . import views
+
+app_name = "api_v1"
+
+urlpatterns = [
+    path("products/", views.ProductListView.as_view(), name="product_list"),
+    path(
+        "products/<int:pk>/", views.ProductDetailView.as_view(), name="product_detail"
+    ),
+    path(
+        "products/<int:pk>/reviews/",
+        views.ProductReviewListView.as_view(),
+        name="product_reviews",
+    ),
+    path("categories/", views.CategoryListView.as_view(), name="category_list"),
+]
@@ -0,0 +1,211 @@
+"""
+Read-only catalog API, version 1.
+
+Every response is computed from ``values()`` projections (only the columns
+of the requested fields), paginated by cursor, and stored in the shared
+cache through ``listing_cache.get_or_compute``: entries are keyed on the
+host, path and canonical query string and go stale with the catalog
+version, so all workers serve a response computed once per catalog change.
+Product and category responses also carry ETags (see ``store.conditional``).
+"""
+
+import hashlib
+import json
+
+from django.db.models import Max
+from django.shortcuts import get_object_or_404
+from django.utils.decorators import method_decorator
+from rest_framework import serializers
+from rest_framework.generics import GenericAPIView
+from rest_framework.pagination import CursorPagination
+from rest_framework.response import Response
+
+from .. import listing_cache
+from ..conditional import conditional_api
+from ..models import Category, Product, Review
+from .serializers import (
+    CategorySerializer,
+    ProductDetailSerializer,
+    ProductSerializer,
+    ReviewSerializer,
+)
+
+KEY_PREFIX = "store:api:v1"
+
+
+class CatalogCursorPagination(CursorPagination):
+    page_size = 20
+    page_size_query_param = "page_size"
+    max_page_size = 100
+    ordering = "-id"
+
+
+class ReviewCursorPagination(CatalogCursorPagination):
+    ordering = "-created_at"
+
+
+class ProductFilterSerializer(serializers.Serializer):
+    category = serializers.IntegerField(required=False, min_value=1)
+    min_price = serializers.DecimalField(
+        max_digits=10, decimal_places=2, required=False, min_value=0
+    )
+    max_price = serializers.DecimalField(
+        max_digits=10, decimal_places=2, required=False, min_value=0
+    )
+    min_rating = serializers.IntegerField(required=False, min_value=1, max_value=5)
+    featured = serializers.BooleanField(required=False, allow_null=True, default=None)
+
+
+class CatalogAPIView(GenericAPIView):
+    """Shared plumbing: sparse fieldsets, projections and response caching."""
+
+    def get_fields(self):
+        value = self.request.query_params.get("fields")
+        if not value:
+            return None
+        fields = sorted({name.strip() for name in value.split(",") if name.strip()})
+        unknown = set(fields) - set(self.get_serializer_class().field_names())
+        if unknown:
+            raise serializers.ValidationError(
+                {"fields": [f"Unknown field(s): {', '.join(sorted(unknown))}"]}
+            )
+        return fields
+
+    def get_serializer(self, *args, **kwargs):
+        kwargs.setdefault("fields", self.get_fields())
+        return super().get_serializer(*args, **kwargs)
+
+    def cache_key(self, *extra):
+        request = self.request
+        params = sorted(
+            (key, value)
+            for key, values in request.query_params.lists()
+            for value in values
+        )
+        payload = json.dumps(
+            [request.get_host(), request.path, params, *map(str, extra)],
+            separators=(",", ":"),
+        )
+        return f"{KEY_PREFIX}:{hashlib.sha256(payload.encode()).hexdigest()}"
+
+    def cached_response(self, compute, *extra):
+        return Response(listing_cache.get_or_compute(self.cache_key(*extra), compute))
+
+    def paginated(self, queryset, serializer, attach=None):
+        """
+        One page of ``queryset`` projected for ``serializer`` (a ``many=True``
+        serializer), as plain data that can go in the cache.
+        """
+        columns = serializer.child.projection()
+        # the cursor is built from the ordering column, asked for or not
+        ordering = self.paginator.ordering.lstrip("-")
+        if ordering not in columns:
+            columns.append(ordering)
+        page = self.paginate_queryset(queryset.values(*columns))
+        if attach is not None:
+            attach(page)
+        serializer.instance = page
+        response = self.get_paginated_response(serializer.data)
+        return {
+            "next": response.data["next"],
+            "previous": response.data["previous"],
+            "results": list(serializer.data),
+        }
+
+
+def attach_categories(products):
+    """Set ``categories`` (ids) on product dicts, with one query."""
+    categories = {}
+    for product_id, category_id in Product.categories.through.objects.filter(
+        product_id__in=[product["id"] for product in products]
+    ).values_list("product_id", "category_id"):
+        categories.setdefault(product_id, []).append(category_id)
+    for product in products:
+        product["categories"] = sorted(categories.get(product["id"], []))
+
+
+@method_decorator(conditional_api, name="get")
+class ProductListView(CatalogAPIView):
+    serializer_class = ProductSerializer
+    pagination_class = CatalogCursorPagination
+
+    def get_queryset(self):
+        filters = ProductFilterSerializer(data=self.request.query_params)
+        filters.is_valid(raise_exception=True)
+        filters = filters.validated_data
+
+        products = Product.objects.all()
+        if filters.get("category"):
+            products = products.filter(
+                pk__in=Product.categories.through.objects.filter(
+                    category_id=filters["category"]
+                ).values("product_id")
+            )
+        if filters.get("min_price") is not None:
+            products = products.filter(price__gte=filters["min_price"])
+        if filters.get("max_price") is not None:
+            products = products.filter(price__lte=filters["max_price"])
+        if filters.get("min_rating"):
+            products = products.filter(rating_average__gte=filters["min_rating"])
+        if filters.get("featured") is not None:
+            products = products.filter(featured=filters["featured"])
+        return products
+
+    def get(self, request, *args, **kwargs):
+        def compute():
+            serializer = self.get_serializer(many=True)
+            wanted = serializer.child.fields
+            attach = attach_categories if "categories" in wanted else None
+            return self.paginated(self.get_queryset(), serializer, attach)
+
+        return self.cached_response(compute)
+
+
+@method_decorator(conditional_api, name="get")
+class ProductDetailView(CatalogAPIView):
+    serializer_class = ProductDetailSerializer
+
+    def get(self, request, pk):
+        def compute():
+            serializer = self.get_serializer()
+            product = get_object_or_404(
+                Product.objects.values(*serializer.projection()), pk=pk
+            )
+            if "categories" in serializer.fields:
+                attach_categories([product])
+            serializer.instance = product
+            return dict(serializer.data)
+
+        return self.cached_response(compute)
+
+
+@method_decorator(conditional_api, name="get")
+class CategoryListView(CatalogAPIView):
+    serializer_class = CategorySerializer
+
+    def get(self, request):
+        def compute():
+            serializer = self.get_serializer(many=True)
+            serializer.instance = list(
+                Category.objects.order_by("name").values(*serializer.child.projection())
+            )
+            return list(serializer.data)
+
+        return self.cached_response(compute)
+
+
+class ProductReviewListView(CatalogAPIView):
+    serializer_class = ReviewSerializer
+    pagination_class = ReviewCursorPagination
+
+    def get(self, request, pk):
+        get_object_or_404(Product.objects.only("pk"), pk=pk)
+        reviews = Review.objects.filter(product_id=pk)
+        # editing a review's text leaves the catalog version alone, so the
+        # latest review edit is part of the key
+        last_edit = reviews.aggregate(last=Max("updated_at"))["last"]
+
+        def compute():
+            return self.paginated(reviews, self.get_serializer(many=True))
+
+        return self.cached_response(compute, last_edit)
@@ -0,0 +1,158 @@
+"""
+Product name autocomplete.
+
+Every worker keeps a sorted array of ``(key, product id)`` entries, one per
+word of each product name: the key is the name lower-cased from that word
+on, so "Red Apple" is found by both "red a" and "app". A lookup is a
+``bisect`` to the first key starting with the query and a short forward
+scan, entirely in memory.
+
+Like the facet index (see ``store.facets``) the index is stamped with the
+catalog version it was built at and patched in place for products changed
+by this process. When another process moves the version, lookups keep
+answering from the current index while a background thread rebuilds it, so
+keystroke traffic never waits on the database.
+"""
+
+import threading
+from bisect import bisect_left, insort
+
+from django.db import connection
+
+from . import catalog, search
+
+MAX_SUGGESTIONS = 8
+MIN_QUERY_LENGTH = 2
+# entries scanned past the first match before giving up on filling the list
+MAX_SCAN = 200
+
+
+def normalize(text):
+    return " ".join(search.tokenize(text))
+
+
+def keys_for(name):
+    words = normalize(name).split(" ")
+    return {" ".join(words[start:]) for start in range(len(words)) if words[start]}
+
+
+class AutocompleteIndex:
+    def __init__(self, version):
+        self.version = version
+        self.entries = []  # sorted (key, pk) pairs
+        self.names = {}  # pk -> display name
+
+    @classmethod
+    def build(cls, version):
+        from .models import Product
+
+        index = cls(version)
+        rows = Product.objects.values_list("pk", "name").order_by()
+        for pk, name in rows.iterator(chunk_size=5000):
+            index.names[pk] = name
+            index.entries.extend((key, pk) for key in keys_for(name))
+        index.entries.sort()
+        return index
+
+    def remove(self, pk):
+        name = self.names.pop(pk, None)
+        if name is None:
+            return
+        for key in keys_for(name):
+            position = bisect_left(self.entries, (key, pk))
+            if position < len(self.entries) and self.entries[position] == (key, pk):
+                del self.entries[position]
+
+    def add(self, pk, name):
+        self.names[pk] = name
+        for key in keys_for(name):
+            insort(self.entries, (key, pk))
+
+    def refresh(self, product_ids):
+        """Re-read the given products' names from the database into the index."""
+        from .models import Product
+
+        product_ids = list(product_ids)
+        names = dict(
+            Product.objects.filter(pk__in=product_ids).values_list("pk", "name")
+        )
+        for pk in product_ids:
+            self.remove(pk)
+            if pk in names:
+                self.add(pk, names[pk])
+
+    def suggest(self, query, limit=MAX_SUGGESTIONS):
+        """``(pk, name)`` of products with a word starting with ``query``."""
+        prefix = normalize(query)
+        if len(prefix) < MIN_QUERY_LENGTH:
+            return []
+
+        entries = self.entries
+        position = bisect_left(entries, (prefix,))
+        seen, suggestions = set(), []
+        for key, pk in entries[position : position + MAX_SCAN]:
+            if not key.startswith(prefix):
+                break
+            if pk not in seen:
+                seen.add(pk)
+                suggestions.append((pk, self.names[pk]))
+                if len(suggestions) >= limit:
+                    break
+        return suggestions
+
+
+_index = None
+_lock = threading.Lock()
+# held while a rebuild runs, so there is at most one per process
+_building = threading.Lock()
+
+
+def _rebuild(version):
+    global _index
+
+    try:
+        index = AutocompleteIndex.build(version)
+        with _lock:
+            if _index is None or _index.version < version:
+                _index = index
+    finally:
+        # the thread's own connection would otherwise outlive it
+        connection.close()
+        _building.release()
+
+
+def get_index():
+    """
+    The autocomplete index. Only the very first call builds it inline; a stale
+    index keeps serving while a background thread catches up.
+    """
+    global _index
+
+    version = catalog.get_version()
+    index = _index
+    if index is not None and index.version == version:
+        return index
+
+    if index is None:
+        with _building:
+            if _index is None:
+                _index = AutocompleteIndex.build(version)
+        return _index
+
+    if _building.acquire(blocking=False):
+        threading.Thread(target=_rebuild, args=(version,), daemon=True).start()
+    return index
+
+
+def refresh_products(product_ids, version):
+    """
+    Patch this worker's index after it changed ``product_ids`` and moved the
+    catalog to ``version``. Otherwise the index is left stale and rebuilt in
+    the background on next use.
+    """
+    with _lock:
+        if product_ids is None or _index is None:
+            return
+        if _index.version == version - 1:
+            _index.refresh(product_ids)
+            _index.version = version
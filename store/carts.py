@@ -0,0 +1,692 @@
+"""
+Pluggable cart storage.
+
+A cart is a ``{product id: quantity}`` mapping per user. ``CART_BACKEND``
+names the class that holds it:
+
+- ``store.carts.CacheCartBackend`` (default with ``REDIS_URL``) keeps the
+  live cart in the shared cache. Mutations only touch the cache;
+  ``CartProduct`` rows are brought up to date by a background task a few
+  seconds later (``CART_WRITE_BEHIND_DELAY``) and always at checkout.
+- ``store.carts.InMemoryCartBackend`` keeps carts in a per-process dict and
+  only persists them on ``flush`` and at checkout; a stand-in for tests.
+- ``store.carts.DatabaseCartBackend`` (default otherwise) reads and writes
+  ``CartProduct`` directly, as the views used to.
+
+The task worker is a process of its own, so carts are only written behind
+when the cache is shared (see ``utils.cache_is_shared``); with a
+per-process cache every change is written to ``CartProduct`` straight away.
+
+Visitors who are not logged in get a ``SignedCookieCartBackend`` instead
+(see ``for_request``): their cart lives in a signed cookie, costs no
+database writes, and is merged into their ``CartProduct`` rows when they
+log in (``merge_anonymous_cart``).
+
+Each cart also has a summary (item count and total) in the shared cache for
+the navbar. Mutations adjust it by the quantities they change, pricing only
+those products; a product price change moves ``PRICES_KEY`` and summaries
+stamped with an older value are worked out again on their next read.
+Without a shared cache the summary is kept on the ``Cart`` row instead,
+where every process reads it with one query: mutations clear it, and it is
+worked out again on the next read, or once the catalog version moves.
+
+Every read-modify-write of a cart runs under a per-user lock, and
+``checkout`` holds that lock while the order is written, so ``place_order``
+sees one consistent cart and no mutation slips in between.
+"""
+
+import threading
+import time
+import uuid
+from contextlib import contextmanager, nullcontext
+from decimal import Decimal
+
+from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Case, F, When
+from django.db.models.functions import Greatest
+from django.utils.module_loading import import_string
+
+from . import catalog
+from .utils import cache_is_shared
+
+LOCK_TIMEOUT = 10
+LOCK_WAIT = 5.0
+LOCK_INTERVAL = 0.01
+
+PRICES_KEY = "store:cart:prices"
+
+
+class CartLocked(Exception):
+    """The cart stayed locked by another request for too long."""
+
+
+class InvalidChanges(ValueError):
+    """A batch of cart changes that cannot be applied."""
+
+
+class CartLine:
+    """One product in a cart, as the cart template shows it."""
+
+    def __init__(self, product, quantity):
+        self.product = product
+        self.quantity = quantity
+
+    @property
+    def get_total_price(self):
+        return self.quantity * self.product.price
+
+
+class BaseCartBackend:
+    """
+    Cart operations on top of three storage primitives: ``load``, ``store``
+    and ``lock``. Subclasses keeping the cart outside the database persist
+    it with ``flush``.
+    """
+
+    def load(self, user_id):
+        """The stored ``{product id: quantity}``, or ``None`` if not held."""
+        raise NotImplementedError
+
+    def store(self, user_id, items):
+        raise NotImplementedError
+
+    def lock(self, user_id):
+        raise NotImplementedError
+
+    # reads
+
+    def items(self, user_id):
+        items = self.load(user_id)
+        if items is None:
+            items = load_from_database(user_id)
+            self.store(user_id, items)
+        return items
+
+    def lines(self, user_id):
+        """``CartLine``s of the cart, in the order products were added."""
+        from .models import Product
+
+        items = self.items(user_id)
+        products = Product.objects.in_bulk(list(items))
+        return [
+            CartLine(products[product_id], quantity)
+            for product_id, quantity in items.items()
+            if product_id in products
+        ]
+
+    # writes
+
+    def _update(self, user_id, change):
+        with self.lock(user_id):
+            old = self.items(user_id)
+            items = dict(old)
+            result = change(items)
+            if result:
+                self.store(user_id, items)
+                self.summary_changed(user_id, old, items)
+                self.changed(user_id)
+            return result
+
+    def add(self, user_id, product_id, quantity):
+        """Add a product that is not in the cart yet; ``False`` if it is."""
+
+        def change(items):
+            if product_id in items:
+                return False
+            items[product_id] = quantity
+            return True
+
+        return self._update(user_id, change)
+
+    def set_quantity(self, user_id, product_id, quantity):
+        """``False`` if the product is not in the cart."""
+
+        def change(items):
+            if product_id not in items:
+                return False
+            items[product_id] = quantity
+            return True
+
+        return self._update(user_id, change)
+
+    def remove(self, user_id, product_id):
+        """``False`` if the product is not in the cart."""
+        return self._update(
+            user_id, lambda items: items.pop(product_id, None) is not None
+        )
+
+    def apply(self, user_id, changes, replace=False):
+        """
+        Apply ``{product id: quantity}`` changes at once: quantities are added
+        to the cart's, or replace them with ``replace``. Products ending up
+        at zero or less leave the cart. Returns the cart's items.
+        """
+
+        result = {}
+
+        def change(items):
+            for product_id, quantity in changes.items():
+                if not replace:
+                    quantity += items.get(product_id, 0)
+                if quantity > 0:
+                    items[product_id] = quantity
+                else:
+                    items.pop(product_id, None)
+            result.update(items)
+            return True
+
+        self._update(user_id, change)
+        return result
+
+    # summary
+
+    def _summary_key(self, user_id):
+        return f"store:cart:{user_id}:summary"
+
+    def summary(self, user_id):
+        """``{"count": .., "total": ..}`` of the cart, from the cache."""
+        if not cache_is_shared():
+            # another process may have changed the cart since it was cached
+            return stored_summary(user_id, lambda: self.items(user_id))
+
+        key = self._summary_key(user_id)
+        cached = cache.get_many([key, PRICES_KEY])
+        summary = cached.get(key)
+        if summary is not None and summary["prices"] == cached.get(PRICES_KEY):
+            return summary
+
+        summary = {**summarize(self.items(user_id)), "prices": prices_version()}
+        cache.set(key, summary, timeout=settings.CART_CACHE_TIMEOUT)
+        return summary
+
+    def summary_changed(self, user_id, old, new):
+        """Adjust the cached summary for a change of the cart from ``old`` to ``new``."""
+        delta = {
+            product_id: new.get(product_id, 0) - old.get(product_id, 0)
+            for product_id in old.keys() | new.keys()
+            if new.get(product_id, 0) != old.get(product_id, 0)
+        }
+        if not delta:
+            return
+        if not cache_is_shared():
+            forget_stored_summary(user_id)
+            return
+
+        key = self._summary_key(user_id)
+        cached = cache.get_many([key, PRICES_KEY])
+        summary = cached.get(key)
+        if summary is None or summary["prices"] != cached.get(PRICES_KEY):
+            # worked out in full on the next read
+            cache.delete(key)
+            return
+        change = summarize(delta)
+        summary = {
+            "count": summary["count"] + change["count"],
+            "total": summary["total"] + change["total"],
+            "prices": summary["prices"],
+        }
+        cache.set(key, summary, timeout=settings.CART_CACHE_TIMEOUT)
+
+    def forget_summary(self, user_id):
+        if cache_is_shared():
+            cache.delete(self._summary_key(user_id))
+        else:
+            forget_stored_summary(user_id)
+
+    # persistence
+
+    def changed(self, user_id):
+        """
+        Schedule a write-behind of the cart, at most one pending per user.
+        The task could not see a per-process cache, so without a shared one
+        the cart is written straight away.
+        """
+        from .tasks import persist_cart_task
+
+        if not cache_is_shared():
+            save_to_database(user_id, self.load(user_id))
+            return
+
+        delay = settings.CART_WRITE_BEHIND_DELAY
+        if cache.add(f"store:cart:{user_id}:flush", 1, timeout=delay + LOCK_TIMEOUT):
+            transaction.on_commit(lambda: persist_cart_task(user_id, schedule=delay))
+
+    def flush(self, user_id):
+        """Write the held cart to ``CartProduct``."""
+        cache.delete(f"store:cart:{user_id}:flush")
+        with self.lock(user_id):
+            items = self.load(user_id)
+            if items is not None:
+                save_to_database(user_id, items)
+
+    @contextmanager
+    def checkout(self, user_id):
+        """
+        Lock the cart, persist it and yield its ``{product id: quantity}``.
+        The block writes the order (reading ``CartProduct`` if it likes) and
+        empties ``CartProduct``; the held cart is emptied with it when the
+        block completes.
+        """
+        with self.lock(user_id):
+            items = self.items(user_id)
+            save_to_database(user_id, items)
+            yield dict(items)
+            self.store(user_id, {})
+            self.summary_changed(user_id, items, {})
+
+
+class CacheCartBackend(BaseCartBackend):
+    def _key(self, user_id):
+        return f"store:cart:{user_id}"
+
+    def load(self, user_id):
+        return cache.get(self._key(user_id))
+
+    def store(self, user_id, items):
+        cache.set(self._key(user_id), items, timeout=settings.CART_CACHE_TIMEOUT)
+
+    @contextmanager
+    def lock(self, user_id):
+        key, token = f"{self._key(user_id)}:lock", uuid.uuid4().hex
+        deadline = time.monotonic() + LOCK_WAIT
+        while not cache.add(key, token, timeout=LOCK_TIMEOUT):
+            if time.monotonic() > deadline:
+                raise CartLocked(user_id)
+            time.sleep(LOCK_INTERVAL)
+        try:
+            yield
+        finally:
+            if cache.get(key) == token:
+                cache.delete(key)
+
+
+class InMemoryCartBackend(BaseCartBackend):
+    def __init__(self):
+        self.carts = {}
+        self._guard = threading.Lock()
+        self._locks = {}
+
+    def load(self, user_id):
+        items = self.carts.get(user_id)
+        return dict(items) if items is not None else None
+
+    def store(self, user_id, items):
+        self.carts[user_id] = dict(items)
+
+    def changed(self, user_id):
+        pass
+
+    def lock(self, user_id):
+        with self._guard:
+            return self._locks.setdefault(user_id, threading.RLock())
+
+
+class DatabaseCartBackend(BaseCartBackend):
+    """No cart held outside the database; every operation reads ``CartProduct``."""
+
+    def load(self, user_id):
+        return load_from_database(user_id)
+
+    def items(self, user_id):
+        return self.load(user_id)
+
+    def store(self, user_id, items):
+        save_to_database(user_id, items)
+
+    def changed(self, user_id):
+        pass
+
+    def flush(self, user_id):
+        pass
+
+    def lock(self, user_id):
+        return _locked_cart_row(user_id)
+
+    def apply(self, user_id, changes, replace=False):
+        with self.lock(user_id):
+            apply_to_database(user_id, changes, replace)
+            self.forget_summary(user_id)
+            return self.items(user_id)
+
+
+class SignedCookieCartBackend(BaseCartBackend):
+    """
+    The cart of one anonymous visitor, read from the ``CART_COOKIE_NAME``
+    cookie. One instance lives for one request; ``AnonymousCartMiddleware``
+    writes the cookie back if the cart changed. ``user_id`` is ignored.
+    """
+
+    def __init__(self, request):
+        self.held = read_cookie(request)
+        self.modified = False
+
+    def load(self, user_id):
+        return dict(self.held)
+
+    def store(self, user_id, items):
+        if len(items) > settings.CART_COOKIE_MAX_ITEMS:
+            raise InvalidChanges(
+                f"at most {settings.CART_COOKIE_MAX_ITEMS} products fit in the cart, "
+                "log in to add more"
+            )
+        self.held = dict(items)
+        self.modified = True
+
+    def lock(self, user_id):
+        return nullcontext()
+
+    def changed(self, user_id):
+        pass
+
+    def flush(self, user_id):
+        pass
+
+    def checkout(self, user_id):
+        raise NotImplementedError("anonymous carts are merged before checkout")
+
+    def summary(self, user_id):
+        # nowhere to keep it between requests; one query, and only for a
+        # visitor with something in the cart
+        return summarize(self.held)
+
+    def summary_changed(self, user_id, old, new):
+        pass
+
+    def save(self, response):
+        if not self.modified:
+            return
+        if self.held:
+            response.set_signed_cookie(
+                settings.CART_COOKIE_NAME,
+                signing.dumps(list(self.held.items()), compress=True),
+                salt=COOKIE_SALT,
+                max_age=settings.CART_COOKIE_AGE,
+                httponly=True,
+                samesite="Lax",
+                secure=settings.SESSION_COOKIE_SECURE,
+            )
+        else:
+            response.delete_cookie(settings.CART_COOKIE_NAME, samesite="Lax")
+
+
+COOKIE_SALT = "store.carts.cookie"
+
+
+def read_cookie(request):
+    """The ``{product id: quantity}`` in the visitor's cart cookie, or ``{}``."""
+    value = request.get_signed_cookie(
+        settings.CART_COOKIE_NAME,
+        default=None,
+        salt=COOKIE_SALT,
+        max_age=settings.CART_COOKIE_AGE,
+    )
+    if value is None:
+        return {}
+    try:
+        return {
+            int(product_id): int(quantity)
+            for product_id, quantity in signing.loads(value)
+            if int(quantity) > 0
+        }
+    except (signing.BadSignature, TypeError, ValueError):
+        return {}
+
+
+def anonymous_cart(request):
+    """The ``SignedCookieCartBackend`` of ``request``, created on first use."""
+    if not hasattr(request, "_anonymous_cart"):
+        request._anonymous_cart = SignedCookieCartBackend(request)
+    return request._anonymous_cart
+
+
+def for_request(request):
+    """The backend holding the cart of whoever made ``request``."""
+    if request.user.is_authenticated:
+        return get_backend()
+    return anonymous_cart(request)
+
+
+def request_summary(request):
+    """
+    The summary of the cart of whoever made ``request``, worked out once per
+    request for the conditional GET checks and the navbar alike.
+    """
+    if not hasattr(request, "_cart_summary"):
+        request._cart_summary = for_request(request).summary(request.user.pk)
+    return request._cart_summary
+
+
+def merge_anonymous_cart(request, user):
+    """
+    Add the cart a visitor filled before logging in to ``user``'s cart and
+    empty the cookie. Products gone from the catalog are dropped.
+    """
+    from .models import Product
+
+    cart = anonymous_cart(request)
+    items = cart.load(None)
+    if not items:
+        return
+    existing = set(Product.objects.filter(pk__in=items).values_list("pk", flat=True))
+    changes = {pk: quantity for pk, quantity in items.items() if pk in existing}
+    if changes:
+        get_backend().apply(user.pk, changes)
+    cart.store(None, {})
+
+
+@contextmanager
+def _locked_cart_row(user_id):
+    from .models import Cart
+
+    with transaction.atomic():
+        Cart.objects.get_or_create(user_id=user_id)
+        Cart.objects.select_for_update().filter(user_id=user_id).first()
+        yield
+
+
+def load_from_database(user_id):
+    from .models import CartProduct
+
+    return dict(
+        CartProduct.objects.filter(cart__user_id=user_id)
+        .order_by("added_at", "pk")
+        .values_list("product_id", "quantity")
+    )
+
+
+def save_to_database(user_id, items):
+    """Make the user's ``CartProduct`` rows match ``items``."""
+    from .models import Cart, CartProduct
+
+    with transaction.atomic():
+        cart, _ = Cart.objects.get_or_create(user_id=user_id)
+        CartProduct.objects.filter(cart=cart).exclude(product_id__in=items).delete()
+        _upsert(cart, items)
+
+
+def apply_to_database(user_id, changes, replace=False):
+    """
+    ``BaseCartBackend.apply`` on ``CartProduct``, in a fixed number of
+    queries however many products change: one upsert (plus one ``F()``
+    increment when adding) and one delete of the rows left at zero or less.
+    """
+    from .models import Cart, CartProduct
+
+    with transaction.atomic():
+        cart, _ = Cart.objects.get_or_create(user_id=user_id)
+        rows = CartProduct.objects.filter(cart=cart)
+        if replace:
+            _upsert(cart, {pk: qty for pk, qty in changes.items() if qty > 0})
+            rows.filter(
+                product_id__in=[pk for pk, qty in changes.items() if qty <= 0]
+            ).delete()
+            return
+
+        # new rows start at zero and get the increment like existing ones;
+        # taking from a product not in the cart leaves nothing to create
+        CartProduct.objects.bulk_create(
+            [
+                CartProduct(cart=cart, product_id=pk, quantity=0)
+                for pk, qty in changes.items()
+                if qty > 0
+            ],
+            ignore_conflicts=True,
+        )
+        # clamped at zero, so taking away more than there is does not break
+        # the positive quantity check before the delete below
+        rows.filter(product_id__in=changes).update(
+            quantity=Greatest(
+                F("quantity")
+                + Case(
+                    *[When(product_id=pk, then=qty) for pk, qty in changes.items()],
+                    default=0,
+                ),
+                0,
+            )
+        )
+        rows.filter(quantity__lte=0).delete()
+
+
+def _upsert(cart, items):
+    from .models import CartProduct
+
+    CartProduct.objects.bulk_create(
+        [
+            CartProduct(cart=cart, product_id=product_id, quantity=quantity)
+            for product_id, quantity in items.items()
+        ],
+        update_conflicts=True,
+        unique_fields=["cart", "product"],
+        update_fields=["quantity"],
+    )
+
+
+def parse_changes(lines, replace=False):
+    """
+    ``{product id: quantity}`` from ``[{"product_id": .., "quantity": ..}]``,
+    checked against the catalog in one query. Repeated products add up,
+    unless ``replace``, where the last quantity wins.
+    """
+    from .models import Product
+
+    if not isinstance(lines, list) or not lines:
+        raise InvalidChanges("items must be a non-empty list")
+    if len(lines) > settings.CART_BATCH_MAX_ITEMS:
+        raise InvalidChanges(
+            f"at most {settings.CART_BATCH_MAX_ITEMS} items can be changed at once"
+        )
+
+    changes = {}
+    for line in lines:
+        try:
+            product_id, quantity = line["product_id"], line["quantity"]
+        except (KeyError, TypeError):
+            raise InvalidChanges("each item needs a product_id and a quantity")
+        if not isinstance(product_id, int) or not isinstance(quantity, int):
+            raise InvalidChanges("product_id and quantity must be integers")
+        if replace:
+            if quantity < 0:
+                raise InvalidChanges("quantity cannot be negative")
+            changes[product_id] = quantity
+        else:
+            changes[product_id] = changes.get(product_id, 0) + quantity
+
+    unknown = set(changes) - set(
+        Product.objects.filter(pk__in=changes).values_list("pk", flat=True)
+    )
+    if unknown:
+        raise InvalidChanges(
+            f"unknown product(s): {', '.join(map(str, sorted(unknown)))}"
+        )
+    return changes
+
+
+def summarize(items):
+    """
+    ``{"count": .., "total": ..}`` of ``{product id: quantity}`` at current
+    prices, in one query. Products no longer in the catalog don't count.
+    """
+    from .models import Product
+
+    if not items:
+        return {"count": 0, "total": Decimal(0)}
+    prices = dict(Product.objects.filter(pk__in=items).values_list("pk", "price"))
+    return {
+        "count": sum(
+            quantity for product_id, quantity in items.items() if product_id in prices
+        ),
+        "total": sum(
+            (
+                prices[product_id] * quantity
+                for product_id, quantity in items.items()
+                if product_id in prices
+            ),
+            Decimal(0),
+        ),
+    }
+
+
+def stored_summary(user_id, items):
+    """
+    The summary kept on the user's ``Cart`` row, worked out from ``items()``
+    and stored there again if it is missing or from another catalog version.
+    """
+    from .models import Cart
+
+    version = catalog.get_version()
+    row = (
+        Cart.objects.filter(user_id=user_id)
+        .values_list("summary_count", "summary_total", "summary_version", "revision")
+        .first()
+    )
+    if row is not None and row[2] == version:
+        return {"count": row[0], "total": row[1]}
+
+    summary = summarize(items())
+    if row is not None:
+        # stored only if the cart has not changed since the row was read
+        Cart.objects.filter(user_id=user_id, revision=row[3]).update(
+            summary_count=summary["count"],
+            summary_total=summary["total"],
+            summary_version=version,
+        )
+    return summary
+
+
+def forget_stored_summary(user_id):
+    from .models import Cart
+
+    Cart.objects.filter(user_id=user_id).update(
+        summary_version=None, revision=F("revision") + 1
+    )
+
+
+def prices_version():
+    version = cache.get(PRICES_KEY)
+    if version is None:
+        cache.add(PRICES_KEY, time.time_ns(), timeout=None)
+        version = cache.get(PRICES_KEY)
+    return version
+
+
+def prices_changed():
+    """Let every cached cart summary be worked out again at current prices."""
+    try:
+        cache.incr(PRICES_KEY)
+    except ValueError:
+        cache.set(PRICES_KEY, time.time_ns(), timeout=None)
+
+
+_backend = None
+
+
+def get_backend():
+    """The configured cart backend, created once per process."""
+    global _backend
+
+    if _backend is None:
+        _backend = import_string(settings.CART_BACKEND)()
+    return _backend
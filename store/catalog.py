@@ -0,0 +1,61 @@
+"""
+Shared catalog version.
+
+Per-process catalog structures (facet bitmaps, ...) are stamped with the
+version they were built from. Product and category receivers in
+``store.signals`` bump the version after commit, and every worker rebuilds
+its copy the next time it notices the number has moved.
+
+The version is kept in the database (``CatalogVersion``), so a change made
+by any process is seen by all of them: other web workers, ``manage.py``
+commands and the task worker. Processes read it through the cache, for at
+most ``VERSION_CACHE_TIMEOUT`` seconds: the process that bumped it (with a
+shared cache, every process) sees a new version at once, the others within
+that time.
+"""
+
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
+
+VERSION_KEY = "store:catalog:version"
+VERSION_CACHE_TIMEOUT = 5
+
+
+def _initial_version():
+    # a fresh, time based starting point, so a new database is never
+    # mistaken for the one an old structure was built from
+    return int(time.time() * 1000)
+
+
+def _read_version():
+    from .models import CatalogVersion
+
+    version, _ = CatalogVersion.objects.get_or_create(
+        pk=1, defaults={"value": _initial_version()}
+    )
+    return version.value
+
+
+def get_version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        version = _read_version()
+        cache.set(VERSION_KEY, version, timeout=VERSION_CACHE_TIMEOUT)
+    return version
+
+
+def bump_version():
+    """Mark the catalog as changed and return the new version."""
+    from .models import CatalogVersion
+
+    with transaction.atomic():
+        if not CatalogVersion.objects.filter(pk=1).update(value=F("value") + 1):
+            _read_version()
+            CatalogVersion.objects.filter(pk=1).update(value=F("value") + 1)
+        # the row stays locked until commit, so this is our increment
+        version = CatalogVersion.objects.get(pk=1).value
+    cache.set(VERSION_KEY, version, timeout=VERSION_CACHE_TIMEOUT)
+    return version
@@ -0,0 +1,215 @@
+"""
+Bulk product import from CSV or JSON Lines.
+
+Rows are streamed from the file and written a batch at a time: one
+``bulk_create(update_conflicts=True)`` upserts the batch's products on
+``sku``, and its category links are replaced with one delete and one
+``bulk_create`` on the through table. Category names are resolved from an
+in-memory map, creating the missing ones, so memory stays bounded by the
+batch size and the number of categories, not the size of the file.
+
+Columns / keys: ``sku``, ``name`` and ``price`` (required),
+``description``, ``featured``, ``image`` (a name in media storage) and
+``categories`` (a list in JSON Lines, ``|``-separated in CSV). Optional
+columns missing from a row leave an existing product's values as they are.
+
+``bulk_create`` skips model signals, so the search index is updated per
+batch here and the catalog moves to a new version once at the end.
+"""
+
+import csv
+import json
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+
+from django.db import transaction
+
+from . import search
+from .models import Category, Product
+
+# written for every row; the optional ones only when the row has them
+REQUIRED_FIELDS = ["name", "price", "updated_at"]
+OPTIONAL_FIELDS = ["description", "featured", "image"]
+CATEGORY_SEPARATOR = "|"
+TRUE_VALUES = {"1", "true", "yes", "y", "t"}
+
+
+class InvalidRow(ValueError):
+    pass
+
+
+class ImportResult:
+    def __init__(self):
+        self.rows = 0
+        self.imported = 0
+        # (line number, message) of the rows that were skipped
+        self.errors = []
+
+
+def read_rows(file, format):
+    """Yield ``(line number, row dict)`` from an open text file."""
+    if format == "csv":
+        reader = csv.DictReader(file)
+        for row in reader:
+            yield reader.line_num, row
+    else:
+        for line_number, line in enumerate(file, start=1):
+            if not line.strip():
+                continue
+            try:
+                yield line_number, json.loads(line)
+            except json.JSONDecodeError as error:
+                yield line_number, InvalidRow(f"invalid JSON: {error.msg}")
+
+
+def _categories(value):
+    if not value:
+        return []
+    if isinstance(value, str):
+        value = value.split(CATEGORY_SEPARATOR)
+    return [name.strip() for name in value if name and name.strip()]
+
+
+def _featured(value):
+    if isinstance(value, bool):
+        return value
+    return str(value or "").strip().lower() in TRUE_VALUES
+
+
+def parse_row(row):
+    """
+    ``(Product, category names, fields to update)`` for one input row. The
+    category names are ``None`` when the row has no ``categories``.
+    """
+    if isinstance(row, Exception):
+        raise row
+    if not isinstance(row, dict):
+        raise InvalidRow("expected an object")
+
+    sku = str(row.get("sku") or "").strip()
+    name = str(row.get("name") or "").strip()
+    if not sku:
+        raise InvalidRow("sku is required")
+    if not name:
+        raise InvalidRow("name is required")
+    if len(name) > Product._meta.get_field("name").max_length:
+        raise InvalidRow("name is too long")
+
+    if row.get("price") in (None, ""):
+        raise InvalidRow("price is required")
+    try:
+        price = Decimal(str(row["price"])).quantize(Decimal("0.01"))
+    except InvalidOperation:
+        raise InvalidRow(f"invalid price {row.get('price')!r}")
+    if price < 0:
+        raise InvalidRow("price can't be negative")
+
+    product = Product(
+        sku=sku,
+        name=name,
+        price=price,
+        description=row.get("description") or None,
+        featured=_featured(row.get("featured")),
+        image=row.get("image") or "",
+    )
+    fields = tuple(REQUIRED_FIELDS + [f for f in OPTIONAL_FIELDS if f in row])
+    categories = _categories(row["categories"]) if "categories" in row else None
+    return product, categories, fields
+
+
+class CategoryMap:
+    """Category ids by case-insensitive name, creating unknown ones."""
+
+    def __init__(self):
+        self.ids = {}
+        for pk, name in Category.objects.order_by("-pk").values_list("pk", "name"):
+            self.ids[name.lower()] = pk
+
+    def __getitem__(self, name):
+        return self.ids[name.lower()]
+
+    def add(self, names):
+        missing = {name.lower(): name for name in names if name.lower() not in self.ids}
+        if missing:
+            created = Category.objects.bulk_create(
+                [Category(name=name) for name in missing.values()]
+            )
+            if any(category.pk is None for category in created):
+                # backends that don't return ids from bulk inserts
+                created = Category.objects.filter(name__in=missing.values())
+            for category in created:
+                self.ids.setdefault(category.name.lower(), category.pk)
+
+
+def import_products(rows, batch_size=1000, progress=None):
+    """
+    Upsert products from ``rows`` (see ``read_rows``). ``progress`` is called
+    with the running ``ImportResult`` after every batch.
+    """
+    result = ImportResult()
+    category_map = CategoryMap()
+    rows = iter(rows)
+
+    while batch := list(islice(rows, batch_size)):
+        products = {}
+        for line_number, row in batch:
+            result.rows += 1
+            try:
+                product, categories, fields = parse_row(row)
+            except InvalidRow as error:
+                result.errors.append((line_number, str(error)))
+                continue
+            # the last row wins when a sku repeats within a batch
+            products[product.sku] = (product, categories, fields)
+
+        if products:
+            _write_batch(products, category_map)
+            result.imported += len(products)
+
+        if progress is not None:
+            progress(result)
+
+    if result.imported:
+        from .signals import catalog_changed
+
+        catalog_changed(None)
+    return result
+
+
+def _write_batch(products, category_map):
+    # one upsert per set of columns, so missing ones are not overwritten
+    by_fields = {}
+    for product, _, fields in products.values():
+        by_fields.setdefault(fields, []).append(product)
+    categorized = {
+        sku: names for sku, (_, names, _) in products.items() if names is not None
+    }
+
+    with transaction.atomic():
+        for fields, group in by_fields.items():
+            Product.objects.bulk_create(
+                group,
+                update_conflicts=True,
+                unique_fields=["sku"],
+                update_fields=list(fields),
+            )
+        ids = dict(Product.objects.filter(sku__in=products).values_list("sku", "pk"))
+
+        category_map.add({name for names in categorized.values() for name in names})
+        through = Product.categories.through
+        through.objects.filter(
+            product_id__in=[ids[sku] for sku in categorized]
+        ).delete()
+        links = {
+            (ids[sku], category_map[name])
+            for sku, names in categorized.items()
+            for name in names
+        }
+        through.objects.bulk_create(
+            [
+                through(product_id=product_id, category_id=category_id)
+                for product_id, category_id in links
+            ]
+        )
+
+        search.index_products(ids.values())
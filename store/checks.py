@@ -0,0 +1,21 @@
+from django.conf import settings
+from django.core.checks import Warning, register
+from django.utils.module_loading import import_string
+
+
+@register()
+def check_cart_backend(app_configs, **kwargs):
+    from .carts import CacheCartBackend
+    from .utils import cache_is_shared
+
+    backend = import_string(settings.CART_BACKEND)
+    if issubclass(backend, CacheCartBackend) and not cache_is_shared():
+        return [
+            Warning(
+                "CacheCartBackend keeps carts in the default cache, which is "
+                "not shared between processes: each process sees its own cart.",
+                hint="Set REDIS_URL, or use store.carts.DatabaseCartBackend.",
+                id="store.W001",
+            )
+        ]
+    return []
@@ -0,0 +1,109 @@
+"""
+Conditional GET (``ETag`` / ``Last-Modified``) for catalog pages and APIs.
+
+Validators are derived from the catalog version (see ``store.catalog``),
+which moves whenever a product or category changes, and from product
+``updated_at`` timestamps. Working them out costs a cache read and at most
+one ``MAX(updated_at)`` or single-row query, so a repeat visit gets a
+``304 Not Modified`` without rendering anything.
+
+HTML pages also show who is logged in, their cart summary and a CSRF
+token, so their ETags include the user, the summary and the CSRF cookie,
+and they are marked ``private``. Pages with pending flash messages are never answered with a
+304, so the messages are not lost behind a cached copy.
+"""
+
+import hashlib
+
+from django.contrib.messages import get_messages
+from django.db.models import Max
+from django.middleware.csrf import get_token
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
+
+from . import carts, catalog
+
+
+def _digest(*parts):
+    return hashlib.sha256(
+        "\x1f".join(str(part) for part in parts).encode()
+    ).hexdigest()[:32]
+
+
+def _viewer(request):
+    # asked for by both the ETag and the Last-Modified check; worked out once
+    if not hasattr(request, "_conditional_viewer"):
+        request._conditional_viewer = _work_out_viewer(request)
+    return request._conditional_viewer
+
+
+def _work_out_viewer(request):
+    if get_messages(request):
+        return None
+    # get_token hands out a freshly masked token; the cookie secret is stable
+    get_token(request)
+    summary = carts.request_summary(request)
+    return (
+        request.user.pk or "",
+        request.META["CSRF_COOKIE"],
+        summary["count"],
+        summary["total"],
+    )
+
+
+def catalog_last_modified(request, *args, **kwargs):
+    from .models import Product
+
+    return Product.objects.aggregate(last=Max("updated_at"))["last"]
+
+
+def catalog_etag(request, *args, **kwargs):
+    """ETag of a page that depends on the whole catalog and the query string."""
+    viewer = _viewer(request)
+    if viewer is None:
+        return None
+    return _digest(
+        request.path, catalog.get_version(), request.GET.urlencode(), *viewer
+    )
+
+
+def product_last_modified(request, pk):
+    from .models import Product
+
+    return Product.objects.filter(pk=pk).values_list("updated_at", flat=True).first()
+
+
+def product_etag(request, pk):
+    # the page also lists related products, which the catalog version covers
+    viewer = _viewer(request)
+    if viewer is None:
+        return None
+    return _digest(request.path, catalog.get_version(), *viewer)
+
+
+def api_etag(request, *args, **kwargs):
+    """ETag of a public catalog API response: the same for every user."""
+    return _digest(request.path, catalog.get_version(), request.GET.urlencode())
+
+
+def conditional_page(etag_func, last_modified_func=None):
+    """
+    ``condition`` for a user-facing page: the browser keeps a private copy
+    and revalidates it on every visit.
+    """
+
+    def page_last_modified(request, *args, **kwargs):
+        if last_modified_func is None or _viewer(request) is None:
+            return None
+        return last_modified_func(request, *args, **kwargs)
+
+    def decorator(view):
+        view = condition(etag_func=etag_func, last_modified_func=page_last_modified)(
+            view
+        )
+        return cache_control(private=True, no_cache=True)(view)
+
+    return decorator
+
+
+conditional_api = condition(etag_func=api_etag)
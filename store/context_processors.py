@@ -0,0 +1,12 @@
+from django.utils.functional import SimpleLazyObject
+
+from . import carts
+
+
+def cart_summary(request):
+    """
+    ``cart_summary`` (``{"count": .., "total": ..}``) for the navbar. Read
+    from the cache for logged in users, or with one query from their
+    ``Cart`` row without a shared cache, and shared with the ETag check.
+    """
+    return {"cart_summary": SimpleLazyObject(lambda: carts.request_summary(request))}
@@ -0,0 +1,184 @@
+"""
+Streaming catalog and order exports, as CSV or JSON Lines.
+
+Rows are read with server-side cursors (``QuerySet.iterator``) and encoded
+one at a time, so an export holds a single chunk of rows in memory however
+large it gets; product categories are looked up per chunk.
+
+Exports are incremental on ``updated_at``: an export covers rows updated in
+``(since, until]`` where ``until`` is the time the export started, and
+``until`` is handed back as the watermark to pass as ``since`` next time.
+Rows touched while the export runs fall after the watermark and go out with
+the next one.
+
+Under ASGI, Django reads a sync iterator of a streaming response into a
+list before sending it, so ASGI requests get ``astream``, which reads the
+same lines in a thread ``CHUNK_SIZE`` at a time.
+"""
+
+import csv
+import json
+from datetime import datetime
+from itertools import batched, islice
+
+from asgiref.sync import sync_to_async
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import OrderItem, Product
+
+CHUNK_SIZE = 2000
+FORMATS = {
+    "csv": "text/csv; charset=utf-8",
+    "jsonl": "application/x-ndjson",
+}
+
+PRODUCT_FIELDS = [
+    "id",
+    "sku",
+    "name",
+    "price",
+    "description",
+    "featured",
+    "image",
+    "rating_average",
+    "rating_count",
+    "categories",
+    "created_at",
+    "updated_at",
+]
+
+# one row per order line, with its order's fields repeated
+ORDER_FIELDS = [
+    ("order_id", "order__order_id"),
+    ("status", "order__status"),
+    ("customer_email", "order__user__email"),
+    ("subtotal", "order__subtotal"),
+    ("tax", "order__tax"),
+    ("shipping_cost", "order__shipping_cost"),
+    ("total", "order__total"),
+    ("created_at", "order__created_at"),
+    ("updated_at", "order__updated_at"),
+    ("item_id", "id"),
+    ("product_id", "product_id"),
+    ("sku", "product__sku"),
+    ("product_name", "product_name"),
+    ("price", "price"),
+    ("quantity", "quantity"),
+]
+
+
+class InvalidWatermark(ValueError):
+    pass
+
+
+def parse_watermark(value):
+    """``since``/``until`` from an ISO 8601 string; ``None`` for no bound."""
+    if not value:
+        return None
+    moment = parse_datetime(value)
+    if moment is None:
+        raise InvalidWatermark(value)
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+def _window(queryset, field, since, until):
+    queryset = queryset.filter(**{f"{field}__lte": until})
+    if since is not None:
+        queryset = queryset.filter(**{f"{field}__gt": since})
+    return queryset
+
+
+def product_rows(since=None, until=None, chunk_size=CHUNK_SIZE):
+    """Yield one dict per product updated in ``(since, until]``."""
+    until = until or timezone.now()
+    fields = [field for field in PRODUCT_FIELDS if field != "categories"]
+    products = _window(Product.objects.all(), "updated_at", since, until)
+    rows = (
+        products.order_by("updated_at", "pk")
+        .values_list(*fields)
+        .iterator(chunk_size=chunk_size)
+    )
+    through = Product.categories.through
+
+    for chunk in batched(rows, chunk_size):
+        categories = {}
+        for product_id, name in through.objects.filter(
+            product_id__in=[row[0] for row in chunk]
+        ).values_list("product_id", "category__name"):
+            categories.setdefault(product_id, []).append(name)
+
+        for row in chunk:
+            product = dict(zip(fields, row))
+            product["categories"] = sorted(categories.get(product["id"], []))
+            yield product
+
+
+def order_rows(since=None, until=None, chunk_size=CHUNK_SIZE):
+    """Yield one dict per order line of the orders updated in ``(since, until]``."""
+    until = until or timezone.now()
+    items = _window(OrderItem.objects.all(), "order__updated_at", since, until)
+    rows = (
+        items.order_by("order__updated_at", "order_id", "pk")
+        .values_list(*[lookup for _, lookup in ORDER_FIELDS])
+        .iterator(chunk_size=chunk_size)
+    )
+    names = [name for name, _ in ORDER_FIELDS]
+    for row in rows:
+        yield dict(zip(names, row))
+
+
+def _text(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, list):
+        return "|".join(value)
+    if value is None:
+        return ""
+    return str(value)
+
+
+class _Echo:
+    """A file-like sink handing ``csv.writer`` output straight back."""
+
+    def write(self, value):
+        return value
+
+
+def encode(rows, fields, format):
+    """Yield ``rows`` (dicts) as lines of CSV with a header, or of JSON."""
+    if format == "csv":
+        writer = csv.writer(_Echo())
+        yield writer.writerow(fields)
+        for row in rows:
+            yield writer.writerow([_text(row[field]) for field in fields])
+    else:
+        for row in rows:
+            yield json.dumps(row, cls=DjangoJSONEncoder, separators=(",", ":")) + "\n"
+
+
+EXPORTS = {
+    "products": (product_rows, PRODUCT_FIELDS),
+    "orders": (order_rows, [name for name, _ in ORDER_FIELDS]),
+}
+
+
+def stream(kind, format, since=None, until=None):
+    """Encoded lines of the ``kind`` export (a key of ``EXPORTS``)."""
+    rows, fields = EXPORTS[kind]
+    return encode(rows(since, until), fields, format)
+
+
+async def astream(kind, format, since=None, until=None, lines=CHUNK_SIZE):
+    """``stream`` as an async iterator, ``lines`` lines to a chunk."""
+    encoded = stream(kind, format, since, until)
+    # thread-sensitive, so the server-side cursor stays on one connection
+    take = sync_to_async(lambda: "".join(islice(encoded, lines)))
+    try:
+        while chunk := await take():
+            yield chunk
+    finally:
+        await sync_to_async(encoded.close)()
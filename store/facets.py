@@ -0,0 +1,279 @@
+"""
+Facet counts for the product listing.
+
+Every worker keeps a bitmap index of the catalog: one bit per product id for
+the whole catalog, for each category, each price bucket and each whole-star
+rating. Counting the
+hits of a facet under the current filters is an AND plus a popcount, so the
+listing gets per-category counts and a price histogram without querying the
+Product table.
+
+The index is built once per catalog version (see ``store.catalog``) and
+patched in place for products changed by this process.
+"""
+
+import threading
+from array import array
+from bisect import bisect_left, bisect_right, insort
+from decimal import Decimal
+
+from django.conf import settings
+
+from . import catalog
+
+
+def to_cents(price):
+    return int(Decimal(price) * 100)
+
+
+def bitmap_from_ids(ids):
+    ids = list(ids)
+    if not ids:
+        return 0
+    buffer = bytearray(max(ids) // 8 + 1)
+    for pk in ids:
+        buffer[pk >> 3] |= 1 << (pk & 7)
+    return int.from_bytes(buffer, "little")
+
+
+class FacetIndex:
+    def __init__(self, version, bucket_edges):
+        self.version = version
+        # lower bound of each price bucket, in cents, ascending from 0
+        self.edges = [to_cents(edge) for edge in bucket_edges]
+        self.products = 0
+        self.categories = {}
+        self.buckets = [0] * len(self.edges)
+        # (cents, pk) pairs per bucket, sorted, to cut buckets at arbitrary prices
+        self.bucket_prices = [[] for _ in self.edges]
+        # price in cents by product id, -1 for no product
+        self.prices = array("q")
+        # products by whole stars of their average rating (0 for unrated)
+        self.ratings = [0] * 6
+        self.stars = array("b")
+
+    @classmethod
+    def build(cls, version):
+        from .models import Product
+
+        index = cls(version, settings.FACET_PRICE_BUCKETS)
+        rows = Product.objects.values_list("pk", "price", "rating_average").order_by(
+            "pk"
+        )
+        members = Product.categories.through.objects.values_list(
+            "product_id", "category_id"
+        )
+
+        bucket_ids = [[] for _ in index.edges]
+        rating_ids = [[] for _ in index.ratings]
+        for pk, price, rating in rows.iterator(chunk_size=5000):
+            cents = to_cents(price)
+            bucket = index.bucket_of(cents)
+            bucket_ids[bucket].append(pk)
+            index.bucket_prices[bucket].append((cents, pk))
+            index._set_price(pk, cents)
+            rating_ids[int(rating)].append(pk)
+            index._set_stars(pk, int(rating))
+
+        category_ids = {}
+        for product_id, category_id in members.iterator(chunk_size=5000):
+            category_ids.setdefault(category_id, []).append(product_id)
+
+        index.products = bitmap_from_ids(pk for ids in bucket_ids for pk in ids)
+        index.buckets = [bitmap_from_ids(ids) for ids in bucket_ids]
+        index.ratings = [bitmap_from_ids(ids) for ids in rating_ids]
+        for prices in index.bucket_prices:
+            prices.sort()
+        index.categories = {
+            category_id: bitmap_from_ids(ids)
+            for category_id, ids in category_ids.items()
+        }
+        return index
+
+    def bucket_of(self, cents):
+        return max(bisect_right(self.edges, cents) - 1, 0)
+
+    def _set_price(self, pk, cents):
+        if pk >= len(self.prices):
+            self.prices.extend([-1] * (pk + 1 - len(self.prices)))
+        self.prices[pk] = cents
+
+    def _set_stars(self, pk, stars):
+        if pk >= len(self.stars):
+            self.stars.extend([-1] * (pk + 1 - len(self.stars)))
+        self.stars[pk] = stars
+
+    def remove(self, pk):
+        bit = 1 << pk
+        if pk < len(self.prices) and self.prices[pk] >= 0:
+            cents = self.prices[pk]
+            bucket = self.bucket_of(cents)
+            self.buckets[bucket] &= ~bit
+            prices = self.bucket_prices[bucket]
+            position = bisect_left(prices, (cents, pk))
+            if position < len(prices) and prices[position] == (cents, pk):
+                del prices[position]
+            self.prices[pk] = -1
+        if pk < len(self.stars) and self.stars[pk] >= 0:
+            self.ratings[self.stars[pk]] &= ~bit
+            self.stars[pk] = -1
+        self.products &= ~bit
+        for category_id, bitmap in self.categories.items():
+            if bitmap & bit:
+                self.categories[category_id] = bitmap & ~bit
+
+    def add(self, pk, price, category_ids, rating=0.0):
+        bit = 1 << pk
+        cents = to_cents(price)
+        bucket = self.bucket_of(cents)
+        self.products |= bit
+        self.buckets[bucket] |= bit
+        insort(self.bucket_prices[bucket], (cents, pk))
+        self._set_price(pk, cents)
+        self.ratings[int(rating)] |= bit
+        self._set_stars(pk, int(rating))
+        for category_id in category_ids:
+            self.categories[category_id] = self.categories.get(category_id, 0) | bit
+
+    def refresh(self, product_ids):
+        """Re-read the given products from the database into the index."""
+        from .models import Product
+
+        product_ids = list(product_ids)
+        category_ids = {}
+        for product_id, category_id in Product.categories.through.objects.filter(
+            product_id__in=product_ids
+        ).values_list("product_id", "category_id"):
+            category_ids.setdefault(product_id, []).append(category_id)
+        rows = {
+            pk: (price, rating)
+            for pk, price, rating in Product.objects.filter(
+                pk__in=product_ids
+            ).values_list("pk", "price", "rating_average")
+        }
+
+        for pk in product_ids:
+            self.remove(pk)
+            if pk in rows:
+                price, rating = rows[pk]
+                self.add(pk, price, category_ids.get(pk, []), rating)
+
+    def price_bitmap(self, min_price=None, max_price=None):
+        """Products priced within ``[min_price, max_price]``."""
+        if min_price is None and max_price is None:
+            return self.products
+
+        low = to_cents(min_price) if min_price is not None else 0
+        high = to_cents(max_price) if max_price is not None else None
+        bitmap = 0
+        for bucket, edge in enumerate(self.edges):
+            upper = self.edges[bucket + 1] if bucket + 1 < len(self.edges) else None
+            if (high is not None and edge > high) or (
+                upper is not None and upper <= low
+            ):
+                continue
+            inside = low <= edge and (
+                high is None or (upper is not None and upper - 1 <= high)
+            )
+            if inside:
+                bitmap |= self.buckets[bucket]
+            else:
+                # bucket is cut by the range; pick its products by price
+                prices = self.bucket_prices[bucket]
+                start = bisect_left(prices, (low, -1))
+                end = (
+                    bisect_right(prices, (high, float("inf")))
+                    if high is not None
+                    else len(prices)
+                )
+                bitmap |= bitmap_from_ids(pk for _, pk in prices[start:end])
+        return bitmap
+
+    def rating_bitmap(self, min_rating):
+        """Products rated ``min_rating`` stars on average or better."""
+        bitmap = 0
+        for bits in self.ratings[min_rating:]:
+            bitmap |= bits
+        return bitmap
+
+    def counts(
+        self,
+        product_ids=None,
+        min_price=None,
+        max_price=None,
+        category_ids=None,
+        min_rating=None,
+    ):
+        """
+        Facet counts under the given filters. ``product_ids`` restricts the
+        candidates (e.g. to search hits); ``category_ids`` are OR-ed like the
+        listing does.
+
+        Each facet ignores its own filter: a category's count is its products
+        under the other filters, and the histogram spans every price bucket.
+        """
+        base = self.products
+        if product_ids is not None:
+            base &= bitmap_from_ids(product_ids)
+        if min_rating:
+            base &= self.rating_bitmap(min_rating)
+
+        in_price = base & self.price_bitmap(min_price, max_price)
+        in_categories = base
+        if category_ids:
+            selected = 0
+            for category_id in category_ids:
+                selected |= self.categories.get(category_id, 0)
+            in_categories &= selected
+
+        histogram = []
+        for bucket, edge in enumerate(self.edges):
+            upper = self.edges[bucket + 1] if bucket + 1 < len(self.edges) else None
+            histogram.append(
+                {
+                    "min": Decimal(edge) / 100,
+                    "max": Decimal(upper - 1) / 100 if upper is not None else None,
+                    "count": (in_categories & self.buckets[bucket]).bit_count(),
+                }
+            )
+
+        return {
+            "total": (in_price & in_categories).bit_count(),
+            "categories": {
+                category_id: (in_price & bitmap).bit_count()
+                for category_id, bitmap in self.categories.items()
+            },
+            "prices": histogram,
+        }
+
+
+_index = None
+_lock = threading.Lock()
+
+
+def get_index():
+    """The facet index for the current catalog version, rebuilt if stale."""
+    global _index
+
+    version = catalog.get_version()
+    if _index is None or _index.version != version:
+        with _lock:
+            if _index is None or _index.version != version:
+                _index = FacetIndex.build(version)
+    return _index
+
+
+def refresh_products(product_ids, version):
+    """
+    Patch this worker's index after it changed ``product_ids`` and moved the
+    catalog to ``version``. If other changes slipped in between, or the
+    changed products are unknown (``None``), the index is rebuilt on next use.
+    """
+    global _index
+
+    with _lock:
+        if product_ids is None:
+            _index = None
+        elif _index is not None and _index.version == version - 1:
+            _index.refresh(product_ids)
+            _index.version = version
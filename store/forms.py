@@ -1,13 +1,23 @@
 from django import forms
+from django.db import transaction
 from .models import Category, Order, Review
+from .ratings import apply_rating_change
 from accounts.models import DeliveryPerson
 
-
 SORTING_CHOICES = [
     ("price_asc", "Price Low to High"),
     ("price_desc", "Price High to Low"),
     ("latest", "Latest"),
     ("oldest", "Oldest"),
+    ("top_rated", "Top Rated"),
+]
+
+RATING_CHOICES = [
+    ("", "Any rating"),
+    (4, "4 stars & up"),
+    (3, "3 stars & up"),
+    (2, "2 stars & up"),
+    (1, "1 star & up"),
 ]
 
 
@@ -16,7 +26,12 @@ class ProductFilterForm(forms.Form):
         max_length=60,
         required=False,
         widget=forms.TextInput(
-            attrs={"class": "form-control", "placeholder": "search by name"}
+            attrs={
+                "class": "form-control",
+                "placeholder": "search by name",
+                "autocomplete": "off",
+                "list": "product_suggestions",
+            }
         ),
     )
 
@@ -42,6 +57,14 @@ class ProductFilterForm(forms.Form):
         widget=forms.CheckboxSelectMultiple(attrs={"class": ""}),
     )
 
+    min_rating = forms.TypedChoiceField(
+        choices=RATING_CHOICES,
+        coerce=int,
+        empty_value=None,
+        required=False,
+        widget=forms.Select(attrs={"class": "form-control"}),
+    )
+
     sorting_key = forms.ChoiceField(
         choices=SORTING_CHOICES,
         required=False,
@@ -91,9 +114,17 @@ class ReviewForm(forms.ModelForm):
         if not self.user or not self.product:
             raise ValueError("user and product are required")
 
-        review, _ = Review.objects.update_or_create(
-            user=self.user,
-            product=self.product,
-            defaults=self.cleaned_data,
-        )
+        with transaction.atomic():
+            previous_rating = (
+                Review.objects.select_for_update()
+                .filter(user=self.user, product=self.product)
+                .values_list("rating", flat=True)
+                .first()
+            )
+            review, _ = Review.objects.update_or_create(
+                user=self.user,
+                product=self.product,
+                defaults=self.cleaned_data,
+            )
+            apply_rating_change(self.product.pk, old=previous_rating, new=review.rating)
         return review
@@ -0,0 +1,85 @@
+"""
+Cached template fragments for the catalog pages.
+
+- Product cards are cached per ``(product.pk, updated_at)``, so a card is
+  rendered once per version of its product. A listing page fetches all of
+  its cards with one ``get_many`` and only renders (and queries) the misses.
+- The featured strip on ``home`` is cached whole, per catalog version
+  (``catalog.get_version``), so every worker renders it again once the
+  catalog changes, whether or not the cache is shared.
+
+``store.signals`` drops the cached card of a product when it is saved,
+deleted or has its categories changed.
+"""
+
+from django.core.cache import cache
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+from . import catalog
+
+CARD_TEMPLATE = "store/product_card.html"
+FEATURED_TEMPLATE = "store/featured_products.html"
+FEATURED_KEY = "store:fragment:featured"
+FRAGMENT_TIMEOUT = 60 * 60 * 24
+
+
+def stamp(updated_at):
+    return int(updated_at.timestamp() * 1_000_000)
+
+
+def card_key(pk, updated_stamp):
+    return f"store:fragment:card:{pk}:{updated_stamp}"
+
+
+def product_cards(cards):
+    """
+    Rendered cards for ``cards``, a sequence of ``(pk, stamp)`` pairs, in the
+    same order. Products deleted in the meantime are left out.
+    """
+    from .models import Product
+
+    keys = [card_key(pk, updated_stamp) for pk, updated_stamp in cards]
+    rendered = cache.get_many(keys)
+
+    missing = {pk: key for (pk, _), key in zip(cards, keys) if key not in rendered}
+    if missing:
+        new = {}
+        for product in Product.objects.filter(pk__in=missing).only(
+            "name",
+            "price",
+            "image",
+            "image_variants",
+            "rating_average",
+            "rating_count",
+            "updated_at",
+        ):
+            html = render_to_string(CARD_TEMPLATE, {"product": product})
+            # cache under the product's current version, which may be newer
+            # than the one asked for
+            new[card_key(product.pk, stamp(product.updated_at))] = html
+            rendered[missing[product.pk]] = html
+        cache.set_many(new, timeout=FRAGMENT_TIMEOUT)
+
+    return [mark_safe(rendered[key]) for key in keys if key in rendered]
+
+
+def featured_strip(get_products):
+    """
+    The rendered featured products strip; ``get_products`` returns the
+    products to show when it has to be rendered again.
+    """
+    key = f"{FEATURED_KEY}:{catalog.get_version()}"
+    html = cache.get(key)
+    if html is None:
+        products = get_products()
+        cards = product_cards(
+            [(product.pk, stamp(product.updated_at)) for product in products]
+        )
+        html = render_to_string(FEATURED_TEMPLATE, {"cards": cards})
+        cache.set(key, html, timeout=FRAGMENT_TIMEOUT)
+    return mark_safe(html)
+
+
+def invalidate_product(product):
+    cache.delete(card_key(product.pk, stamp(product.updated_at)))
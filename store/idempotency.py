@@ -0,0 +1,199 @@
+"""
+Idempotency keys for POSTs with side effects.
+
+Forms that place orders or start payments carry a one-off token
+(``{% idempotency_field %}``, or an ``Idempotency-Key`` header). The first
+request with a token runs the view and keeps its response in an
+``IdempotencyRecord`` for ``IDEMPOTENCY_TTL``; a repeat of it (a double
+click, a retried POST) gets that response back without running the view
+again. A repeat that arrives while the first request is still running waits
+for it. Records are rows with a unique ``(user, key)``, so a repeat that
+lands on another worker process is caught as well.
+
+Records are scoped to the user and the path, so a token only ever replays
+the request it was minted for; requests of anonymous visitors are not
+tracked. Responses of 500 and above are not kept, so a failed request can
+be retried with the same token.
+"""
+
+import hashlib
+import time
+import uuid
+from datetime import timedelta
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.http import HttpResponse
+from django.utils import timezone
+
+FIELD_NAME = "idempotency_key"
+HEADER_NAME = "HTTP_IDEMPOTENCY_KEY"
+# how long a repeat waits for the first request to finish
+WAIT_TIMEOUT = 15.0
+WAIT_INTERVAL = 0.05
+
+
+def new_key():
+    return uuid.uuid4().hex
+
+
+def request_key(request, user=None):
+    """
+    ``(user id, key)`` for the client token of ``request``, or ``None`` if
+    it sent none or nobody is logged in.
+    """
+    token = request.POST.get(FIELD_NAME) or request.META.get(HEADER_NAME)
+    if not token or len(token) > 255:
+        return None
+    if user is None:
+        user = request.user
+    if not user.is_authenticated:
+        return None
+    payload = f"{request.path}\x1f{token}"
+    return user.pk, hashlib.sha256(payload.encode()).hexdigest()
+
+
+def freeze(response):
+    return {
+        "status_code": response.status_code,
+        "content": response.content,
+        "headers": {
+            name: response[name]
+            for name in ("Content-Type", "Location")
+            if response.has_header(name)
+        },
+    }
+
+
+def thaw(record):
+    response = HttpResponse(bytes(record.content), status=record.status_code)
+    for name, value in record.headers.items():
+        response[name] = value
+    response["Idempotent-Replayed"] = "true"
+    return response
+
+
+def _records(user_id, key):
+    from .models import IdempotencyRecord
+
+    return IdempotencyRecord.objects.filter(user_id=user_id, key=key)
+
+
+def wait_for(user_id, key):
+    """
+    The record of ``key`` once the request holding it is done: ``None`` if
+    it left none, still pending if it did not finish in time.
+    """
+    from .models import IdempotencyRecord
+
+    deadline = time.monotonic() + WAIT_TIMEOUT
+    record = _records(user_id, key).first()
+    while (
+        record is not None
+        and record.status == IdempotencyRecord.Status.PENDING
+        and time.monotonic() < deadline
+    ):
+        time.sleep(WAIT_INTERVAL)
+        record = _records(user_id, key).first()
+    return record
+
+
+def _claim(user_id, key):
+    """
+    ``None`` once this request holds ``key``, else the response to answer
+    with instead of running the view.
+    """
+    from .models import IdempotencyRecord
+
+    now = timezone.now()
+    # the user's expired records, and pending ones whose request died
+    IdempotencyRecord.objects.filter(user_id=user_id).filter(
+        Q(created_at__lt=now - timedelta(seconds=settings.IDEMPOTENCY_TTL))
+        | Q(
+            status=IdempotencyRecord.Status.PENDING,
+            created_at__lt=now - timedelta(seconds=WAIT_TIMEOUT * 2),
+        )
+    ).delete()
+
+    while True:
+        try:
+            with transaction.atomic():
+                IdempotencyRecord.objects.create(user_id=user_id, key=key)
+            return None
+        except IntegrityError:
+            pass
+        record = wait_for(user_id, key)
+        if record is None:
+            # the first request failed without a response to keep; run it again
+            continue
+        if record.status == IdempotencyRecord.Status.PENDING:
+            return HttpResponse(
+                "The same request is still being processed.", status=409
+            )
+        return thaw(record)
+
+
+def _keep(user_id, key, response):
+    from .models import IdempotencyRecord
+
+    if response.status_code >= 500 or response.streaming:
+        _forget(user_id, key)
+    else:
+        _records(user_id, key).update(
+            status=IdempotencyRecord.Status.DONE, **freeze(response)
+        )
+
+
+def _forget(user_id, key):
+    _records(user_id, key).delete()
+
+
+def idempotent(view):
+    """
+    Answer repeated POSTs with the same token from the first response.
+    Works on sync and async views.
+    """
+    if iscoroutinefunction(view):
+
+        @wraps(view)
+        async def async_wrapper(request, *args, **kwargs):
+            if request.method != "POST":
+                return await view(request, *args, **kwargs)
+            key = request_key(request, await request.auser())
+            if key is None:
+                return await view(request, *args, **kwargs)
+
+            replay = await sync_to_async(_claim)(*key)
+            if replay is not None:
+                return replay
+            try:
+                response = await view(request, *args, **kwargs)
+            except BaseException:
+                await sync_to_async(_forget)(*key)
+                raise
+            await sync_to_async(_keep)(*key, response)
+            return response
+
+        return async_wrapper
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        key = request_key(request) if request.method == "POST" else None
+        if key is None:
+            return view(request, *args, **kwargs)
+
+        replay = _claim(*key)
+        if replay is not None:
+            return replay
+        try:
+            response = view(request, *args, **kwargs)
+        except BaseException:
+            _forget(*key)
+            raise
+        _keep(*key, response)
+        return response
+
+    return wrapper
@@ -0,0 +1,122 @@
+"""
+Responsive derivatives of ``Product.image``.
+
+Every uploaded product image is resized to each width in
+``PRODUCT_IMAGE_WIDTHS`` (never upscaled) and saved twice: as WebP and in a
+fallback format (JPEG, or PNG for images with transparency). The names are
+recorded in ``Product.image_variants`` so templates can emit ``srcset``
+without touching storage.
+
+``render_derivatives`` only does image work and storage I/O, so the
+backfill command can run it in a process pool; ``generate_derivatives`` is
+the per-product entry point used by the background task.
+"""
+
+import posixpath
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+DERIVATIVES_DIR = "derivatives"
+WEBP_QUALITY = 80
+JPEG_QUALITY = 85
+
+
+def derivative_name(name, width, extension):
+    directory, filename = posixpath.split(name)
+    stem = posixpath.splitext(filename)[0]
+    return posixpath.join(directory, DERIVATIVES_DIR, f"{stem}-{width}w.{extension}")
+
+
+def _has_alpha(image):
+    return image.mode in ("RGBA", "LA") or (
+        image.mode == "P" and "transparency" in image.info
+    )
+
+
+def _save(image, name, format, **options):
+    buffer = BytesIO()
+    image.save(buffer, format=format, **options)
+    if default_storage.exists(name):
+        default_storage.delete(name)
+    return default_storage.save(name, ContentFile(buffer.getvalue()))
+
+
+def render_derivatives(name):
+    """
+    Write the derivatives of the stored image ``name`` and return the
+    variants to store on the product:
+    ``{"source": name, "webp": [[width, name], ...], "fallback": [...]}``.
+    """
+    with default_storage.open(name, "rb") as file:
+        with Image.open(file) as original:
+            # apply the camera orientation before dropping the EXIF data
+            original = ImageOps.exif_transpose(original)
+            original.load()
+
+    if _has_alpha(original):
+        original = original.convert("RGBA")
+        fallback = ("PNG", "png", {"optimize": True})
+    else:
+        original = original.convert("RGB")
+        fallback = ("JPEG", "jpg", {"quality": JPEG_QUALITY, "progressive": True})
+
+    widths = sorted(
+        {min(width, original.width) for width in settings.PRODUCT_IMAGE_WIDTHS}
+    )
+    variants = {"source": name, "webp": [], "fallback": []}
+    for width in widths:
+        height = max(round(original.height * width / original.width), 1)
+        resized = (
+            original
+            if width == original.width
+            else original.resize((width, height), Image.Resampling.LANCZOS)
+        )
+        variants["webp"].append(
+            [
+                width,
+                _save(
+                    resized,
+                    derivative_name(name, width, "webp"),
+                    "WEBP",
+                    quality=WEBP_QUALITY,
+                    method=6,
+                ),
+            ]
+        )
+        format, extension, options = fallback
+        variants["fallback"].append(
+            [
+                width,
+                _save(
+                    resized, derivative_name(name, width, extension), format, **options
+                ),
+            ]
+        )
+    return variants
+
+
+def srcset(names):
+    return ", ".join(f"{default_storage.url(name)} {width}w" for width, name in names)
+
+
+def generate_derivatives(product_id):
+    """Render the derivatives of one product's current image and record them."""
+    from .models import Product
+    from .signals import catalog_changed
+
+    name = Product.objects.filter(pk=product_id).values_list("image", flat=True).first()
+    if not name:
+        return
+
+    variants = render_derivatives(name)
+    # the image may have been replaced while rendering; its own task wins then
+    updated = Product.objects.filter(pk=product_id, image=name).update(
+        image_variants=variants, updated_at=timezone.now()
+    )
+    if updated:
+        catalog_changed([product_id])
@@ -0,0 +1,210 @@
+"""
+Stock levels and checkout reservations.
+
+A stock-tracked product's stock is split over ``StockShard`` rows
+(``INVENTORY_SHARDS`` of them by default), so concurrent checkouts of one
+hot product decrement different rows instead of queueing on a single row
+lock. Products without shards are not tracked and never run out.
+
+``reserve`` takes an order's quantities in a fixed number of queries: one
+unlocked read of the shards, one conditional decrement of every chosen
+shard (``quantity >= wanted`` in the ``WHERE``, so stock never goes below
+zero) and one insert of ``StockReservation`` rows. When another checkout
+drains a chosen shard first, fewer rows update than planned and the attempt
+is retried with fresh numbers. ``release`` gives an order's reservations
+back, for cancelled orders and failed payments.
+"""
+
+import random
+from functools import reduce
+from operator import or_
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, PositiveIntegerField, Q, Sum, When
+
+
+class OutOfStock(Exception):
+    """Not enough stock for some products; ``product_ids`` names them."""
+
+    def __init__(self, product_ids):
+        super().__init__(product_ids)
+        self.product_ids = product_ids
+
+
+class _Raced(Exception):
+    pass
+
+
+def available(product_ids):
+    """``{product id: units in stock}`` of the stock-tracked ones among ``product_ids``."""
+    from .models import StockShard
+
+    return dict(
+        StockShard.objects.filter(product_id__in=product_ids)
+        .values_list("product_id")
+        .annotate(total=Sum("quantity"))
+    )
+
+
+def set_stock(product_id, quantity, shards=None):
+    """Make ``quantity`` the product's stock, spread evenly over ``shards`` rows."""
+    from .models import StockShard
+
+    shards = shards or settings.INVENTORY_SHARDS
+    share, extra = divmod(quantity, shards)
+    with transaction.atomic():
+        StockShard.objects.filter(product_id=product_id).delete()
+        StockShard.objects.bulk_create(
+            StockShard(
+                product_id=product_id,
+                shard=shard,
+                quantity=share + (1 if shard < extra else 0),
+            )
+            for shard in range(shards)
+        )
+
+
+def stop_tracking(product_id):
+    from .models import StockShard
+
+    StockShard.objects.filter(product_id=product_id).delete()
+
+
+def plan(wanted, shards):
+    """
+    ``(product id, shard, quantity)`` decrements covering ``wanted`` from
+    ``shards`` (``{product id: [(shard, quantity)]}``). A random shard that
+    covers a product alone is preferred, so checkouts spread over the rows.
+    """
+    picks, short = [], []
+    for product_id, quantity in wanted.items():
+        stock = shards.get(product_id)
+        if stock is None:
+            continue
+        covering = [shard for shard, units in stock if units >= quantity]
+        if covering:
+            picks.append((product_id, random.choice(covering), quantity))
+            continue
+
+        remaining = quantity
+        for shard, units in sorted(stock, key=lambda item: -item[1]):
+            if remaining == 0 or units == 0:
+                break
+            take = min(units, remaining)
+            picks.append((product_id, shard, take))
+            remaining -= take
+        if remaining:
+            short.append(product_id)
+    if short:
+        raise OutOfStock(short)
+    return picks
+
+
+def _decrement(picks):
+    from .models import StockShard
+
+    updated = StockShard.objects.filter(
+        reduce(
+            or_,
+            (
+                Q(product_id=product_id, shard=shard, quantity__gte=quantity)
+                for product_id, shard, quantity in picks
+            ),
+        )
+    ).update(
+        quantity=F("quantity")
+        - Case(
+            *(
+                When(product_id=product_id, shard=shard, then=quantity)
+                for product_id, shard, quantity in picks
+            ),
+            output_field=PositiveIntegerField(),
+        )
+    )
+    if updated != len(picks):
+        raise _Raced
+
+
+def take(wanted):
+    """
+    Take ``{product id: quantity}`` out of stock, returning the decrements
+    made. Untracked products are skipped. Raises ``OutOfStock``.
+    """
+    from .models import StockShard
+
+    for _ in range(settings.INVENTORY_RETRIES):
+        shards = {}
+        for product_id, shard, quantity in StockShard.objects.filter(
+            product_id__in=wanted
+        ).values_list("product_id", "shard", "quantity"):
+            shards.setdefault(product_id, []).append((shard, quantity))
+        picks = plan(wanted, shards)
+        if not picks:
+            return []
+        try:
+            with transaction.atomic():
+                _decrement(picks)
+        except _Raced:
+            continue
+        return picks
+    # still racing after every retry: name the products that are short now,
+    # or the tracked ones if the stock is there but kept being taken first
+    stock = available(wanted)
+    short = [
+        product_id
+        for product_id, quantity in wanted.items()
+        if product_id in stock and stock[product_id] < quantity
+    ]
+    raise OutOfStock(
+        short or [product_id for product_id in wanted if product_id in stock]
+    )
+
+
+def reserve(order, wanted):
+    """``take`` stock for ``order`` and record it against the order."""
+    from .models import StockReservation
+
+    picks = take(wanted)
+    StockReservation.objects.bulk_create(
+        StockReservation(order=order, product_id=product_id, shard=shard, quantity=qty)
+        for product_id, shard, qty in picks
+    )
+    return picks
+
+
+def release(order):
+    """Give ``order``'s reserved stock back to the shards it came from."""
+    from .models import StockReservation, StockShard
+
+    with transaction.atomic():
+        reservations = StockReservation.objects.filter(order=order)
+        returned = {}
+        for product_id, shard, quantity in reservations.values_list(
+            "product_id", "shard", "quantity"
+        ):
+            returned[product_id, shard] = (
+                returned.get((product_id, shard), 0) + quantity
+            )
+        if not returned:
+            return
+        StockShard.objects.filter(
+            reduce(
+                or_,
+                (
+                    Q(product_id=product_id, shard=shard)
+                    for product_id, shard in returned
+                ),
+            )
+        ).update(
+            quantity=F("quantity")
+            + Case(
+                *(
+                    When(product_id=product_id, shard=shard, then=quantity)
+                    for (product_id, shard), quantity in returned.items()
+                ),
+                default=0,
+                output_field=PositiveIntegerField(),
+            )
+        )
+        reservations.delete()
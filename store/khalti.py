@@ -0,0 +1,200 @@
+"""
+Client for the Khalti ePayment gateway, for the async payment views.
+
+``ainitiate`` creates a payment and is never retried. ``alookup`` only reads
+a payment's state and is retried with exponential backoff on connection
+errors, timeouts and 5xx answers. A slow gateway holds no thread while it
+answers.
+
+Every event loop keeps one ``httpx.AsyncClient`` to ``KHALTI_BASE_URL``,
+with up to ``KHALTI_POOL_SIZE`` kept-alive connections, so a payment does
+not pay for a new TCP and TLS handshake. Under ASGI that is one client for
+the life of the worker. The client is closed when its loop shuts down:
+``asyncio.run`` and asgiref's ``async_to_sync`` finish every loop with
+``shutdown_asyncgens``, which runs the ``finally`` of ``_lifetime``.
+
+Each call's latency is recorded per operation (see ``metrics``) and logged
+to the ``store.khalti`` logger. Point ``KHALTI_BASE_URL`` at
+``manage.py khalti_stub`` to run without the real gateway.
+"""
+
+import asyncio
+import collections
+import logging
+import statistics
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+
+import httpx
+from django.conf import settings
+
+logger = logging.getLogger("store.khalti")
+
+# latencies kept per operation for the percentiles in metrics()
+LATENCY_SAMPLES = 1000
+RETRY_STATUSES = {500, 502, 503, 504}
+# lookup statuses after which a payment can no longer complete; others, such
+# as "Pending" and "Initiated", may still turn into "Completed"
+FAILED_STATUSES = {"Expired", "User canceled", "Refunded"}
+
+
+class KhaltiError(Exception):
+    """The gateway could not be reached or gave no usable answer."""
+
+
+class Metrics:
+    """Call counts, errors and latencies per operation, for this process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._calls = collections.Counter()
+            self._errors = collections.Counter()
+            self._retries = collections.Counter()
+            self._latencies = collections.defaultdict(
+                lambda: collections.deque(maxlen=LATENCY_SAMPLES)
+            )
+
+    def record(self, operation, elapsed_ms, error=False, retries=0):
+        with self._lock:
+            self._calls[operation] += 1
+            self._errors[operation] += error
+            self._retries[operation] += retries
+            self._latencies[operation].append(elapsed_ms)
+
+    def snapshot(self):
+        with self._lock:
+            result = {}
+            for operation, latencies in self._latencies.items():
+                ordered = sorted(latencies)
+                result[operation] = {
+                    "calls": self._calls[operation],
+                    "errors": self._errors[operation],
+                    "retries": self._retries[operation],
+                    "mean_ms": statistics.fmean(ordered),
+                    "p50_ms": ordered[len(ordered) // 2],
+                    "p95_ms": ordered[max(int(len(ordered) * 0.95) - 1, 0)],
+                    "max_ms": ordered[-1],
+                }
+            return result
+
+
+metrics = Metrics()
+
+
+def _headers():
+    return {
+        "Authorization": f"Key {settings.KHALTI_SECRET_KEY}",
+        "Content-Type": "application/json",
+    }
+
+
+def _backoff(attempt):
+    return settings.KHALTI_RETRY_BACKOFF * 2 ** (attempt - 1)
+
+
+@contextmanager
+def _recorded(operation):
+    """Time a call, count it in ``metrics`` and turn failures into ``KhaltiError``."""
+    call = {"retries": 0}
+    started = time.perf_counter()
+    try:
+        yield call
+    except (httpx.HTTPError, ValueError) as e:
+        elapsed = (time.perf_counter() - started) * 1000
+        metrics.record(operation, elapsed, error=True, retries=call["retries"])
+        logger.warning(f"khalti {operation} failed after {elapsed:.0f} ms: {e!r}")
+        raise KhaltiError(str(e)) from e
+    elapsed = (time.perf_counter() - started) * 1000
+    metrics.record(operation, elapsed, retries=call["retries"])
+    logger.debug(f"khalti {operation} took {elapsed:.0f} ms")
+
+
+def _retryable(error):
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code in RETRY_STATUSES
+    return isinstance(error, httpx.TransportError)
+
+
+_ssl_context = None
+
+
+def _get_ssl_context():
+    # loading the CA bundle takes tens of milliseconds; without sharing it, a
+    # loop per request (async views under WSGI) would pay that every time
+    global _ssl_context
+
+    if _ssl_context is None:
+        _ssl_context = httpx.create_ssl_context()
+    return _ssl_context
+
+
+# an AsyncClient's connections belong to the event loop that opened them
+_async_clients = weakref.WeakKeyDictionary()
+
+
+async def _lifetime(client):
+    # an async generator left suspended here is closed by the loop's
+    # shutdown_asyncgens, so the client goes when its loop does
+    try:
+        yield
+    finally:
+        await client.aclose()
+
+
+async def get_async_client():
+    loop = asyncio.get_running_loop()
+    entry = _async_clients.get(loop)
+    if entry is None:
+        client = httpx.AsyncClient(
+            headers=_headers(),
+            timeout=settings.KHALTI_TIMEOUT,
+            verify=_get_ssl_context(),
+            limits=httpx.Limits(
+                max_connections=settings.KHALTI_ASYNC_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.KHALTI_POOL_SIZE,
+            ),
+        )
+        # the loop only holds its async generators weakly
+        lifetime = _lifetime(client)
+        await lifetime.asend(None)
+        entry = _async_clients[loop] = (client, lifetime)
+    return entry[0]
+
+
+async def _apost(operation, path, payload, attempts=1):
+    with _recorded(operation) as call:
+        client = await get_async_client()
+        for attempt in range(attempts):
+            if attempt:
+                await asyncio.sleep(_backoff(attempt))
+                call["retries"] = attempt
+            try:
+                response = await client.post(
+                    f"{settings.KHALTI_BASE_URL}{path}", json=payload
+                )
+                response.raise_for_status()
+                return response.json()
+            except httpx.HTTPError as e:
+                if attempt + 1 == attempts or not _retryable(e):
+                    raise
+
+
+async def ainitiate(payload):
+    """Start a payment; the gateway's answer, with ``pidx`` and ``payment_url``."""
+    return await _apost("initiate", "/epayment/initiate/", payload)
+
+
+async def alookup(pidx):
+    """The state of payment ``pidx``, retried while the gateway is unavailable."""
+    return await _apost(
+        "lookup",
+        "/epayment/lookup/",
+        {"pidx": pidx},
+        attempts=settings.KHALTI_LOOKUP_ATTEMPTS,
+    )
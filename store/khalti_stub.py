@@ -0,0 +1,110 @@
+"""
+A stand-in for the Khalti ePayment gateway, for development, tests and
+benchmarks.
+
+It answers ``/epayment/initiate/`` with a new ``pidx`` and a payment URL on
+itself; opening that URL "pays" and sends the browser back to the
+``return_url`` with the ``pidx``, as Khalti does. ``/epayment/lookup/``
+reports every payment it issued as completed for the initiated amount.
+``latency`` delays every answer, to imitate a slow gateway.
+"""
+
+import json
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlencode
+
+
+class StubKhaltiHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # headers and body go out in separate writes on kept-alive connections
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _answer(self, status, data=None, headers=()):
+        body = json.dumps(data).encode() if data is not None else b""
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            payload = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            return self._answer(400, {"detail": "Invalid JSON"})
+        if not self.headers.get("Authorization", "").startswith("Key "):
+            return self._answer(401, {"detail": "Invalid token."})
+        time.sleep(self.server.latency)
+
+        if self.path == "/epayment/initiate/":
+            pidx = uuid.uuid4().hex
+            with self.server.lock:
+                self.server.payments[pidx] = payload
+            host = f"http://{self.server.server_address[0]}:{self.server.server_port}"
+            return self._answer(
+                200,
+                {
+                    "pidx": pidx,
+                    "payment_url": f"{host}/pay/{pidx}/",
+                    "expires_in": 1800,
+                },
+            )
+        if self.path == "/epayment/lookup/":
+            with self.server.lock:
+                payment = self.server.payments.get(payload.get("pidx"))
+            if payment is None:
+                return self._answer(404, {"detail": "Not found."})
+            return self._answer(
+                200,
+                {
+                    "pidx": payload["pidx"],
+                    "total_amount": payment["amount"],
+                    "status": "Completed",
+                    "transaction_id": f"stub-{payload['pidx'][:12]}",
+                    "fee": 0,
+                    "refunded": False,
+                },
+            )
+        return self._answer(404, {"detail": "Not found."})
+
+    def do_GET(self):
+        pidx = self.path.strip("/").removeprefix("pay/")
+        with self.server.lock:
+            payment = self.server.payments.get(pidx)
+        if payment is None:
+            return self._answer(404, {"detail": "Not found."})
+        query = urlencode({"pidx": pidx, "status": "Completed"})
+        return self._answer(
+            302, headers=[("Location", f"{payment['return_url']}?{query}")]
+        )
+
+
+class StubKhaltiServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # room for a burst of concurrent connections from async benchmarks
+    request_queue_size = 256
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0):
+        super().__init__((host, port), StubKhaltiHandler)
+        self.latency = latency
+        self.payments = {}
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        return f"http://{self.server_address[0]}:{self.server_port}"
+
+    def start(self):
+        """Serve from a background thread; for tests and benchmarks."""
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return self
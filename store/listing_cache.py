@@ -0,0 +1,108 @@
+"""
+Cache for computed product listings.
+
+Entries are keyed on the canonical form of the listing filters rather than
+the raw URL, so reordered or empty query parameters and ``page=1`` versus no
+page share one entry. Each entry records the catalog version it was computed
+at (see ``store.catalog``): with a shared cache it is fresh until a
+product or category changes, with no TTL to wait out. A per-process cache
+keeps entries for ``LOCAL_ENTRY_TIMEOUT`` seconds only, as ``cache_page``
+did, so a worker that misses a change never serves it for long.
+
+Recomputation is single-flight. When an entry goes stale, one worker takes a
+short lock and rebuilds it while everyone else keeps serving the stale value;
+when there is no value at all, the others wait briefly for the builder. The
+lock lives in the cache too, so without a shared cache it only holds back
+the threads of one process.
+"""
+
+import hashlib
+import json
+import time
+
+from django.core.cache import cache
+
+from . import catalog
+from .utils import cache_is_shared
+
+KEY_PREFIX = "store:listing"
+# in a shared cache entries only go stale on a catalog change and the
+# timeout just bounds storage
+SHARED_ENTRY_TIMEOUT = 60 * 60 * 24
+LOCAL_ENTRY_TIMEOUT = 10
+LOCK_TIMEOUT = 30
+# how long a worker without any value waits for another one to build it
+WAIT_TIMEOUT = 2.0
+WAIT_INTERVAL = 0.05
+
+
+def canonical_filters(cleaned_data):
+    """Filters from ``ProductFilterForm.cleaned_data`` in one normal form."""
+    filters = {}
+    if cleaned_data.get("name"):
+        filters["name"] = " ".join(cleaned_data["name"].lower().split())
+    for field in ("min_price", "max_price"):
+        if cleaned_data.get(field) is not None:
+            filters[field] = format(cleaned_data[field].normalize(), "f")
+    if cleaned_data.get("categories"):
+        filters["categories"] = sorted(
+            category.pk for category in cleaned_data["categories"]
+        )
+    if cleaned_data.get("min_rating"):
+        filters["min_rating"] = cleaned_data["min_rating"]
+    if cleaned_data.get("sorting_key"):
+        filters["sorting_key"] = cleaned_data["sorting_key"]
+    return filters
+
+
+def canonical_page(page):
+    try:
+        return max(int(page), 1)
+    except (TypeError, ValueError):
+        return 1
+
+
+def listing_key(filters, page=1, cursor=None):
+    payload = json.dumps(
+        {"filters": filters, "page": page, "cursor": cursor or None},
+        sort_keys=True,
+        separators=(",", ":"),
+    )
+    return f"{KEY_PREFIX}:{hashlib.sha256(payload.encode()).hexdigest()}"
+
+
+def entry_timeout():
+    return SHARED_ENTRY_TIMEOUT if cache_is_shared() else LOCAL_ENTRY_TIMEOUT
+
+
+def get_or_compute(key, compute):
+    """Return the cached value for ``key``, computing it at most once at a time."""
+    version = catalog.get_version()
+    entry = cache.get(key)
+    if entry is not None and entry["version"] == version:
+        return entry["value"]
+
+    lock_key = f"{key}:lock"
+    if cache.add(lock_key, 1, timeout=LOCK_TIMEOUT):
+        try:
+            value = compute()
+            cache.set(
+                key, {"version": version, "value": value}, timeout=entry_timeout()
+            )
+            return value
+        finally:
+            cache.delete(lock_key)
+
+    if entry is not None:
+        # stale while another worker revalidates
+        return entry["value"]
+
+    deadline = time.monotonic() + WAIT_TIMEOUT
+    while time.monotonic() < deadline:
+        time.sleep(WAIT_INTERVAL)
+        entry = cache.get(key)
+        if entry is not None:
+            return entry["value"]
+
+    # the builder is too slow or gone; don't hold the request any longer
+    return compute()
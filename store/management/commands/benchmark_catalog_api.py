@@ -0,0 +1,84 @@
+import statistics
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+
+from store.models import Product
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the per-request cost of the catalog API with the HTML views, "
+        "with cold and warm caches"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=200)
+
+    def handle(self, *args, **options):
+        product = Product.objects.order_by("-pk").only("pk").first()
+        if product is None:
+            self.stderr.write("No products to benchmark with")
+            return
+
+        pairs = [
+            (
+                "listing",
+                reverse("store:products_page"),
+                reverse("api_v1:product_list") + "?page_size=16",
+            ),
+            (
+                "detail",
+                reverse("store:product_detail_page", args=[product.pk]),
+                reverse("api_v1:product_detail", args=[product.pk]),
+            ),
+        ]
+
+        with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, "testserver"]):
+            client = Client()
+            self.stdout.write(
+                f"{'':<8} {'endpoint':<9} {'cache':<5} {'ms/req':>8} "
+                f"{'p95 ms':>8} {'queries':>8} {'bytes':>8}"
+            )
+            for name, html_url, api_url in pairs:
+                for label, url in (("html", html_url), ("api", api_url)):
+                    for warm in (False, True):
+                        result = self.measure(client, url, options["requests"], warm)
+                        self.stdout.write(
+                            f"{name:<8} {label:<9} {'warm' if warm else 'cold':<5} "
+                            f"{result['mean']:>8.2f} {result['p95']:>8.2f} "
+                            f"{result['queries']:>8.1f} {result['bytes']:>8}"
+                        )
+
+    def measure(self, client, url, requests, warm):
+        timings, queries, size = [], 0, 0
+        client.get(url)
+        for _ in range(requests):
+            if not warm:
+                # drop cached listings and fragments; the catalog version is
+                # kept in the database
+                cache.clear()
+            with CaptureQueriesContext(connection) as captured:
+                started = time.perf_counter()
+                response = client.get(url)
+                timings.append((time.perf_counter() - started) * 1000)
+            queries += len(captured.captured_queries)
+            size = len(
+                b"".join(response.streaming_content)
+                if response.streaming
+                else response.content
+            )
+
+        timings.sort()
+        return {
+            "mean": statistics.fmean(timings),
+            "p95": timings[int(len(timings) * 0.95) - 1],
+            "queries": queries / requests,
+            "bytes": size,
+        }
@@ -0,0 +1,75 @@
+import time
+import uuid
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from store import carts, inventory, orders
+from store.models import Product
+from store.utils import generate_order_id
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Place orders from carts of growing size, in a transaction that is "
+        "rolled back, with and without tracked stock, and fail unless checkout "
+        "costs the same number of queries for every size"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes", type=int, nargs="+", default=[1, 10, 50])
+
+    def handle(self, *args, **options):
+        sizes = sorted(options["sizes"])
+        products = list(Product.objects.values_list("pk", flat=True)[: sizes[-1]])
+        if len(products) < sizes[-1]:
+            raise CommandError(f"Need {sizes[-1]} products, found {len(products)}")
+
+        # lease this process's worker id for good, not in a rolled back checkout
+        generate_order_id()
+        # tracked stock costs a few more queries, so sizes are only compared
+        # within one mode; whatever stock the products have is rolled back
+        self.stdout.write(f"{'stock':<10} {'lines':>6} {'queries':>8} {'ms':>8}")
+        for tracked in (False, True):
+            counts = set()
+            for size in sizes:
+                queries, elapsed = self.checkout(products[:size], tracked)
+                counts.add(queries)
+                self.stdout.write(
+                    f"{'tracked' if tracked else 'untracked':<10} {size:>6} "
+                    f"{queries:>8} {elapsed:>8.2f}"
+                )
+            if len(counts) > 1:
+                raise CommandError("Checkout queries grow with the size of the cart")
+        self.stdout.write(self.style.SUCCESS("Checkout runs a fixed number of queries"))
+
+    def checkout(self, products, tracked):
+        backend = carts.DatabaseCartBackend()
+        try:
+            with transaction.atomic():
+                for pk in products:
+                    if tracked:
+                        inventory.set_stock(pk, len(products) + 1)
+                    else:
+                        inventory.stop_tracking(pk)
+                user = get_user_model().objects.create_user(
+                    email=f"checkout-{uuid.uuid4().hex}@example.com",
+                    password=None,
+                )
+                backend.apply(user.pk, {pk: 1 for pk in products})
+                order_id = generate_order_id()
+                with CaptureQueriesContext(connection) as captured:
+                    started = time.perf_counter()
+                    with backend.checkout(user.pk):
+                        orders.create_order(user, order_id)
+                    elapsed = (time.perf_counter() - started) * 1000
+                raise Rollback
+        except Rollback:
+            pass
+        return len(captured.captured_queries), elapsed
@@ -0,0 +1,115 @@
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connection, transaction
+
+from store import inventory
+from store.models import Product, StockShard
+
+
+class Command(BaseCommand):
+    help = (
+        "Reserve one product from many threads at once, with its stock in one "
+        "row and in shards, and report checkouts per second"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--product", type=int, help="defaults to the newest")
+        parser.add_argument("--threads", type=int, default=16)
+        parser.add_argument("--checkouts", type=int, default=2000)
+        parser.add_argument(
+            "--shards", type=int, nargs="+", default=[1, settings.INVENTORY_SHARDS]
+        )
+        parser.add_argument(
+            "--hold-ms",
+            type=float,
+            default=2.0,
+            help="time each checkout keeps its transaction open after reserving",
+        )
+
+    def handle(self, *args, **options):
+        products = Product.objects.order_by("-pk")
+        if options["product"]:
+            products = products.filter(pk=options["product"])
+        product = products.only("pk", "name").first()
+        if product is None:
+            raise CommandError("No product to benchmark with")
+
+        saved = list(
+            StockShard.objects.filter(product=product).values_list("shard", "quantity")
+        )
+        if connection.vendor == "sqlite":
+            self.stdout.write(
+                "SQLite lets one transaction write at a time, so shards cannot "
+                "help here and concurrent writers fail with 'database is "
+                "locked' (errors); run against PostgreSQL for the real numbers"
+            )
+        self.stdout.write(
+            f"{product} on {connection.vendor}, {options['threads']} threads, "
+            f"{options['checkouts']} checkouts"
+        )
+        self.stdout.write(
+            f"{'shards':>6} {'ok':>6} {'sold out':>8} {'errors':>6} "
+            f"{'checkouts/s':>12} {'left':>6}"
+        )
+        try:
+            for shards in options["shards"]:
+                # a little less stock than checkouts, so selling out is exercised
+                stock = options["checkouts"] * 9 // 10
+                inventory.set_stock(product.pk, stock, shards)
+                result = self.run(product.pk, options)
+                left = inventory.available([product.pk])[product.pk]
+                if result["ok"] + left != stock:
+                    raise CommandError(
+                        f"Stock does not add up: {result['ok']} sold, {left} left "
+                        f"of {stock}"
+                    )
+                self.stdout.write(
+                    f"{shards:>6} {result['ok']:>6} {result['sold_out']:>8} "
+                    f"{result['errors']:>6} {result['rate']:>12.0f} {left:>6}"
+                )
+        finally:
+            StockShard.objects.filter(product=product).delete()
+            StockShard.objects.bulk_create(
+                StockShard(product=product, shard=shard, quantity=quantity)
+                for shard, quantity in saved
+            )
+
+    def run(self, product_id, options):
+        counts = {"ok": 0, "sold_out": 0, "errors": 0}
+        lock = threading.Lock()
+        remaining = [options["checkouts"]]
+        hold = options["hold_ms"] / 1000
+
+        def worker():
+            try:
+                while True:
+                    with lock:
+                        if remaining[0] == 0:
+                            return
+                        remaining[0] -= 1
+                    try:
+                        with transaction.atomic():
+                            inventory.take({product_id: 1})
+                            # the rest of the order transaction
+                            time.sleep(hold)
+                        outcome = "ok"
+                    except inventory.OutOfStock:
+                        outcome = "sold_out"
+                    except OperationalError:
+                        outcome = "errors"
+                    with lock:
+                        counts[outcome] += 1
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker) for _ in range(options["threads"])]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        return {**counts, "rate": options["checkouts"] / elapsed}
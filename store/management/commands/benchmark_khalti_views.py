@@ -0,0 +1,160 @@
+import asyncio
+import statistics
+import threading
+import time
+from decimal import Decimal
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import AsyncClient, Client
+from django.test.utils import override_settings
+from django.urls import reverse
+
+from store.khalti_stub import StubKhaltiServer
+from store.models import Order
+from store.utils import generate_order_id
+
+
+class Command(BaseCommand):
+    help = (
+        "Start Khalti payments while the stub gateway answers slowly, from one "
+        "event loop and from a fixed pool of threads, and report payments per "
+        "second"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=200)
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=100,
+            help="payments in flight at once on the event loop",
+        )
+        parser.add_argument(
+            "--threads",
+            type=int,
+            default=8,
+            help="sync workers, each busy until the gateway answers",
+        )
+        parser.add_argument(
+            "--latency-ms", type=float, nargs="+", default=[0, 200, 1000]
+        )
+
+    def handle(self, *args, **options):
+        user = get_user_model().objects.create(
+            email=f"khalti-benchmark-{generate_order_id()}@example.com"
+        )
+        # bulk_create, so no order confirmation mails go out
+        orders = Order.objects.bulk_create(
+            Order(
+                user=user,
+                order_id=generate_order_id(),
+                subtotal=Decimal("100.00"),
+                total=Decimal("100.00"),
+            )
+            for _ in range(options["requests"])
+        )
+        # the first round creates the payments through the view, like real
+        # checkouts; they stay initiated, so later rounds start them again
+        urls = [
+            reverse("store:khalti_payment", args=[order.order_id]) for order in orders
+        ]
+
+        self.stdout.write(
+            f"{options['requests']} payments a round; async: {options['concurrency']} "
+            f"in flight, sync: {options['threads']} threads"
+        )
+        self.stdout.write(
+            f"{'gateway ms':>10} {'mode':<6} {'payments/s':>11} {'mean ms':>8} "
+            f"{'p95 ms':>8} {'errors':>6}"
+        )
+        try:
+            for latency_ms in options["latency_ms"]:
+                stub = StubKhaltiServer(latency=latency_ms / 1000).start()
+                try:
+                    with override_settings(
+                        ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, "testserver"],
+                        KHALTI_BASE_URL=stub.url,
+                    ):
+                        for mode, run in (
+                            ("async", self.run_async),
+                            ("sync", self.run_sync),
+                        ):
+                            result = run(user, urls, stub.url, options)
+                            self.stdout.write(
+                                f"{latency_ms:>10.0f} {mode:<6} "
+                                f"{result['rate']:>11.1f} {result['mean']:>8.1f} "
+                                f"{result['p95']:>8.1f} {result['errors']:>6}"
+                            )
+                finally:
+                    stub.shutdown()
+        finally:
+            Order.objects.filter(pk__in=[order.pk for order in orders]).delete()
+            user.delete()
+
+    def summarize(self, timings, errors, elapsed):
+        timings.sort()
+        return {
+            "rate": len(timings) / elapsed,
+            "mean": statistics.fmean(timings),
+            "p95": timings[int(len(timings) * 0.95) - 1],
+            "errors": errors,
+        }
+
+    def run_async(self, user, urls, gateway_url, options):
+        timings, errors = [], [0]
+
+        async def pay(client, url, slots):
+            async with slots:
+                started = time.perf_counter()
+                response = await client.post(url)
+                timings.append((time.perf_counter() - started) * 1000)
+            if not response.get("Location", "").startswith(gateway_url):
+                errors[0] += 1
+
+        async def main():
+            client = AsyncClient()
+            await client.aforce_login(user)
+            slots = asyncio.Semaphore(options["concurrency"])
+            started = time.perf_counter()
+            await asyncio.gather(*(pay(client, url, slots) for url in urls))
+            return time.perf_counter() - started
+
+        elapsed = asyncio.run(main())
+        return self.summarize(timings, errors[0], elapsed)
+
+    def run_sync(self, user, urls, gateway_url, options):
+        # each thread stands for a WSGI worker thread: it serves one request
+        # at a time and waits out the gateway with it
+        timings, errors = [], [0]
+        lock = threading.Lock()
+        pending = list(urls)
+
+        def worker():
+            client = Client()
+            client.force_login(user)
+            try:
+                while True:
+                    with lock:
+                        if not pending:
+                            return
+                        url = pending.pop()
+                    started = time.perf_counter()
+                    response = client.post(url)
+                    elapsed = (time.perf_counter() - started) * 1000
+                    with lock:
+                        timings.append(elapsed)
+                        if not response.get("Location", "").startswith(gateway_url):
+                            errors[0] += 1
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker) for _ in range(options["threads"])]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return self.summarize(timings, errors[0], time.perf_counter() - started)
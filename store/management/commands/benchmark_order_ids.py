@@ -0,0 +1,75 @@
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from store.utils import get_order_id_generator, release_order_id_generator
+
+
+def generate(count, batch):
+    # a forked process leases a worker id of its own, like a web worker
+    generator = get_order_id_generator()
+    connection.close()
+    started = time.perf_counter()
+    if batch > 1:
+        ids = []
+        while len(ids) < count:
+            ids.extend(generator.next_ids(min(batch, count - len(ids))))
+    else:
+        next_id = generator.next_id
+        ids = [next_id() for _ in range(count)]
+    elapsed = time.perf_counter() - started
+    worker_id = generator.worker_id
+    # pool processes leave with os._exit, which skips the release at exit
+    release_order_id_generator()
+    connection.close()
+    if any(a >= b for a, b in zip(ids, ids[1:])):
+        raise RuntimeError(f"worker {worker_id} made ids out of order")
+    return worker_id, ids, elapsed
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate order ids in several processes at once, each on the worker "
+        "id it leased, and check that none of them collide"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--processes", type=int, default=4)
+        parser.add_argument("--count", type=int, default=1_000_000)
+        parser.add_argument(
+            "--batch",
+            type=int,
+            default=1,
+            help="ids asked for at once with next_ids(); 1 calls next_id()",
+        )
+
+    def handle(self, *args, **options):
+        processes, count, batch = (
+            options["processes"],
+            options["count"],
+            options["batch"],
+        )
+
+        # forked processes must open database connections of their own
+        connection.close()
+        started = time.perf_counter()
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            results = list(pool.map(generate, [count] * processes, [batch] * processes))
+        wall = time.perf_counter() - started
+
+        seen = set()
+        for worker_id, ids, elapsed in results:
+            seen.update(ids)
+            self.stdout.write(
+                f"worker {worker_id}: {count / elapsed:,.0f} ids/s " f"({elapsed:.2f}s)"
+            )
+
+        total = processes * count
+        self.stdout.write(
+            f"{total:,} ids in {wall:.2f}s, {total / wall:,.0f} ids/s overall"
+        )
+        if len(seen) != total:
+            raise CommandError(f"{total - len(seen):,} duplicate ids")
+        self.stdout.write(self.style.SUCCESS("No duplicates"))
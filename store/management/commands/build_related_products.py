@@ -0,0 +1,19 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from store import recommendations
+
+
+class Command(BaseCommand):
+    help = "Rebuild the co-purchase related products table from paid orders"
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        written = recommendations.rebuild()
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Stored {written} related product pairs in {elapsed:.2f}s"
+            )
+        )
@@ -0,0 +1,36 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from store import catalog
+from store.snapshot import CatalogSnapshot
+
+
+class Command(BaseCommand):
+    help = "Build the in-process catalog snapshot and report its memory use"
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        snapshot = CatalogSnapshot.build(catalog.get_version())
+        elapsed = time.perf_counter() - started
+
+        report = snapshot.memory_report()
+        total = report.pop("total")
+        budget = settings.CATALOG_SNAPSHOT_MAX_BYTES
+
+        self.stdout.write(
+            f"{len(snapshot)} products, {len(snapshot.categories)} categories, "
+            f"built in {elapsed:.2f}s (catalog version {snapshot.version})"
+        )
+        for column, size in report.items():
+            self.stdout.write(f"  {column:<12} {size / 1024:>10.1f} KB")
+
+        summary = (
+            f"  {'total':<12} {total / 1024:>10.1f} KB "
+            f"of {budget / 1024:.1f} KB budget ({total / budget:.1%})"
+        )
+        if total > budget:
+            self.stdout.write(self.style.ERROR(summary))
+        else:
+            self.stdout.write(self.style.SUCCESS(summary))
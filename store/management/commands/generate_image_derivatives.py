@@ -0,0 +1,105 @@
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.core.management.base import BaseCommand
+from django.db import connections, transaction
+from django.utils import timezone
+
+from store import images
+from store.models import Product
+from store.signals import catalog_changed
+
+
+def _init_worker():
+    import django
+
+    django.setup()
+
+
+class Command(BaseCommand):
+    help = "Generate the responsive image derivatives of existing products"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=os.cpu_count(),
+            help="Processes to resize images in (default: one per CPU)",
+        )
+        parser.add_argument(
+            "--all",
+            action="store_true",
+            help="Regenerate derivatives that are already up to date",
+        )
+        parser.add_argument("--batch-size", type=int, default=500)
+
+    def handle(self, *args, **options):
+        # one pass over the catalog, without an IN list of every product
+        products = {
+            pk: name
+            for pk, name, source in Product.objects.exclude(image="")
+            .values_list("pk", "image", "image_variants__source")
+            .order_by("pk")
+            .iterator()
+            if options["all"] or source != name
+        }
+
+        if not products:
+            self.stdout.write("All product images are up to date")
+            return
+
+        # forked workers must not share the parent's database connections
+        connections.close_all()
+
+        done, failed, batch = [], 0, []
+        with ProcessPoolExecutor(
+            max_workers=options["workers"], initializer=_init_worker
+        ) as pool:
+            futures = {
+                pool.submit(images.render_derivatives, name): pk
+                for pk, name in products.items()
+            }
+            for future in as_completed(futures):
+                pk = futures[future]
+                try:
+                    variants = future.result()
+                except Exception as error:
+                    failed += 1
+                    self.stderr.write(f"Product {pk}: {error}")
+                    continue
+                batch.append((pk, products[pk], variants))
+                if len(batch) >= options["batch_size"]:
+                    done.extend(self._save(batch))
+                    batch = []
+        done.extend(self._save(batch))
+
+        if done:
+            catalog_changed(done)
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Generated derivatives for {len(done)} products, {failed} failed"
+            )
+        )
+
+    def _save(self, batch):
+        """
+        Record ``(pk, image name, variants)`` renders, skipping products whose
+        image was replaced while rendering; their own task wins then, as in
+        ``images.generate_derivatives``.
+        """
+        if not batch:
+            return []
+        now = timezone.now()
+        with transaction.atomic():
+            current = dict(
+                Product.objects.select_for_update()
+                .filter(pk__in=[pk for pk, _, _ in batch])
+                .values_list("pk", "image")
+            )
+            products = [
+                Product(pk=pk, image_variants=variants, updated_at=now)
+                for pk, name, variants in batch
+                if current.get(pk) == name
+            ]
+            Product.objects.bulk_update(products, ["image_variants", "updated_at"])
+        return [product.pk for product in products]
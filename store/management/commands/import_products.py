@@ -0,0 +1,59 @@
+import time
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from store import catalog_import
+
+
+class Command(BaseCommand):
+    help = "Create or update products, keyed on sku, from a CSV or JSON Lines file"
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="CSV or JSON Lines file to import")
+        parser.add_argument(
+            "--format",
+            choices=["csv", "jsonl"],
+            help="Input format (default: from the file extension)",
+        )
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        path = Path(options["path"])
+        format = options["format"] or (
+            "csv" if path.suffix.lower() == ".csv" else "jsonl"
+        )
+        started = time.perf_counter()
+
+        def progress(result):
+            elapsed = time.perf_counter() - started
+            self.stdout.write(
+                f"{result.rows} rows, {result.imported} imported "
+                f"({result.rows / elapsed:.0f} rows/s)"
+            )
+
+        try:
+            with path.open(newline="", encoding="utf-8") as file:
+                result = catalog_import.import_products(
+                    catalog_import.read_rows(file, format),
+                    batch_size=options["batch_size"],
+                    progress=progress,
+                )
+        except OSError as error:
+            raise CommandError(error)
+
+        for line_number, message in result.errors:
+            self.stderr.write(f"Line {line_number}: {message}")
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Imported {result.imported} of {result.rows} rows in {elapsed:.2f}s "
+                f"({result.rows / elapsed:.0f} rows/s), {len(result.errors)} skipped"
+            )
+        )
+        if result.imported:
+            self.stdout.write(
+                "Run generate_image_derivatives to make the responsive images "
+                "of new or changed product images"
+            )
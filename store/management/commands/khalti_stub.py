@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from store.khalti_stub import StubKhaltiServer
+
+
+class Command(BaseCommand):
+    help = (
+        "Run a stand-in for the Khalti gateway; point KHALTI_BASE_URL at it "
+        "to take payments without Khalti"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--host", default="127.0.0.1")
+        parser.add_argument("--port", type=int, default=8001)
+        parser.add_argument(
+            "--latency-ms", type=float, default=0, help="delay of every answer"
+        )
+
+    def handle(self, *args, **options):
+        server = StubKhaltiServer(
+            options["host"], options["port"], options["latency_ms"] / 1000
+        )
+        self.stdout.write(f"Khalti stub listening on {server.url}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
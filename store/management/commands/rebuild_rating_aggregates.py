@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from store import ratings
+
+
+class Command(BaseCommand):
+    help = "Recompute the rating count, sum, average and histogram of every product"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        rated = ratings.rebuild(batch_size=options["batch_size"])
+        self.stdout.write(self.style.SUCCESS(f"Updated {rated} rated products"))
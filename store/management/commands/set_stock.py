@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from store import inventory
+from store.models import Product
+
+
+class Command(BaseCommand):
+    help = "Set a product's stock, spread over its stock shards"
+
+    def add_arguments(self, parser):
+        parser.add_argument("product", help="product id or SKU")
+        parser.add_argument("quantity", type=int, nargs="?")
+        parser.add_argument("--shards", type=int)
+        parser.add_argument(
+            "--untrack", action="store_true", help="stop tracking the product's stock"
+        )
+
+    def handle(self, *args, **options):
+        product = (
+            Product.objects.filter(sku=options["product"]).first()
+            or Product.objects.filter(
+                pk=int(options["product"]) if options["product"].isdigit() else None
+            ).first()
+        )
+        if product is None:
+            raise CommandError(f"No product {options['product']}")
+
+        if options["untrack"]:
+            inventory.stop_tracking(product.pk)
+            self.stdout.write(self.style.SUCCESS(f"{product} is no longer tracked"))
+            return
+        if options["quantity"] is None or options["quantity"] < 0:
+            raise CommandError("Give a quantity of 0 or more")
+
+        inventory.set_stock(product.pk, options["quantity"], options["shards"])
+        self.stdout.write(
+            self.style.SUCCESS(f"{product} has {options['quantity']} in stock")
+        )
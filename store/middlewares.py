@@ -0,0 +1,11 @@
+from django.utils.deprecation import MiddlewareMixin
+
+
+class AnonymousCartMiddleware(MiddlewareMixin):
+    """Write back the cart cookie of anonymous visitors whose cart changed."""
+
+    def process_response(self, request, response):
+        cart = getattr(request, "_anonymous_cart", None)
+        if cart is not None:
+            cart.save(response)
+        return response
@@ -0,0 +1,72 @@
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+
+    if connection.vendor == "sqlite":
+        schema_editor.execute(
+            "CREATE VIRTUAL TABLE store_product_fts USING fts5("
+            "name, description, categories, tokenize='unicode61 remove_diacritics 2')"
+        )
+    elif connection.vendor == "postgresql":
+        schema_editor.execute(
+            "CREATE TABLE store_product_search ("
+            "product_id integer PRIMARY KEY "
+            "REFERENCES store_product (id) ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED, "
+            "document tsvector NOT NULL)"
+        )
+        schema_editor.execute(
+            "CREATE INDEX store_product_search_document_gin "
+            "ON store_product_search USING GIN (document)"
+        )
+    else:
+        return
+
+    Product = apps.get_model("store", "Product")
+    Category = apps.get_model("store", "Category")
+    category_names = dict(Category.objects.values_list("pk", "name"))
+    through = Product.categories.through
+
+    for product in Product.objects.only("pk", "name", "description").iterator():
+        categories = " ".join(
+            category_names[category_id]
+            for category_id in through.objects.filter(
+                product_id=product.pk
+            ).values_list("category_id", flat=True)
+        )
+        if connection.vendor == "sqlite":
+            schema_editor.execute(
+                "INSERT INTO store_product_fts (rowid, name, description, categories) "
+                "VALUES (%s, %s, %s, %s)",
+                [product.pk, product.name, product.description or "", categories],
+            )
+        else:
+            schema_editor.execute(
+                "INSERT INTO store_product_search (product_id, document) VALUES ("
+                "%s, "
+                "setweight(to_tsvector('simple', %s), 'A') || "
+                "setweight(to_tsvector('simple', %s), 'C') || "
+                "setweight(to_tsvector('simple', %s), 'B'))",
+                [product.pk, product.name, product.description or "", categories],
+            )
+
+
+def drop_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+
+    if connection.vendor == "sqlite":
+        schema_editor.execute("DROP TABLE IF EXISTS store_product_fts")
+    elif connection.vendor == "postgresql":
+        schema_editor.execute("DROP TABLE IF EXISTS store_product_search")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("store", "0017_alter_product_name"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 6.0 on 2026-10-18 19:28
+
+from django.db import migrations, models
+from django.db.models import Count, Min, Sum
+
+
+def merge_duplicate_cart_products(apps, schema_editor):
+    CartProduct = apps.get_model("store", "CartProduct")
+
+    duplicates = (
+        CartProduct.objects.values("cart_id", "product_id")
+        .annotate(rows=Count("id"), first=Min("id"), total=Sum("quantity"))
+        .filter(rows__gt=1)
+    )
+    for row in duplicates:
+        CartProduct.objects.filter(pk=row["first"]).update(quantity=row["total"])
+        CartProduct.objects.filter(
+            cart_id=row["cart_id"], product_id=row["product_id"]
+        ).exclude(pk=row["first"]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("store", "0023_product_updated_at_index"),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_cart_products, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name="cartproduct",
+            constraint=models.UniqueConstraint(
+                fields=("cart", "product"), name="unique_cart_product"
+            ),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 6.0 on 2026-10-18 20:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("store", "0027_catalogversion"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="WorkerIdLease",
+            fields=[
+                (
+                    "worker_id",
+                    models.PositiveSmallIntegerField(primary_key=True, serialize=False),
+                ),
+                ("holder", models.CharField(max_length=255)),
+                ("expires_at", models.DateTimeField()),
+            ],
+        ),
+    ]
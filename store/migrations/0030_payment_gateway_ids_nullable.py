@@ -0,0 +1,31 @@
+# Generated by Django 6.0 on 2026-10-18 20:20
+
+from django.db import migrations, models
+
+
+def blank_ids_to_null(apps, schema_editor):
+    Payment = apps.get_model("store", "Payment")
+
+    Payment.objects.filter(pidx="").update(pidx=None)
+    Payment.objects.filter(transaction_id="").update(transaction_id=None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("store", "0029_idempotencyrecord"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="payment",
+            name="pidx",
+            field=models.CharField(blank=True, max_length=100, null=True, unique=True),
+        ),
+        migrations.AlterField(
+            model_name="payment",
+            name="transaction_id",
+            field=models.CharField(blank=True, max_length=100, null=True, unique=True),
+        ),
+        migrations.RunPython(blank_ids_to_null, migrations.RunPython.noop),
+    ]
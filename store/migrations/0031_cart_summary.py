@@ -0,0 +1,35 @@
+# Generated by Django 6.0 on 2026-10-18 20:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("store", "0030_payment_gateway_ids_nullable"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="cart",
+            name="revision",
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="cart",
+            name="summary_count",
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="cart",
+            name="summary_total",
+            field=models.DecimalField(
+                blank=True, decimal_places=2, max_digits=12, null=True
+            ),
+        ),
+        migrations.AddField(
+            model_name="cart",
+            name="summary_version",
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 6.0 on 2026-10-18 20:29
+
+from django.db import migrations, models
+
+
+def mark_purchased_orders(apps, schema_editor):
+    # already counted, by their own task or by a rebuild
+    Order = apps.get_model("store", "Order")
+
+    Order.objects.filter(status__in=["paid", "on_the_way", "delivered"]).update(
+        related_recorded=True
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("store", "0031_cart_summary"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="order",
+            name="related_recorded",
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.RunPython(mark_purchased_orders, migrations.RunPython.noop),
+    ]
@@ -13,24 +13,71 @@ class Category(models.Model):
 
 
 class Product(models.Model):
+    # merchandising's stock keeping unit; the key of bulk imports
+    sku = models.CharField(max_length=64, unique=True, null=True, blank=True)
     name = models.CharField(max_length=100, db_index=True)
     price = models.DecimalField(max_digits=10, decimal_places=2, default=0.0)
     image = models.ImageField(upload_to="products/")
+    # resized copies of image, written by store.images
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
     featured = models.BooleanField(default=False)
     description = models.TextField(null=True, blank=True)
 
     created_at = models.DateTimeField(auto_now_add=True)
-    updated_at = models.DateTimeField(auto_now=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     categories = models.ManyToManyField(Category)
 
+    # review aggregates, maintained by store.ratings
+    rating_count = models.PositiveIntegerField(default=0)
+    rating_sum = models.PositiveIntegerField(default=0)
+    rating_average = models.FloatField(default=0.0, db_index=True)
+    rating_1 = models.PositiveIntegerField(default=0)
+    rating_2 = models.PositiveIntegerField(default=0)
+    rating_3 = models.PositiveIntegerField(default=0)
+    rating_4 = models.PositiveIntegerField(default=0)
+    rating_5 = models.PositiveIntegerField(default=0)
+
     def __str__(self):
         return self.name
 
+    @property
+    def rating_histogram(self):
+        """``(stars, count)`` pairs, 5 stars first."""
+        return [(stars, getattr(self, f"rating_{stars}")) for stars in range(5, 0, -1)]
+
+    def _image_variants(self, kind):
+        # variants of a replaced image are stale until the task catches up
+        if self.image_variants.get("source") != self.image.name:
+            return []
+        return self.image_variants.get(kind, [])
+
+    @property
+    def image_srcset(self):
+        from .images import srcset
+
+        return srcset(self._image_variants("fallback"))
+
+    @property
+    def image_webp_srcset(self):
+        from .images import srcset
+
+        return srcset(self._image_variants("webp"))
+
 
 class Cart(models.Model):
     user = models.OneToOneField("accounts.CustomUser", on_delete=models.CASCADE)
 
+    # the navbar summary while no shared cache holds it (see store.carts),
+    # worked out at catalog version summary_version; revision moves with
+    # every change of the cart, so a summary of an older cart is not stored
+    summary_count = models.PositiveIntegerField(null=True, blank=True)
+    summary_total = models.DecimalField(
+        max_digits=12, decimal_places=2, null=True, blank=True
+    )
+    summary_version = models.BigIntegerField(null=True, blank=True)
+    revision = models.PositiveBigIntegerField(default=0)
+
     def __str__(self):
         return f"{self.user.email}'s cart"
 
@@ -42,6 +89,13 @@ class CartProduct(models.Model):
 
     added_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["cart", "product"], name="unique_cart_product"
+            )
+        ]
+
     @property
     def get_total_price(self):
         return self.quantity * self.product.price
@@ -77,6 +131,9 @@ class Order(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    # its basket is counted in RelatedProduct, see store.recommendations
+    related_recorded = models.BooleanField(default=False, editable=False)
+
     # delivery_person
     delivery_person = models.ForeignKey(
         "accounts.DeliveryPerson", on_delete=models.PROTECT, null=True, blank=True
@@ -139,9 +196,12 @@ class Payment(models.Model):
 
     purchase_order_id = models.CharField(max_length=100, unique=True)
 
-    # from khati
-    transaction_id = models.CharField(max_length=100, unique=True)
-    pidx = models.CharField(max_length=100, unique=True)
+    # from khati; empty until the gateway hands them out, and NULL rather
+    # than "" so unique still allows more than one such payment
+    transaction_id = models.CharField(
+        max_length=100, unique=True, null=True, blank=True
+    )
+    pidx = models.CharField(max_length=100, unique=True, null=True, blank=True)
     amount = models.DecimalField(max_digits=10, decimal_places=2)
 
     paid_at = models.DateTimeField(null=True, blank=True)
@@ -173,3 +233,147 @@ class Review(models.Model):
 
     def __str__(self):
         return f"{self.user.email} -> {self.product.name}"
+
+
+class RelatedProduct(models.Model):
+    """Co-purchase similarity, maintained by ``store.recommendations``."""
+
+    product = models.ForeignKey(
+        Product, on_delete=models.CASCADE, related_name="related_links"
+    )
+    related = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="+")
+
+    co_purchases = models.PositiveIntegerField(default=0)
+    score = models.FloatField(default=0.0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["product", "related"], name="unique_related_product"
+            )
+        ]
+        indexes = [
+            models.Index(fields=["product", "-score"], name="related_product_score_idx")
+        ]
+
+    def __str__(self):
+        return f"{self.product.name} -> {self.related.name} ({self.score:.2f})"
+
+
+class StockShard(models.Model):
+    """
+    One slice of a product's stock, see ``store.inventory``. Products
+    without shards are not stock-tracked.
+    """
+
+    product = models.ForeignKey(
+        Product, on_delete=models.CASCADE, related_name="stock_shards"
+    )
+    shard = models.PositiveSmallIntegerField()
+    quantity = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["product", "shard"], name="unique_stock_shard"
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.product.name} #{self.shard}: {self.quantity}"
+
+
+class StockReservation(models.Model):
+    """Stock taken from a shard for an order, given back if the order falls through."""
+
+    order = models.ForeignKey(
+        Order, on_delete=models.CASCADE, related_name="stock_reservations"
+    )
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="+")
+    shard = models.PositiveSmallIntegerField()
+    quantity = models.PositiveIntegerField()
+
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.order.order_id}: {self.product.name} x {self.quantity}"
+
+
+class QueuedCheckout(models.Model):
+    """A checkout waiting for a worker to write its order, see ``store.orders``."""
+
+    class Status(models.TextChoices):
+        QUEUED = "queued", "Queued"
+        PLACED = "placed", "Placed"
+        FAILED = "failed", "Failed"
+
+    order_id = models.CharField(max_length=30, unique=True)
+    user = models.ForeignKey(
+        "accounts.CustomUser", on_delete=models.CASCADE, related_name="+"
+    )
+    # [[product id, quantity], ...] as the cart was at checkout
+    items = models.JSONField()
+    status = models.CharField(
+        max_length=20, choices=Status.choices, default=Status.QUEUED
+    )
+    message = models.CharField(max_length=255, blank=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.order_id} ({self.get_status_display()})"
+
+
+class CatalogVersion(models.Model):
+    """The one row holding the catalog version, see ``store.catalog``."""
+
+    value = models.BigIntegerField()
+
+    def __str__(self):
+        return str(self.value)
+
+
+class WorkerIdLease(models.Model):
+    """An order id worker id held by one process, see ``store.utils``."""
+
+    worker_id = models.PositiveSmallIntegerField(primary_key=True)
+    # host, process id and a random part of the process holding it
+    holder = models.CharField(max_length=255)
+    expires_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.worker_id}: {self.holder}"
+
+
+class IdempotencyRecord(models.Model):
+    """A POST run under a client's idempotency key, see ``store.idempotency``."""
+
+    class Status(models.TextChoices):
+        PENDING = "pending", "Pending"
+        DONE = "done", "Done"
+
+    user = models.ForeignKey(
+        "accounts.CustomUser", on_delete=models.CASCADE, related_name="+"
+    )
+    # sha256 of the path and the client's token
+    key = models.CharField(max_length=64)
+    status = models.CharField(
+        max_length=20, choices=Status.choices, default=Status.PENDING
+    )
+    # the response replayed for repeats, once done
+    status_code = models.PositiveSmallIntegerField(null=True)
+    content = models.BinaryField(default=b"")
+    headers = models.JSONField(default=dict)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "key"], name="unique_idempotency_key"
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.user_id}: {self.key} ({self.status})"
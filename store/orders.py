@@ -0,0 +1,150 @@
+"""
+Turning a cart into an order.
+
+``create_order`` writes the order in a fixed number of queries whatever
+the size of the cart: one locked read of the cart lines with their
+products, one insert of the order, the stock reservation (see
+``store.inventory``), one ``bulk_create`` of its items and one delete of
+the cart lines. Prices are copied from the locked read, so the order total
+and its items agree.
+
+With ``CHECKOUT_QUEUED`` on, checkout only validates the cart and moves it
+into a ``QueuedCheckout`` (``enqueue_order``); a ``process_tasks --queue
+checkout`` worker writes the order later (``place_queued_order``). The
+number of such workers bounds how many orders are written at once, so a
+burst of checkouts queues up instead of tying up web workers.
+"""
+
+from decimal import Decimal
+
+from django.db import transaction
+
+from . import inventory
+
+
+class EmptyCart(Exception):
+    """There is nothing in the cart to order."""
+
+
+def _write_order(user, order_id, lines):
+    """Order ``(product, quantity)`` pairs for ``user``."""
+    from .models import Order, OrderItem
+
+    subtotal = sum(
+        (product.price * quantity for product, quantity in lines), Decimal(0)
+    )
+    order = Order.objects.create(
+        user=user, order_id=order_id, subtotal=subtotal, total=subtotal
+    )
+    wanted = {}
+    for product, quantity in lines:
+        wanted[product.pk] = wanted.get(product.pk, 0) + quantity
+    inventory.reserve(order, wanted)
+    OrderItem.objects.bulk_create(
+        [
+            OrderItem(
+                order=order,
+                product=product,
+                product_name=product.name,
+                price=product.price,
+                quantity=quantity,
+            )
+            for product, quantity in lines
+        ]
+    )
+    return order
+
+
+def create_order(user, order_id):
+    """
+    Order everything in ``user``'s ``CartProduct`` rows and empty them.
+    Raises ``inventory.OutOfStock``, leaving everything as it was.
+    """
+    from .models import CartProduct
+
+    with transaction.atomic():
+        cart_products = CartProduct.objects.filter(cart__user=user)
+        lines = list(
+            cart_products.select_for_update(of=("self",)).select_related("product")
+        )
+        if not lines:
+            raise EmptyCart(user.pk)
+
+        order = _write_order(
+            user, order_id, [(line.product, line.quantity) for line in lines]
+        )
+        cart_products.filter(pk__in=[line.pk for line in lines]).delete()
+    return order
+
+
+def enqueue_order(user, order_id, items):
+    """
+    Move ``items`` (the cart's ``{product id: quantity}``) out of the cart
+    into a ``QueuedCheckout`` for a worker to order as ``order_id``. Products that are
+    clearly short of stock fail here already, with ``inventory.OutOfStock``.
+    """
+    from .models import CartProduct, QueuedCheckout
+    from .tasks import place_queued_order_task
+
+    if not items:
+        raise EmptyCart(user.pk)
+    stock = inventory.available(list(items))
+    short = [pk for pk, units in stock.items() if units < items[pk]]
+    if short:
+        raise inventory.OutOfStock(short)
+
+    with transaction.atomic():
+        checkout = QueuedCheckout.objects.create(
+            order_id=order_id, user=user, items=list(items.items())
+        )
+        CartProduct.objects.filter(cart__user=user).delete()
+        transaction.on_commit(lambda: place_queued_order_task(checkout.pk))
+    return checkout
+
+
+def place_queued_order(checkout_id):
+    """
+    Write the order of a ``QueuedCheckout``. If it cannot be placed, the
+    items go back into the user's cart and the checkout records why.
+    """
+    from .carts import get_backend
+    from .models import Product, QueuedCheckout
+
+    with transaction.atomic():
+        checkout = (
+            QueuedCheckout.objects.select_for_update()
+            .select_related("user")
+            .filter(pk=checkout_id, status=QueuedCheckout.Status.QUEUED)
+            .first()
+        )
+        if checkout is None:
+            # already handled by an earlier attempt
+            return
+
+        items = dict(checkout.items)
+        products = Product.objects.in_bulk(list(items))
+        lines = [
+            (products[product_id], quantity)
+            for product_id, quantity in items.items()
+            if product_id in products
+        ]
+        try:
+            if not lines:
+                raise EmptyCart(checkout.user_id)
+            with transaction.atomic():
+                _write_order(checkout.user, checkout.order_id, lines)
+        except inventory.OutOfStock as e:
+            names = [products[pk].name for pk in e.product_ids if pk in products]
+            checkout.status = QueuedCheckout.Status.FAILED
+            checkout.message = f"Not enough stock for: {', '.join(names)}"
+        except EmptyCart:
+            checkout.status = QueuedCheckout.Status.FAILED
+            checkout.message = "The products in your cart are no longer sold"
+        else:
+            checkout.status = QueuedCheckout.Status.PLACED
+        checkout.save(update_fields=["status", "message", "updated_at"])
+
+    if checkout.status == QueuedCheckout.Status.FAILED and lines:
+        get_backend().apply(
+            checkout.user_id, {product.pk: quantity for product, quantity in lines}
+        )
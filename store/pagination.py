@@ -0,0 +1,160 @@
+"""
+Keyset (cursor) pagination for product listings.
+
+Unlike ``django.core.paginator.Paginator`` this never runs ``COUNT(*)`` or
+``OFFSET``: every page is one indexed range query that seeks past the last
+row of the previous page, so page 5,000 costs the same as page 1.
+
+Cursors are opaque signed tokens holding the sort values of the boundary row,
+the direction to move in and the page number (for display only).
+"""
+
+from django.core import signing
+from django.core.paginator import Paginator
+from django.db.models import Q
+
+CURSOR_SALT = "store.pagination.cursor"
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+def encode_cursor(values, direction, number):
+    return signing.dumps(
+        {"v": [str(value) for value in values], "d": direction, "n": number},
+        salt=CURSOR_SALT,
+        compress=True,
+    )
+
+
+def decode_cursor(token):
+    try:
+        data = signing.loads(token, salt=CURSOR_SALT)
+        return data["v"], data["d"], int(data["n"])
+    except (signing.BadSignature, KeyError, TypeError, ValueError):
+        raise InvalidCursor(token)
+
+
+class KeysetPage:
+    is_keyset = True
+
+    def __init__(self, object_list, number, next_token, previous_token, paginator):
+        self.object_list = object_list
+        self.number = number
+        self.next_token = next_token
+        self.previous_token = previous_token
+        self.paginator = paginator
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.next_token is not None
+
+    def has_previous(self):
+        return self.number > 1
+
+    def has_other_pages(self):
+        return self.has_previous() or self.has_next()
+
+    def page_strip(self):
+        """
+        Elided page numbers around the current page, e.g. ``[1, "…", 41, 42,
+        43, "…"]``. Only neighbours are reachable by cursor, so the strip
+        never grows with the size of the catalog.
+        """
+        ellipsis = self.paginator.ELLIPSIS
+        strip = []
+        if self.number > 2:
+            strip.append(1)
+        if self.number > 3:
+            strip.append(ellipsis)
+        if self.has_previous():
+            strip.append(self.number - 1)
+        strip.append(self.number)
+        if self.has_next():
+            strip.extend([self.number + 1, ellipsis])
+        return strip
+
+
+class KeysetPaginator:
+    """
+    Paginate ``queryset`` by ``ordering``, a sequence of field names such as
+    ``("-price", "-pk")``. The last field must be unique (normally ``pk``) so
+    that every row has a distinct position.
+    """
+
+    ELLIPSIS = Paginator.ELLIPSIS
+
+    def __init__(self, queryset, per_page, ordering):
+        self.queryset = queryset
+        self.per_page = per_page
+        self.ordering = tuple(ordering)
+
+    def _fields(self):
+        return [field.lstrip("-") for field in self.ordering]
+
+    def _seek(self, values, forward):
+        """Build the "rows after (values)" filter for the given direction."""
+        condition = Q()
+        equal = {}
+        for field, value in zip(self.ordering, values):
+            name = field.lstrip("-")
+            descending = field.startswith("-")
+            lookup = "lt" if descending == forward else "gt"
+            condition |= Q(**equal, **{f"{name}__{lookup}": value})
+            equal[name] = value
+        return condition
+
+    def _reversed_ordering(self):
+        return [
+            field[1:] if field.startswith("-") else f"-{field}"
+            for field in self.ordering
+        ]
+
+    def _values(self, obj):
+        return [getattr(obj, field) for field in self._fields()]
+
+    def get_page(self, token=None):
+        number = 1
+        forward = True
+        queryset = self.queryset.order_by(*self.ordering)
+
+        if token:
+            try:
+                values, direction, number = decode_cursor(token)
+            except InvalidCursor:
+                values, direction, number = None, "n", 1
+            if values is not None and len(values) == len(self.ordering):
+                forward = direction == "n"
+                queryset = self.queryset.filter(self._seek(values, forward))
+                queryset = queryset.order_by(
+                    *(self.ordering if forward else self._reversed_ordering())
+                )
+            else:
+                number = 1
+
+        rows = list(queryset[: self.per_page + 1])
+        has_more = len(rows) > self.per_page
+        rows = rows[: self.per_page]
+        if not forward:
+            rows.reverse()
+
+        next_token = previous_token = None
+        if rows:
+            if forward and has_more or not forward:
+                next_token = encode_cursor(self._values(rows[-1]), "n", number + 1)
+            if number > 1:
+                previous_token = encode_cursor(self._values(rows[0]), "p", number - 1)
+        if not forward and not has_more:
+            # walked back to the first row; the cursor's page number may be stale
+            number = 1
+            previous_token = None
+            if rows:
+                next_token = encode_cursor(self._values(rows[-1]), "n", 2)
+
+        return KeysetPage(rows, number, next_token, previous_token, self)
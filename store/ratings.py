@@ -0,0 +1,112 @@
+"""
+Review aggregates stored on ``Product``.
+
+Every product carries its review count, rating sum, average and a 1-5 star
+histogram, so listings can show, sort and filter by rating without touching
+``Review``. ``apply_rating_change`` patches them with one ``UPDATE`` in the
+same transaction as the review write; ``rebuild`` recomputes them in bulk.
+"""
+
+from django.db import transaction
+from django.db.models import Case, Count, F, FloatField, Q, Sum, When
+from django.db.models.functions import Cast
+from django.utils import timezone
+
+from .models import Product, Review
+
+STARS = range(1, 6)
+
+
+def apply_rating_change(product_id, old=None, new=None):
+    """
+    Move one review of ``product_id`` from rating ``old`` to ``new``; ``old``
+    is ``None`` for a new review and ``new`` is ``None`` for a deleted one.
+    """
+    if old == new:
+        return
+
+    count_delta = (new is not None) - (old is not None)
+    sum_delta = (new or 0) - (old or 0)
+    count = F("rating_count") + count_delta
+    total = F("rating_sum") + sum_delta
+
+    updates = {
+        "rating_count": count,
+        "rating_sum": total,
+        # every right hand side sees the row as it was before this UPDATE
+        "rating_average": Case(
+            When(
+                Q(rating_count__gt=-count_delta),
+                then=Cast(total, FloatField()) / count,
+            ),
+            default=0.0,
+            output_field=FloatField(),
+        ),
+        # bumping updated_at retires cached cards showing the old rating
+        "updated_at": timezone.now(),
+    }
+    if old is not None:
+        updates[f"rating_{old}"] = F(f"rating_{old}") - 1
+    if new is not None:
+        updates[f"rating_{new}"] = F(f"rating_{new}") + 1
+
+    Product.objects.filter(pk=product_id).update(**updates)
+
+    from .signals import catalog_changed
+
+    catalog_changed([product_id])
+
+
+def rebuild(batch_size=1000):
+    """Recompute every product's aggregates from ``Review``; returns products rated."""
+    aggregates = (
+        Review.objects.values("product_id")
+        .annotate(
+            count=Count("id"),
+            total=Sum("rating"),
+            **{
+                f"stars_{stars}": Count("id", filter=Q(rating=stars)) for stars in STARS
+            },
+        )
+        .order_by("product_id")
+    )
+
+    fields = ["rating_count", "rating_sum", "rating_average", "updated_at"] + [
+        f"rating_{stars}" for stars in STARS
+    ]
+    now = timezone.now()
+    rated = 0
+
+    with transaction.atomic():
+        Product.objects.filter(rating_count__gt=0).update(
+            rating_count=0,
+            rating_sum=0,
+            rating_average=0.0,
+            updated_at=now,
+            **{f"rating_{stars}": 0 for stars in STARS},
+        )
+
+        batch = []
+        for row in aggregates.iterator(chunk_size=batch_size):
+            product = Product(
+                pk=row["product_id"],
+                rating_count=row["count"],
+                rating_sum=row["total"],
+                rating_average=row["total"] / row["count"],
+                updated_at=now,
+                **{f"rating_{stars}": row[f"stars_{stars}"] for stars in STARS},
+            )
+            batch.append(product)
+            if len(batch) >= batch_size:
+                Product.objects.bulk_update(batch, fields)
+                rated += len(batch)
+                batch = []
+        if batch:
+            Product.objects.bulk_update(batch, fields)
+            rated += len(batch)
+
+        from .signals import catalog_changed
+
+        catalog_changed(None)
+
+    return rated
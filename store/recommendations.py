@@ -0,0 +1,155 @@
+"""
+Co-purchase ("customers also bought") recommendations.
+
+Orders are treated as a sparse order x product incidence matrix ``X``; the
+item-to-item co-occurrence matrix is ``C = Xᵀ X``, computed a basket at a
+time into a dict-of-dicts. Pairs are scored with cosine similarity,
+``C[i][j] / sqrt(C[i][i] * C[j][j])``, and the best ``RELATED_PRODUCTS_KEEP``
+per product are stored in ``RelatedProduct`` for ``product_detail`` to read
+with one indexed query.
+
+``rebuild`` is the batch job (``manage.py build_related_products``);
+``record_order`` folds a single newly paid order in between batch runs.
+Each order is counted once: ``Order.related_recorded`` is set in the same
+transaction as its counts, so a retried task or a rebuild that already
+counted the order leaves the table alone.
+"""
+
+import math
+from collections import defaultdict
+from itertools import permutations
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count
+
+from .models import Order, OrderItem, RelatedProduct
+
+# orders that count as purchases
+PURCHASED_STATUSES = [
+    Order.Status.PAID,
+    Order.Status.ON_THE_WAY,
+    Order.Status.DELIVERED,
+]
+
+
+def baskets():
+    """Yield the set of product ids of every purchased order."""
+    rows = (
+        OrderItem.objects.filter(order__status__in=PURCHASED_STATUSES)
+        .values_list("order_id", "product_id")
+        .order_by("order_id")
+    )
+    current_order, basket = None, set()
+    for order_id, product_id in rows.iterator(chunk_size=5000):
+        if order_id != current_order:
+            if basket:
+                yield basket
+            current_order, basket = order_id, set()
+        basket.add(product_id)
+    if basket:
+        yield basket
+
+
+def co_occurrence(baskets):
+    """
+    Sparse ``Xᵀ X`` for the given baskets: ``matrix[i][j]`` is the number of
+    baskets holding both ``i`` and ``j``; the diagonal counts baskets with ``i``.
+    """
+    matrix = defaultdict(lambda: defaultdict(int))
+    for basket in baskets:
+        for product_id in basket:
+            matrix[product_id][product_id] += 1
+        for i, j in permutations(basket, 2):
+            matrix[i][j] += 1
+    return matrix
+
+
+def similarity(co_purchases, count_i, count_j):
+    return co_purchases / math.sqrt(count_i * count_j)
+
+
+def rebuild():
+    """Recompute the whole related products table; returns the rows written."""
+    matrix = co_occurrence(baskets())
+    keep = settings.RELATED_PRODUCTS_KEEP
+
+    rows = []
+    for i, row in matrix.items():
+        scored = [
+            (similarity(count, row[i], matrix[j][j]), j, count)
+            for j, count in row.items()
+            if j != i
+        ]
+        scored.sort(reverse=True)
+        rows.extend(
+            RelatedProduct(product_id=i, related_id=j, co_purchases=count, score=score)
+            for score, j, count in scored[:keep]
+        )
+
+    with transaction.atomic():
+        RelatedProduct.objects.all().delete()
+        RelatedProduct.objects.bulk_create(rows, batch_size=1000)
+        Order.objects.filter(
+            status__in=PURCHASED_STATUSES, related_recorded=False
+        ).update(related_recorded=True)
+    return len(rows)
+
+
+def record_order(order_id):
+    """
+    Add one newly purchased order to the table: bump the co-purchase counts of
+    its product pairs and rescore them. Scores of pairs outside the order are
+    left to the next batch rebuild. Does nothing for an order already counted.
+    """
+    basket = set(
+        OrderItem.objects.filter(order_id=order_id).values_list("product_id", flat=True)
+    )
+
+    with transaction.atomic():
+        if not Order.objects.filter(pk=order_id, related_recorded=False).update(
+            related_recorded=True
+        ):
+            return
+        if len(basket) < 2:
+            return
+
+        counts = dict(
+            OrderItem.objects.filter(
+                order__status__in=PURCHASED_STATUSES, product_id__in=basket
+            )
+            .values_list("product_id")
+            .annotate(orders=Count("order_id", distinct=True))
+        )
+
+        # pairs new to the table first, so that every pair has a row to lock;
+        # a concurrent order creating the same pair is no conflict then
+        RelatedProduct.objects.bulk_create(
+            [
+                RelatedProduct(product_id=i, related_id=j, co_purchases=0)
+                for i, j in permutations(basket, 2)
+            ],
+            ignore_conflicts=True,
+        )
+        links = list(
+            RelatedProduct.objects.select_for_update().filter(
+                product_id__in=basket, related_id__in=basket
+            )
+        )
+        for link in links:
+            link.co_purchases += 1
+            link.score = similarity(
+                link.co_purchases,
+                counts.get(link.product_id, 1),
+                counts.get(link.related_id, 1),
+            )
+        RelatedProduct.objects.bulk_update(links, ["co_purchases", "score"])
+
+
+def related_products(product, limit=4):
+    links = (
+        RelatedProduct.objects.filter(product=product)
+        .select_related("related")
+        .order_by("-score")[:limit]
+    )
+    return [link.related for link in links]
@@ -0,0 +1,260 @@
+"""
+Full-text search over products.
+
+The index lives next to the catalog tables and is kept current by the
+receivers in ``store.signals``:
+
+- SQLite: an FTS5 virtual table (``store_product_fts``) whose rowid is the
+  product id, ranked with ``bm25``.
+- PostgreSQL: a ``tsvector`` table (``store_product_search``) with a GIN
+  index, ranked with ``ts_rank``.
+
+Any other backend has no index; ``search_product_ids`` returns ``None`` and
+callers fall back to a plain ``icontains`` filter.
+"""
+
+import re
+
+from django.db import connection
+from django.db.models.expressions import RawSQL
+
+SQLITE_TABLE = "store_product_fts"
+POSTGRES_TABLE = "store_product_search"
+
+# bm25 is lower-is-better; name outweighs categories outweighs text
+SQLITE_RANK = f"bm25({SQLITE_TABLE}, 10.0, 1.0, 5.0)"
+POSTGRES_RANK = "ts_rank(document, to_tsquery('simple', %s)) DESC"
+
+TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def is_supported(using=connection):
+    return using.vendor in ("sqlite", "postgresql")
+
+
+def tokenize(query):
+    return TOKEN_RE.findall((query or "").lower())
+
+
+def _documents(product_ids):
+    """
+    Return ``(product_id, name, description, category names)`` rows for the
+    given products, with category names joined by spaces.
+    """
+    from .models import Product
+
+    category_names = {}
+    through = Product.categories.through
+    for product_id, category_name in through.objects.filter(
+        product_id__in=product_ids
+    ).values_list("product_id", "category__name"):
+        category_names.setdefault(product_id, []).append(category_name)
+
+    rows = Product.objects.filter(pk__in=product_ids).values_list(
+        "pk", "name", "description"
+    )
+    return [
+        (pk, name, description or "", " ".join(category_names.get(pk, [])))
+        for pk, name, description in rows
+    ]
+
+
+def index_products(product_ids):
+    """(Re)index the given products; ids that no longer exist are dropped."""
+    product_ids = list(product_ids)
+    if not product_ids or not is_supported():
+        return
+
+    documents = _documents(product_ids)
+    remove_products(product_ids)
+
+    with connection.cursor() as cursor:
+        if connection.vendor == "sqlite":
+            cursor.executemany(
+                f"INSERT INTO {SQLITE_TABLE} (rowid, name, description, categories) "
+                "VALUES (%s, %s, %s, %s)",
+                documents,
+            )
+        else:
+            cursor.executemany(
+                f"INSERT INTO {POSTGRES_TABLE} (product_id, document) VALUES ("
+                "%s, "
+                "setweight(to_tsvector('simple', %s), 'A') || "
+                "setweight(to_tsvector('simple', %s), 'C') || "
+                "setweight(to_tsvector('simple', %s), 'B'))",
+                documents,
+            )
+
+
+def index_product(product):
+    index_products([product.pk])
+
+
+def remove_products(product_ids):
+    product_ids = list(product_ids)
+    if not product_ids or not is_supported():
+        return
+
+    placeholders = ", ".join(["%s"] * len(product_ids))
+    with connection.cursor() as cursor:
+        if connection.vendor == "sqlite":
+            cursor.execute(
+                f"DELETE FROM {SQLITE_TABLE} WHERE rowid IN ({placeholders})",
+                product_ids,
+            )
+        else:
+            cursor.execute(
+                f"DELETE FROM {POSTGRES_TABLE} WHERE product_id IN ({placeholders})",
+                product_ids,
+            )
+
+
+def rebuild_index(batch_size=1000):
+    """Drop every indexed document and index the whole catalog again."""
+    from .models import Product
+
+    if not is_supported():
+        return 0
+
+    with connection.cursor() as cursor:
+        table = SQLITE_TABLE if connection.vendor == "sqlite" else POSTGRES_TABLE
+        cursor.execute(f"DELETE FROM {table}")
+
+    indexed = 0
+    batch = []
+    for pk in Product.objects.values_list("pk", flat=True).iterator(
+        chunk_size=batch_size
+    ):
+        batch.append(pk)
+        if len(batch) >= batch_size:
+            index_products(batch)
+            indexed += len(batch)
+            batch = []
+    if batch:
+        index_products(batch)
+        indexed += len(batch)
+    return indexed
+
+
+def _match_expression(tokens):
+    if connection.vendor == "sqlite":
+        return " ".join(f'"{token}"*' for token in tokens)
+    return " & ".join(f"{token}:*" for token in tokens)
+
+
+def search_product_ids(query, ranked=True):
+    """
+    Return the ids of every product matching every word of ``query``
+    (prefix match), best match first unless not ``ranked``. Returns ``None``
+    when the database has no index.
+    """
+    if not is_supported():
+        return None
+
+    tokens = tokenize(query)
+    if not tokens:
+        return []
+
+    match = _match_expression(tokens)
+    with connection.cursor() as cursor:
+        if connection.vendor == "sqlite":
+            cursor.execute(
+                f"SELECT rowid FROM {SQLITE_TABLE} WHERE {SQLITE_TABLE} MATCH %s"
+                + (f" ORDER BY {SQLITE_RANK}, rowid" if ranked else ""),
+                [match],
+            )
+        else:
+            cursor.execute(
+                f"SELECT product_id FROM {POSTGRES_TABLE} "
+                "WHERE document @@ to_tsquery('simple', %s)"
+                + (f" ORDER BY {POSTGRES_RANK}, product_id DESC" if ranked else ""),
+                [match, match] if ranked else [match],
+            )
+        return [row[0] for row in cursor.fetchall()]
+
+
+class RankedMatches:
+    """
+    The products of ``candidates`` (a ``Product`` queryset) matching
+    ``query``, best match first, as a sequence ``Paginator`` can page: the
+    count and each page are one query, ranked and limited in the database,
+    so no more than a page of ids reaches Python.
+    """
+
+    def __init__(self, query, candidates):
+        tokens = tokenize(query)
+        self.match = _match_expression(tokens) if tokens else None
+        self.candidates = candidates
+
+    def count(self):
+        if self.match is None:
+            return 0
+        return self.candidates.filter(pk__in=_matching_ids(self.match)).count()
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice) or index.step not in (None, 1):
+            raise TypeError("RankedMatches only supports slicing")
+        start = index.start or 0
+        if self.match is None or (index.stop is not None and index.stop <= start):
+            return []
+        limit = -1 if index.stop is None else index.stop - start
+        candidates, params = self.candidates.values("pk").query.sql_with_params()
+        with connection.cursor() as cursor:
+            if connection.vendor == "sqlite":
+                # ranked apart from the candidates: with both in one WHERE,
+                # SQLite runs the full-text match once per candidate
+                cursor.execute(
+                    f"WITH matches AS MATERIALIZED (SELECT rowid AS id, "
+                    f"{SQLITE_RANK} AS rank FROM {SQLITE_TABLE} "
+                    f"WHERE {SQLITE_TABLE} MATCH %s) "
+                    f"SELECT id FROM matches WHERE id IN ({candidates}) "
+                    "ORDER BY rank, id LIMIT %s OFFSET %s",
+                    [self.match, *params, limit, start],
+                )
+            else:
+                cursor.execute(
+                    f"SELECT product_id FROM {POSTGRES_TABLE} "
+                    "WHERE document @@ to_tsquery('simple', %s) "
+                    f"AND product_id IN ({candidates}) "
+                    f"ORDER BY {POSTGRES_RANK}, product_id DESC "
+                    "LIMIT %s OFFSET %s",
+                    [
+                        self.match,
+                        *params,
+                        self.match,
+                        None if limit == -1 else limit,
+                        start,
+                    ],
+                )
+            return [row[0] for row in cursor.fetchall()]
+
+
+def matching_ids(query):
+    """
+    A subquery of the ids of products matching ``query``, for
+    ``filter(pk__in=...)``; unlike a list of ids it has no size limit.
+    ``None`` when the database has no index.
+    """
+    if not is_supported():
+        return None
+
+    tokens = tokenize(query)
+    if not tokens:
+        return RawSQL("SELECT NULL WHERE 1 = 0", [])
+    return _matching_ids(_match_expression(tokens))
+
+
+def _matching_ids(match):
+    if connection.vendor == "sqlite":
+        return RawSQL(
+            f"SELECT rowid FROM {SQLITE_TABLE} WHERE {SQLITE_TABLE} MATCH %s",
+            [match],
+        )
+    return RawSQL(
+        f"SELECT product_id FROM {POSTGRES_TABLE} "
+        "WHERE document @@ to_tsquery('simple', %s)",
+        [match],
+    )
@@ -1,9 +1,21 @@
 from django.conf import settings
 from django.dispatch import receiver
-from django.db.models.signals import post_save
-from .models import Order
+from django.db.models.signals import (
+    post_save,
+    post_delete,
+    pre_save,
+    pre_delete,
+    m2m_changed,
+)
+from django.db import transaction
+from .models import Order, Product, Category, Review
 from django.urls import reverse
-from .tasks import order_placed_mail_send_task
+from .tasks import (
+    order_placed_mail_send_task,
+    update_related_products_task,
+    generate_product_images_task,
+)
+from . import search, catalog, facets, fragments, ratings, autocomplete, carts
 
 
 @receiver(post_save, sender=Order)
@@ -21,3 +33,150 @@ def order_placed_mail(sender, instance, created, **kwargs):
         order_id=instance.order_id,
         init_payment_url=f"{settings.SITE_URL}{reverse("store:khalti_payment", args=[instance.order_id])}",
     )
+
+
+@receiver(pre_save, sender=Order)
+def remember_order_status(sender, instance, **kwargs):
+    instance._previous_status = None
+    if instance.pk:
+        instance._previous_status = (
+            Order.objects.filter(pk=instance.pk)
+            .values_list("status", flat=True)
+            .first()
+        )
+
+
+@receiver(post_save, sender=Order)
+def order_paid_related_products(sender, instance, created, **kwargs):
+    if instance.status != Order.Status.PAID:
+        return
+    if getattr(instance, "_previous_status", None) == Order.Status.PAID:
+        return
+
+    transaction.on_commit(lambda: update_related_products_task(instance.pk))
+
+
+def catalog_changed(product_ids=(), product=None):
+    """
+    Once the transaction commits, move the catalog to a new version, patch
+    this worker's facet and autocomplete indexes for ``product_ids`` (``None``
+    when any product may have changed) and drop the cached card of
+    ``product``. The featured strip follows the catalog version.
+    """
+    if product_ids is not None:
+        product_ids = list(product_ids)
+
+    def apply():
+        version = catalog.bump_version()
+        facets.refresh_products(product_ids, version)
+        autocomplete.refresh_products(product_ids, version)
+        if product is not None:
+            fragments.invalidate_product(product)
+        if product_ids is None:
+            # bulk writes may have changed any price
+            carts.prices_changed()
+
+    transaction.on_commit(apply)
+
+
+# search index, catalog version and fragments
+@receiver(post_save, sender=Product)
+def index_saved_product(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    search.index_product(instance)
+    catalog_changed([instance.pk], product=instance)
+
+
+@receiver(post_save, sender=Product)
+def product_image_derivatives(sender, instance, raw=False, **kwargs):
+    if raw or not instance.image:
+        return
+    if instance.image_variants.get("source") == instance.image.name:
+        return
+
+    transaction.on_commit(lambda: generate_product_images_task(instance.pk))
+
+
+@receiver(post_delete, sender=Product)
+def unindex_deleted_product(sender, instance, **kwargs):
+    search.remove_products([instance.pk])
+    catalog_changed([instance.pk], product=instance)
+
+
+# cart summaries
+@receiver(pre_save, sender=Product)
+def remember_product_price(sender, instance, raw=False, **kwargs):
+    instance._previous_price = None
+    if instance.pk and not raw:
+        instance._previous_price = (
+            Product.objects.filter(pk=instance.pk)
+            .values_list("price", flat=True)
+            .first()
+        )
+
+
+@receiver(post_save, sender=Product)
+def reprice_cart_summaries(sender, instance, created, raw=False, **kwargs):
+    if raw or created or getattr(instance, "_previous_price", None) is None:
+        return
+    if instance._previous_price != instance.price:
+        transaction.on_commit(carts.prices_changed)
+
+
+@receiver(post_delete, sender=Product)
+def drop_deleted_product_from_cart_summaries(sender, instance, **kwargs):
+    transaction.on_commit(carts.prices_changed)
+
+
+@receiver(m2m_changed, sender=Product.categories.through)
+def reindex_product_categories(sender, instance, action, pk_set, **kwargs):
+    if action not in ("post_add", "post_remove", "post_clear", "pre_clear"):
+        return
+
+    if not kwargs["reverse"]:
+        if action != "pre_clear":
+            search.index_product(instance)
+            catalog_changed([instance.pk], product=instance)
+        return
+
+    # category side: category.product_set.add(...) and friends
+    if action == "pre_clear":
+        instance._cleared_product_ids = list(
+            instance.product_set.values_list("pk", flat=True)
+        )
+    else:
+        if action == "post_clear":
+            product_ids = getattr(instance, "_cleared_product_ids", [])
+        else:
+            product_ids = pk_set or []
+        search.index_products(product_ids)
+        catalog_changed(product_ids)
+
+
+@receiver(post_save, sender=Category)
+def reindex_renamed_category(sender, instance, created, raw=False, **kwargs):
+    if created or raw:
+        return
+    search.index_products(instance.product_set.values_list("pk", flat=True))
+    catalog_changed()
+
+
+@receiver(pre_delete, sender=Category)
+def remember_category_products(sender, instance, **kwargs):
+    instance._deleted_product_ids = list(
+        instance.product_set.values_list("pk", flat=True)
+    )
+
+
+@receiver(post_delete, sender=Category)
+def reindex_category_products(sender, instance, **kwargs):
+    product_ids = getattr(instance, "_deleted_product_ids", [])
+    search.index_products(product_ids)
+    catalog_changed(product_ids)
+
+
+# rating aggregates
+@receiver(post_delete, sender=Review)
+def remove_review_rating(sender, instance, **kwargs):
+    ratings.apply_rating_change(instance.product_id, old=instance.rating)
@@ -0,0 +1,217 @@
+"""
+Read-only, in-process catalog snapshot.
+
+With ``CATALOG_SNAPSHOT`` enabled each worker holds the columns the listings
+filter and sort on (id, price, created_at, rating, featured, category
+membership) in compact ``array`` columns, plus precomputed sort orders.
+``home`` and ``products`` filter and sort against the snapshot and only fetch
+the rows of the page they render, by primary key.
+
+A snapshot is stamped with the catalog version it was built from (see
+``store.catalog``) and rebuilt when the version moves; the previous snapshot
+keeps serving other threads while a rebuild runs.
+"""
+
+import logging
+import threading
+from array import array
+from bisect import bisect_left
+
+from django.conf import settings
+
+from . import catalog
+from .facets import to_cents
+
+logger = logging.getLogger(__name__)
+
+
+class CatalogSnapshot:
+    def __init__(self, version):
+        self.version = version
+        # one row per product, ordered by id
+        self.ids = array("q")
+        self.prices = array("q")  # cents
+        self.created = array("d")  # unix timestamps
+        self.ratings = array("d")  # average review rating, 0 for unrated
+        self.featured = bytearray()
+        # category id -> rows of its products
+        self.categories = {}
+        # row numbers in ascending sort order, ties broken by id
+        self.by_price = array("l")
+        self.by_created = array("l")
+        self.by_rating = array("l")
+
+    @classmethod
+    def build(cls, version):
+        from .models import Product
+
+        snapshot = cls(version)
+        rows = Product.objects.values_list(
+            "pk", "price", "created_at", "rating_average", "featured"
+        ).order_by("pk")
+        for pk, price, created_at, rating, featured in rows.iterator(chunk_size=5000):
+            snapshot.ids.append(pk)
+            snapshot.prices.append(to_cents(price))
+            snapshot.created.append(created_at.timestamp())
+            snapshot.ratings.append(rating)
+            snapshot.featured.append(featured)
+
+        row_of = {pk: row for row, pk in enumerate(snapshot.ids)}
+        members = {}
+        for product_id, category_id in (
+            Product.categories.through.objects.values_list("product_id", "category_id")
+            .order_by("product_id")
+            .iterator(chunk_size=5000)
+        ):
+            members.setdefault(category_id, array("l")).append(row_of[product_id])
+        snapshot.categories = members
+
+        rows = range(len(snapshot.ids))
+        prices, created, ratings = snapshot.prices, snapshot.created, snapshot.ratings
+        # rows are in id order, so a stable sort keeps ids ascending on ties
+        snapshot.by_price = array("l", sorted(rows, key=prices.__getitem__))
+        snapshot.by_created = array("l", sorted(rows, key=created.__getitem__))
+        snapshot.by_rating = array("l", sorted(rows, key=ratings.__getitem__))
+        return snapshot
+
+    def __len__(self):
+        return len(self.ids)
+
+    def row_of(self, pk):
+        row = bisect_left(self.ids, pk)
+        if row < len(self.ids) and self.ids[row] == pk:
+            return row
+        return None
+
+    def memory_report(self):
+        """Bytes used by each column, and in total."""
+
+        def size(column):
+            return len(column) * getattr(column, "itemsize", 1)
+
+        report = {
+            "ids": size(self.ids),
+            "prices": size(self.prices),
+            "created": size(self.created),
+            "ratings": size(self.ratings),
+            "featured": size(self.featured),
+            "categories": sum(size(rows) for rows in self.categories.values()),
+            "by_price": size(self.by_price),
+            "by_created": size(self.by_created),
+            "by_rating": size(self.by_rating),
+        }
+        report["total"] = sum(report.values())
+        return report
+
+    def _order(self, ordering):
+        field = ordering[0]
+        if field.lstrip("-") == "price":
+            rows = self.by_price
+        elif field.lstrip("-") == "created_at":
+            rows = self.by_created
+        elif field.lstrip("-") == "rating_average":
+            rows = self.by_rating
+        else:
+            rows = range(len(self.ids))
+        return reversed(rows) if field.startswith("-") else rows
+
+    def select(
+        self,
+        ordering=("pk",),
+        product_ids=None,
+        min_price=None,
+        max_price=None,
+        category_ids=None,
+        min_rating=None,
+    ):
+        """
+        Product ids matching the filters, in ``ordering`` (one of the listing
+        orderings). When ``product_ids`` is given and ordering is by ``pk``,
+        its order (search rank) is kept instead.
+        """
+        low = to_cents(min_price) if min_price is not None else None
+        high = to_cents(max_price) if max_price is not None else None
+
+        allowed = None
+        if category_ids:
+            allowed = set()
+            for category_id in category_ids:
+                allowed.update(self.categories.get(category_id, ()))
+
+        if product_ids is not None:
+            wanted = [self.row_of(pk) for pk in product_ids]
+            wanted = [row for row in wanted if row is not None]
+            if ordering == ("pk",):
+                rows = wanted
+            else:
+                wanted = set(wanted)
+                rows = (row for row in self._order(ordering) if row in wanted)
+        else:
+            rows = self._order(ordering)
+
+        ids, prices, ratings = self.ids, self.prices, self.ratings
+        return [
+            ids[row]
+            for row in rows
+            if (low is None or prices[row] >= low)
+            and (high is None or prices[row] <= high)
+            and (not min_rating or ratings[row] >= min_rating)
+            and (allowed is None or row in allowed)
+        ]
+
+    def featured_ids(self, limit):
+        """Newest featured products first."""
+        result = []
+        for row in reversed(self.by_created):
+            if self.featured[row]:
+                result.append(self.ids[row])
+                if len(result) >= limit:
+                    break
+        return result
+
+
+_snapshot = None
+# catalog version found to be over the memory budget
+_skipped_version = None
+_lock = threading.Lock()
+
+
+def get_snapshot():
+    """
+    The snapshot for the current catalog version, or ``None`` when snapshots
+    are disabled or the catalog does not fit in ``CATALOG_SNAPSHOT_MAX_BYTES``.
+    """
+    global _snapshot, _skipped_version
+
+    if not settings.CATALOG_SNAPSHOT:
+        return None
+
+    version = catalog.get_version()
+    snapshot = _snapshot
+    if snapshot is not None and snapshot.version == version:
+        return snapshot
+    if _skipped_version == version:
+        return None
+
+    # one thread rebuilds; the others keep using the previous snapshot
+    if not _lock.acquire(blocking=snapshot is None):
+        return snapshot
+    try:
+        if _skipped_version == version:
+            return None
+        if _snapshot is None or _snapshot.version != version:
+            snapshot = CatalogSnapshot.build(version)
+            report = snapshot.memory_report()
+            if report["total"] > settings.CATALOG_SNAPSHOT_MAX_BYTES:
+                logger.warning(
+                    "Catalog snapshot needs %s bytes, over the %s byte budget; "
+                    "serving listings from the database",
+                    report["total"],
+                    settings.CATALOG_SNAPSHOT_MAX_BYTES,
+                )
+                snapshot = None
+                _skipped_version = version
+            _snapshot = snapshot
+        return _snapshot
+    finally:
+        _lock.release()
@@ -29,3 +29,31 @@ def order_placed_mail_send_task(
         
         """,
     )
+
+
+@background()
+def update_related_products_task(order_id):
+    from .recommendations import record_order
+
+    record_order(order_id)
+
+
+@background()
+def generate_product_images_task(product_id):
+    from .images import generate_derivatives
+
+    generate_derivatives(product_id)
+
+
+@background()
+def persist_cart_task(user_id):
+    from .carts import get_backend
+
+    get_backend().flush(user_id)
+
+
+@background(queue="checkout")
+def place_queued_order_task(checkout_id):
+    from .orders import place_queued_order
+
+    place_queued_order(checkout_id)
@@ -0,0 +1,16 @@
+from django import template
+from django.utils.html import format_html
+
+from store import idempotency
+
+register = template.Library()
+
+
+@register.simple_tag
+def idempotency_field():
+    """A hidden input with a fresh idempotency token for a POST form."""
+    return format_html(
+        '<input type="hidden" name="{}" value="{}">',
+        idempotency.FIELD_NAME,
+        idempotency.new_key(),
+    )
@@ -1,3 +1,950 @@
-from django.test import TestCase
+import hashlib
+import socket
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.core import signing
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from . import (
+    carts,
+    catalog,
+    fragments,
+    idempotency,
+    inventory,
+    khalti,
+    listing_cache,
+    orders,
+    recommendations,
+    search,
+    utils,
+)
+from .management.commands.generate_image_derivatives import (
+    Command as GenerateImageDerivatives,
+)
+from .forms import ProductFilterForm
+from .khalti_stub import StubKhaltiServer
+from .models import (
+    Category,
+    IdempotencyRecord,
+    Order,
+    OrderItem,
+    Payment,
+    Product,
+    RelatedProduct,
+    StockReservation,
+    WorkerIdLease,
+)
+from .pagination import KeysetPaginator
+from .utils import generate_order_id
+from .views import product_listing
+
+
+class CreateOrderQueriesTests(TestCase):
+    """Checkout costs the same number of queries whatever the size of the cart."""
+
+    # savepoint, cart lines read, order inserted, confirmation mail task
+    # queued, stock read, order items inserted, cart lines deleted, release
+    QUERIES = 8
+    # the shard decrement in a savepoint of its own, and the reservations
+    TRACKED_QUERIES = QUERIES + 4
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user(
+            email="checkout@example.com", password=None
+        )
+        # bulk_create, so the search index and catalog receivers stay out of it
+        cls.products = Product.objects.bulk_create(
+            Product(name=f"Product {i}", sku=f"SKU-{i}", price=10 + i)
+            for i in range(50)
+        )
+
+    def place(self, products, tracked):
+        """
+        Fill the cart with ``products``, the first ``tracked`` of them (all
+        for ``None``) stock-tracked, and return a new order id.
+        """
+        for product in products[:tracked]:
+            inventory.set_stock(product.pk, 100)
+        carts.DatabaseCartBackend().apply(
+            self.user.pk, {product.pk: 2 for product in products}
+        )
+        return generate_order_id()
+
+    def assert_checkout_queries(self, expected, tracked):
+        for size in (1, 10, 50):
+            with self.subTest(size=size):
+                order_id = self.place(self.products[:size], tracked)
+                with self.assertNumQueries(expected):
+                    order = orders.create_order(self.user, order_id)
+                self.assertEqual(order.items.count(), size)
+                self.assertFalse(self.user.cart.products.exists())
+
+    def test_untracked_stock(self):
+        self.assert_checkout_queries(self.QUERIES, tracked=0)
+
+    def test_tracked_stock(self):
+        self.assert_checkout_queries(self.TRACKED_QUERIES, tracked=None)
+
+    def test_partly_tracked_stock(self):
+        self.assert_checkout_queries(self.TRACKED_QUERIES, tracked=1)
+
+    def test_out_of_stock_leaves_cart(self):
+        product = self.products[0]
+        inventory.set_stock(product.pk, 1)
+        carts.DatabaseCartBackend().apply(self.user.pk, {product.pk: 2})
+        with self.assertRaises(inventory.OutOfStock) as raised:
+            orders.create_order(self.user, generate_order_id())
+        self.assertEqual(raised.exception.product_ids, [product.pk])
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(inventory.available([product.pk]), {product.pk: 1})
+
+
+class TakeRetriesTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.plenty, cls.short, cls.untracked = Product.objects.bulk_create(
+            Product(name=f"Product {i}", sku=f"SKU-{i}", price=10) for i in range(3)
+        )
+        inventory.set_stock(cls.plenty.pk, 100)
+        inventory.set_stock(cls.short.pk, 100)
+
+    def take_racing(self, wanted):
+        with mock.patch.object(inventory, "_decrement", side_effect=inventory._Raced):
+            with self.assertRaises(inventory.OutOfStock) as raised:
+                inventory.take(wanted)
+        return raised.exception.product_ids
+
+    def test_names_only_short_products(self):
+        wanted = {self.plenty.pk: 1, self.short.pk: 5, self.untracked.pk: 1}
+        # drained by other checkouts while this one kept retrying
+        plan = inventory.plan
+
+        def drain(*args):
+            inventory.set_stock(self.short.pk, 2)
+            return plan(*args)
+
+        with mock.patch.object(inventory, "plan", side_effect=drain):
+            self.assertEqual(self.take_racing(wanted), [self.short.pk])
+
+    def test_names_tracked_products_when_none_short(self):
+        wanted = {self.plenty.pk: 1, self.untracked.pk: 1}
+        self.assertEqual(self.take_racing(wanted), [self.plenty.pk])
+
+
+class CancelOrderTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        cls.user = User.objects.create_user(email="owner@example.com", password=None)
+        cls.other = User.objects.create_user(email="other@example.com", password=None)
+        cls.product = Product.objects.create(name="Product", sku="SKU", price=10)
+
+    def setUp(self):
+        inventory.set_stock(self.product.pk, 10)
+        carts.DatabaseCartBackend().apply(self.user.pk, {self.product.pk: 2})
+        self.order = orders.create_order(self.user, generate_order_id())
+        self.url = reverse("store:cancel_order", args=[self.order.pk])
+
+    def test_owner_cancels_pending_order(self):
+        self.client.force_login(self.user)
+        self.client.post(self.url)
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(inventory.available([self.product.pk]), {self.product.pk: 10})
+
+    def test_other_user_gets_404(self):
+        self.client.force_login(self.other)
+        self.assertEqual(self.client.post(self.url).status_code, 404)
+        self.assertTrue(StockReservation.objects.filter(order=self.order).exists())
+
+    def test_paid_order_is_kept(self):
+        Order.objects.filter(pk=self.order.pk).update(status=Order.Status.PAID)
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.post(self.url).status_code, 404)
+        self.assertEqual(inventory.available([self.product.pk]), {self.product.pk: 8})
+
+
+class ExportStreamTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = get_user_model().objects.create_user(
+            email="staff@example.com", password=None, is_staff=True
+        )
+        Product.objects.bulk_create(
+            Product(name=f"Product {i}", sku=f"SKU-{i}", price=10) for i in range(5)
+        )
+
+    def test_wsgi_streams_sync_lines(self):
+        self.client.force_login(self.staff)
+        response = self.client.get(reverse("store:export_products"))
+        self.assertFalse(response.is_async)
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 6)
+
+    async def test_asgi_streams_async_chunks(self):
+        await self.async_client.aforce_login(self.staff)
+        response = await self.async_client.get(
+            reverse("store:export_products"), {"format": "jsonl"}
+        )
+        self.assertTrue(response.is_async)
+        content = b"".join([chunk async for chunk in response.streaming_content])
+        self.assertEqual(len(content.decode().splitlines()), 5)
+
+
+class KhaltiResponseStockTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user(
+            email="payer@example.com", password=None
+        )
+        cls.product = Product.objects.create(name="Product", sku="SKU", price=10)
+
+    def setUp(self):
+        inventory.set_stock(self.product.pk, 10)
+        carts.DatabaseCartBackend().apply(self.user.pk, {self.product.pk: 2})
+        self.order = orders.create_order(self.user, generate_order_id())
+        self.payment = Payment.objects.create(
+            order=self.order,
+            purchase_order_id=f"TR-{self.order.order_id}",
+            pidx="pidx-1",
+            amount=self.order.total,
+        )
+        self.client.force_login(self.user)
+
+    def return_with(self, status):
+        answer = {
+            "status": status,
+            "total_amount": int(self.order.total * 100),
+            "transaction_id": "txn-1",
+        }
+        with mock.patch("store.khalti.alookup", return_value=answer):
+            self.client.get(
+                reverse("store:khalti_payment_response"), {"pidx": "pidx-1"}
+            )
+        self.payment.refresh_from_db()
+        self.order.refresh_from_db()
+
+    def test_pending_keeps_stock_until_completed(self):
+        self.return_with("Pending")
+        self.assertEqual(self.payment.status, Payment.Status.PENDING)
+        self.assertEqual(inventory.available([self.product.pk]), {self.product.pk: 8})
+
+        self.return_with("Completed")
+        self.assertEqual(self.order.status, Order.Status.PAID)
+        self.assertTrue(StockReservation.objects.filter(order=self.order).exists())
+
+    def test_expired_releases_stock(self):
+        self.return_with("Expired")
+        self.assertEqual(self.payment.status, Payment.Status.FAILED)
+        self.assertEqual(inventory.available([self.product.pk]), {self.product.pk: 10})
+
+
+class CartBatchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user(
+            email="batch@example.com", password=None
+        )
+        cls.kept, cls.taken, cls.absent = Product.objects.bulk_create(
+            Product(name=f"Product {i}", sku=f"SKU-{i}", price=10) for i in range(3)
+        )
+
+    def batch(self, *lines):
+        return self.client.post(
+            reverse("store:cart_batch"),
+            {"items": [{"product_id": pk, "quantity": qty} for pk, qty in lines]},
+            content_type="application/json",
+        )
+
+    def test_negative_deltas(self):
+        self.client.force_login(self.user)
+        self.batch((self.kept.pk, 3), (self.taken.pk, 2))
+        response = self.batch(
+            (self.kept.pk, -1), (self.taken.pk, -5), (self.absent.pk, -2)
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response.json()["items"], [{"product_id": self.kept.pk, "quantity": 2}]
+        )
+        self.assertEqual(carts.load_from_database(self.user.pk), {self.kept.pk: 2})
+
+
+class SearchListingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        # created one by one, so the search index receivers index them
+        cls.cheap = [
+            Product.objects.create(name=f"Lamp {i}", sku=f"LAMP-{i}", price=5)
+            for i in range(20)
+        ]
+        cls.dear = Product.objects.create(
+            name="Lamp lamp", sku="LAMP-X", price=50, description="lamp"
+        )
+        Product.objects.create(name="Chair", sku="CHAIR", price=5)
+
+    def test_pages_ranked_matches(self):
+        ranked = search.search_product_ids("lamp")
+        self.assertEqual(ranked[0], self.dear.pk)
+        self.assertEqual(len(ranked), 21)
+
+        first = product_listing({"name": "lamp"}, 1)
+        second = product_listing({"name": "lamp"}, 2)
+        self.assertEqual(first["count"], 21)
+        self.assertEqual([pk for pk, _ in first["cards"] + second["cards"]], ranked)
+
+    def test_other_filters_apply_before_paging(self):
+        listing = product_listing({"name": "lamp", "max_price": "10"}, 1)
+        self.assertEqual(listing["count"], 20)
+        self.assertNotIn(self.dear.pk, [pk for pk, _ in listing["cards"]])
+
+
+class FeaturedStripTests(TestCase):
+    def setUp(self):
+        # the catalog version starts over with each test database
+        cache.clear()
+
+    def test_follows_catalog_version(self):
+        product = Product.objects.create(
+            name="Old name", sku="FEATURED", price=10, featured=True
+        )
+
+        def featured():
+            return Product.objects.filter(featured=True)
+
+        self.assertIn("Old name", fragments.featured_strip(featured))
+        # renamed by another worker: this one only sees the version move
+        Product.objects.filter(pk=product.pk).update(
+            name="New name", updated_at=timezone.now()
+        )
+        self.assertIn("Old name", fragments.featured_strip(featured))
+        catalog.bump_version()
+        self.assertIn("New name", fragments.featured_strip(featured))
+
+
+class ConditionalPageTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user(
+            email="viewer@example.com", password=None
+        )
+        cls.product = Product.objects.create(name="Product", sku="SKU", price=10)
+
+    def test_repeat_visit_works_out_viewer_once(self):
+        carts.get_backend().apply(self.user.pk, {self.product.pk: 1})
+        self.client.force_login(self.user)
+        etag = self.client.get(reverse("store:home_page"))["ETag"]
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(
+                reverse("store:home_page"), HTTP_IF_NONE_MATCH=etag
+            )
+        self.assertEqual(response.status_code, 304)
+        summary_reads = [
+            query for query in queries if 'FROM "store_cart"' in query["sql"]
+        ]
+        self.assertEqual(len(summary_reads), 1)
+
+    def test_render_shares_summary_with_etag(self):
+        carts.get_backend().apply(self.user.pk, {self.product.pk: 1})
+        self.client.force_login(self.user)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse("store:home_page"))
+        self.assertEqual(response.status_code, 200)
+        summary_reads = [
+            query for query in queries if 'FROM "store_cart"' in query["sql"]
+        ]
+        self.assertEqual(len(summary_reads), 1)
+
+
+class StoredCartSummaryTests(TestCase):
+    """Without a shared cache the summary lives on the ``Cart`` row."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user(
+            email="summary@example.com", password=None
+        )
+        cls.product = Product.objects.create(name="Product", sku="SKU", price=10)
+
+    def setUp(self):
+        cache.clear()
+        self.backend = carts.DatabaseCartBackend()
+
+    def test_read_is_one_query(self):
+        self.backend.apply(self.user.pk, {self.product.pk: 2})
+        self.assertEqual(self.backend.summary(self.user.pk), {"count": 2, "total": 20})
+        with self.assertNumQueries(1):
+            self.assertEqual(
+                self.backend.summary(self.user.pk), {"count": 2, "total": 20}
+            )
+
+    def test_changes_clear_it(self):
+        self.backend.apply(self.user.pk, {self.product.pk: 2})
+        self.backend.summary(self.user.pk)
+        self.backend.apply(self.user.pk, {self.product.pk: 1})
+        self.assertEqual(self.backend.summary(self.user.pk)["count"], 3)
+        self.backend.remove(self.user.pk, self.product.pk)
+        self.assertEqual(self.backend.summary(self.user.pk)["count"], 0)
+
+    def test_new_catalog_version_reprices_it(self):
+        self.backend.apply(self.user.pk, {self.product.pk: 2})
+        self.backend.summary(self.user.pk)
+        Product.objects.filter(pk=self.product.pk).update(price=15)
+        catalog.bump_version()
+        self.assertEqual(self.backend.summary(self.user.pk)["total"], 30)
+
+
+class OrderIdTests(TestCase):
+    def tearDown(self):
+        utils.release_order_id_generator()
+
+    def test_generator_keeps_its_lease(self):
+        generator = utils.get_order_id_generator()
+        self.assertIs(utils.get_order_id_generator(), generator)
+        ids = [generate_order_id() for _ in range(100)]
+        self.assertEqual(ids, sorted(set(ids)))
+        self.assertTrue(
+            WorkerIdLease.objects.filter(worker_id=generator.worker_id).exists()
+        )
+
+    def test_release_frees_the_worker_id(self):
+        worker_id = utils.get_order_id_generator().worker_id
+        utils.release_order_id_generator()
+        self.assertFalse(WorkerIdLease.objects.filter(worker_id=worker_id).exists())
+        self.assertIsNotNone(utils.get_order_id_generator())
+
+    def test_lease_skips_held_ids(self):
+        first = utils.lease_worker_id("first")
+        second = utils.lease_worker_id("second")
+        self.assertNotEqual(first, second)
+
+    def test_expired_lease_is_taken_over(self):
+        now = timezone.now()
+        WorkerIdLease.objects.bulk_create(
+            WorkerIdLease(
+                worker_id=worker_id,
+                holder="gone" if worker_id == 7 else "live",
+                expires_at=(
+                    now - timedelta(seconds=1)
+                    if worker_id == 7
+                    else now + timedelta(hours=1)
+                ),
+            )
+            for worker_id in range(utils.MAX_WORKER_ID + 1)
+        )
+        self.assertEqual(utils.lease_worker_id("new"), 7)
+        self.assertEqual(WorkerIdLease.objects.get(worker_id=7).holder, "new")
+        with self.assertRaises(RuntimeError):
+            utils.lease_worker_id("late")
+
+
+class ImageDerivativesCommandTests(TestCase):
+    def test_skips_up_to_date_products(self):
+        Product.objects.bulk_create(
+            Product(
+                name=f"Product {i}",
+                sku=f"SKU-{i}",
+                price=10,
+                image=f"products/{i}.jpg",
+                image_variants={"source": f"products/{i}.jpg"},
+            )
+            for i in range(3)
+        )
+        out = StringIO()
+        call_command("generate_image_derivatives", stdout=out)
+        self.assertIn("up to date", out.getvalue())
+
+    def test_save_skips_replaced_images(self):
+        kept, replaced = Product.objects.bulk_create(
+            Product(name=f"Product {i}", sku=f"SKU-{i}", price=10, image=f"{i}.jpg")
+            for i in range(2)
+        )
+        Product.objects.filter(pk=replaced.pk).update(image="new.jpg")
+        saved = GenerateImageDerivatives()._save(
+            [
+                (kept.pk, "0.jpg", {"source": "0.jpg"}),
+                (replaced.pk, "1.jpg", {"source": "1.jpg"}),
+            ]
+        )
+        self.assertEqual(saved, [kept.pk])
+        replaced.refresh_from_db()
+        self.assertEqual(replaced.image_variants, {})
+
+
+class RecordOrderTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user(
+            email="buyer@example.com", password=None
+        )
+        cls.a, cls.b = Product.objects.bulk_create(
+            Product(name=f"Product {i}", sku=f"SKU-{i}", price=10) for i in range(2)
+        )
+
+    def paid_order(self):
+        # bulk_create, so the paid receiver does not queue a task
+        (order,) = Order.objects.bulk_create(
+            [
+                Order(
+                    user=self.user,
+                    order_id=generate_order_id(),
+                    subtotal=20,
+                    status=Order.Status.PAID,
+                )
+            ]
+        )
+        OrderItem.objects.bulk_create(
+            OrderItem(
+                order=order,
+                product=product,
+                product_name=product.name,
+                price=10,
+                quantity=1,
+            )
+            for product in (self.a, self.b)
+        )
+        return order
+
+    def co_purchases(self):
+        return RelatedProduct.objects.get(product=self.a, related=self.b).co_purchases
+
+    def test_retried_order_counts_once(self):
+        order = self.paid_order()
+        recommendations.record_order(order.pk)
+        recommendations.record_order(order.pk)
+        self.assertEqual(self.co_purchases(), 1)
+
+    def test_orders_add_up(self):
+        recommendations.record_order(self.paid_order().pk)
+        recommendations.record_order(self.paid_order().pk)
+        self.assertEqual(self.co_purchases(), 2)
+
+    def test_rebuild_counts_order_once(self):
+        order = self.paid_order()
+        recommendations.rebuild()
+        recommendations.record_order(order.pk)
+        self.assertEqual(self.co_purchases(), 1)
+
+
+class IdempotencyTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user(
+            email="idempotent@example.com", password=None
+        )
+
+    def setUp(self):
+        self.calls = 0
+        self.status = 302
+
+    def post(self, view, token="token-1", user=None):
+        request = RequestFactory().post("/order/", {idempotency.FIELD_NAME: token})
+        request.user = user or self.user
+
+        async def auser():
+            return request.user
+
+        request.auser = auser
+        return view(request)
+
+    def view(self):
+        @idempotency.idempotent
+        def place(request):
+            self.calls += 1
+            return HttpResponse(f"call {self.calls}", status=self.status)
+
+        return place
+
+    def test_repeat_is_replayed(self):
+        view = self.view()
+        first = self.post(view)
+        second = self.post(view)
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(second.status_code, 302)
+        self.assertEqual(second["Idempotent-Replayed"], "true")
+
+    def test_other_tokens_and_anonymous_run_the_view(self):
+        view = self.view()
+        self.post(view, token="token-1")
+        self.post(view, token="token-2")
+        self.post(view, user=AnonymousUser())
+        self.post(view, user=AnonymousUser())
+        self.assertEqual(self.calls, 4)
+
+    def test_pending_repeat_gets_409(self):
+        key = hashlib.sha256(b"/order/\x1ftoken-1").hexdigest()
+        IdempotencyRecord.objects.create(user=self.user, key=key)
+        with mock.patch.object(idempotency, "WAIT_TIMEOUT", 0.1):
+            response = self.post(self.view())
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(self.calls, 0)
+
+    def test_server_error_can_be_retried(self):
+        view = self.view()
+        self.status = 500
+        self.post(view)
+        self.status = 302
+        response = self.post(view)
+        self.assertEqual(self.calls, 2)
+        self.assertFalse(response.has_header("Idempotent-Replayed"))
+
+    def test_async_view_is_replayed(self):
+        @idempotency.idempotent
+        async def pay(request):
+            self.calls += 1
+            return HttpResponse(f"call {self.calls}", status=302)
+
+        async def post():
+            return await self.post(pay)
+
+        first = async_to_sync(post)()
+        second = async_to_sync(post)()
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(second["Idempotent-Replayed"], "true")
+
+
+class KeysetPaginatorTests(TestCase):
+    ordering = ("-price", "-pk")
+
+    @classmethod
+    def setUpTestData(cls):
+        # few distinct prices, so the pk tie-break matters
+        Product.objects.bulk_create(
+            Product(name=f"Product {i}", sku=f"SKU-{i}", price=10 + i % 3)
+            for i in range(23)
+        )
+        cls.expected = list(
+            Product.objects.order_by(*cls.ordering).values_list("pk", flat=True)
+        )
+
+    def paginator(self):
+        return KeysetPaginator(Product.objects.all(), 5, self.ordering)
+
+    def test_walks_forward_and_back(self):
+        pages, token = [], None
+        while True:
+            page = self.paginator().get_page(token)
+            pages.append(page)
+            if not page.has_next():
+                break
+            token = page.next_token
+        self.assertEqual([obj.pk for page in pages for obj in page], self.expected)
+        self.assertEqual([page.number for page in pages], [1, 2, 3, 4, 5])
+
+        back = self.paginator().get_page(pages[-1].previous_token)
+        self.assertEqual(back.number, 4)
+        self.assertEqual([obj.pk for obj in back], [obj.pk for obj in pages[3]])
+
+    def test_bad_cursor_starts_over(self):
+        first = self.paginator().get_page()
+        for token in ("not-a-cursor", first.next_token[:-2] + "xx"):
+            page = self.paginator().get_page(token)
+            self.assertEqual(page.number, 1)
+            self.assertEqual([obj.pk for obj in page], self.expected[:5])
+
+
+class ListingKeyTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.shoes, cls.hats = Category.objects.bulk_create(
+            [Category(name="Shoes"), Category(name="Hats")]
+        )
+
+    def key(self, query, page=None):
+        form = ProductFilterForm(query)
+        self.assertTrue(form.is_valid(), form.errors)
+        return listing_cache.listing_key(
+            listing_cache.canonical_filters(form.cleaned_data),
+            listing_cache.canonical_page(page),
+        )
+
+    def test_equivalent_queries_share_a_key(self):
+        self.assertEqual(
+            self.key(
+                {
+                    "name": "  Red   Shoes ",
+                    "min_price": "10",
+                    "categories": [self.hats.pk, self.shoes.pk],
+                }
+            ),
+            self.key(
+                {
+                    "name": "red shoes",
+                    "min_price": "10.00",
+                    "categories": [self.shoes.pk, self.hats.pk],
+                },
+                page="1",
+            ),
+        )
+
+    def test_blank_fields_and_bad_pages_are_dropped(self):
+        plain = self.key({})
+        self.assertEqual(self.key({"name": "", "max_price": ""}), plain)
+        for page in ("0", "-3", "abc", None):
+            self.assertEqual(self.key({}, page), plain)
+
+    def test_different_listings_differ(self):
+        keys = {
+            self.key({"name": "red"}),
+            self.key({"name": "red shoes"}),
+            self.key({"min_price": "10"}),
+            self.key({"max_price": "10"}),
+            self.key({"categories": [self.shoes.pk]}),
+            self.key({}, page="2"),
+        }
+        self.assertEqual(len(keys), 6)
+
+
+class CartBackendTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user(
+            email="backend@example.com", password=None
+        )
+        cls.lamp, cls.rug, cls.vase = Product.objects.bulk_create(
+            Product(name=f"Product {i}", sku=f"BACKEND-{i}", price=10) for i in range(3)
+        )
+
+    def setUp(self):
+        cache.clear()
+
+    def backends(self):
+        return [
+            carts.DatabaseCartBackend(),
+            carts.InMemoryCartBackend(),
+            carts.CacheCartBackend(),
+        ]
+
+    def test_operations(self):
+        uid = self.user.pk
+        for backend in self.backends():
+            with self.subTest(backend=type(backend).__name__):
+                self.assertTrue(backend.add(uid, self.lamp.pk, 1))
+                self.assertFalse(backend.add(uid, self.lamp.pk, 5))
+                self.assertTrue(backend.set_quantity(uid, self.lamp.pk, 3))
+                self.assertFalse(backend.set_quantity(uid, self.rug.pk, 3))
+                self.assertEqual(
+                    backend.apply(uid, {self.lamp.pk: -1, self.rug.pk: 2}),
+                    {self.lamp.pk: 2, self.rug.pk: 2},
+                )
+                self.assertEqual(
+                    backend.apply(uid, {self.rug.pk: 0, self.vase.pk: 4}, replace=True),
+                    {self.lamp.pk: 2, self.vase.pk: 4},
+                )
+                self.assertTrue(backend.remove(uid, self.vase.pk))
+                self.assertFalse(backend.remove(uid, self.vase.pk))
+                self.assertEqual(backend.items(uid), {self.lamp.pk: 2})
+                self.assertEqual(
+                    [(line.product, line.quantity) for line in backend.lines(uid)],
+                    [(self.lamp, 2)],
+                )
+                self.assertEqual(backend.summary(uid)["count"], 2)
+
+                backend.flush(uid)
+                self.assertEqual(carts.load_from_database(uid), {self.lamp.pk: 2})
+                with backend.checkout(uid) as items:
+                    self.assertEqual(items, {self.lamp.pk: 2})
+                    carts.save_to_database(uid, {})
+                self.assertEqual(backend.items(uid), {})
+                self.assertEqual(backend.summary(uid)["count"], 0)
+
+    def test_cache_backend_writes_through_without_a_shared_cache(self):
+        backend = carts.CacheCartBackend()
+        backend.add(self.user.pk, self.lamp.pk, 2)
+        self.assertEqual(carts.load_from_database(self.user.pk), {self.lamp.pk: 2})
+        backend.apply(self.user.pk, {self.lamp.pk: -2})
+        self.assertEqual(carts.load_from_database(self.user.pk), {})
+
+    def test_held_cart_is_loaded_from_the_database(self):
+        carts.save_to_database(self.user.pk, {self.rug.pk: 1})
+        for backend in self.backends():
+            with self.subTest(backend=type(backend).__name__):
+                self.assertEqual(backend.items(self.user.pk), {self.rug.pk: 1})
+
+
+class LoginCartMergeTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user(
+            email="merge@example.com", password="secret-merge-pw"
+        )
+        cls.lamp, cls.rug, cls.gone = Product.objects.bulk_create(
+            Product(name=f"Product {i}", sku=f"MERGE-{i}", price=10) for i in range(3)
+        )
+
+    def setUp(self):
+        cache.clear()
+
+    def set_cookie_cart(self, items):
+        self.client.cookies[settings.CART_COOKIE_NAME] = signing.get_cookie_signer(
+            salt=settings.CART_COOKIE_NAME + carts.COOKIE_SALT
+        ).sign(signing.dumps(list(items.items()), compress=True))
+
+    def log_in(self):
+        return self.client.post(
+            reverse("accounts:login_page"),
+            {"email": self.user.email, "password": "secret-merge-pw"},
+        )
+
+    def test_cookie_cart_is_merged(self):
+        carts.save_to_database(self.user.pk, {self.lamp.pk: 1})
+        self.set_cookie_cart({self.lamp.pk: 2, self.rug.pk: 1, self.gone.pk: 4})
+        self.gone.delete()
+
+        response = self.log_in()
+
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(
+            carts.load_from_database(self.user.pk),
+            {self.lamp.pk: 3, self.rug.pk: 1},
+        )
+        cookie = response.cookies[settings.CART_COOKIE_NAME]
+        self.assertEqual(cookie.value, "")
+        self.assertEqual(cookie["max-age"], 0)
+
+    def test_tampered_cookie_is_ignored(self):
+        self.client.cookies[settings.CART_COOKIE_NAME] = "not-signed"
+        response = self.log_in()
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(carts.load_from_database(self.user.pk), {})
+
+
+def closed_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class StubKhaltiTestCase(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.stub = StubKhaltiServer().start()
+        cls.addClassCleanup(cls.stub.server_close)
+        cls.addClassCleanup(cls.stub.shutdown)
+        cls.enterClassContext(
+            override_settings(
+                KHALTI_BASE_URL=cls.stub.url,
+                KHALTI_SECRET_KEY="test",
+                KHALTI_RETRY_BACKOFF=0,
+            )
+        )
+
+    def setUp(self):
+        khalti.metrics.reset()
+
+
+class KhaltiClientTests(StubKhaltiTestCase):
+    payload = {
+        "return_url": "http://testserver/return/",
+        "website_url": "http://testserver/",
+        "amount": 1500,
+        "purchase_order_id": "TR-1",
+        "purchase_order_name": "1",
+    }
+
+    def test_initiate_and_lookup(self):
+        initiated = async_to_sync(khalti.ainitiate)(self.payload)
+        self.assertTrue(initiated["payment_url"].startswith(self.stub.url))
+
+        looked_up = async_to_sync(khalti.alookup)(initiated["pidx"])
+        self.assertEqual(looked_up["status"], "Completed")
+        self.assertEqual(looked_up["total_amount"], 1500)
+
+        operations = khalti.metrics.snapshot()
+        self.assertEqual(operations["initiate"]["calls"], 1)
+        self.assertEqual(operations["lookup"]["errors"], 0)
+
+    def test_client_errors_are_not_retried(self):
+        with self.assertRaises(khalti.KhaltiError):
+            async_to_sync(khalti.alookup)("unknown")
+        lookup = khalti.metrics.snapshot()["lookup"]
+        self.assertEqual((lookup["errors"], lookup["retries"]), (1, 0))
+
+    def test_unreachable_gateway_is_retried(self):
+        with override_settings(KHALTI_BASE_URL=f"http://127.0.0.1:{closed_port()}"):
+            with self.assertRaises(khalti.KhaltiError):
+                async_to_sync(khalti.alookup)("pidx")
+            with self.assertRaises(khalti.KhaltiError):
+                async_to_sync(khalti.ainitiate)(self.payload)
+        operations = khalti.metrics.snapshot()
+        self.assertEqual(
+            operations["lookup"]["retries"], settings.KHALTI_LOOKUP_ATTEMPTS - 1
+        )
+        self.assertEqual(operations["initiate"]["retries"], 0)
+
+
+class KhaltiPaymentFlowTests(StubKhaltiTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user(
+            email="stub-payer@example.com", password=None
+        )
+        cls.product = Product.objects.create(name="Product", sku="STUB", price=12)
+
+    def setUp(self):
+        super().setUp()
+        inventory.set_stock(self.product.pk, 5)
+        carts.DatabaseCartBackend().apply(self.user.pk, {self.product.pk: 2})
+        self.order = orders.create_order(self.user, generate_order_id())
+        self.client.force_login(self.user)
+
+    def pay(self):
+        response = self.client.post(
+            reverse("store:khalti_payment", args=[self.order.order_id])
+        )
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(response.url.startswith(self.stub.url))
+        return response.url
+
+    def test_pay_and_return(self):
+        payment_url = self.pay()
+        payment = Payment.objects.get(order=self.order)
+        self.assertEqual(payment.status, Payment.Status.INITIATED)
+        self.assertIn(payment.pidx, payment_url)
+
+        response = self.client.get(
+            reverse("store:khalti_payment_response"), {"pidx": payment.pidx}
+        )
+        self.assertRedirects(
+            response, reverse("store:order_page"), fetch_redirect_response=False
+        )
+        payment.refresh_from_db()
+        self.order.refresh_from_db()
+        self.assertEqual(payment.status, Payment.Status.SUCCESS)
+        self.assertEqual(payment.transaction_id, f"stub-{payment.pidx[:12]}")
+        self.assertEqual(self.order.status, Order.Status.PAID)
+
+    def test_payments_awaiting_the_gateway_do_not_collide(self):
+        carts.DatabaseCartBackend().apply(self.user.pk, {self.product.pk: 1})
+        other = orders.create_order(self.user, generate_order_id())
+        Payment.objects.create(
+            order=other, purchase_order_id=f"TR-{other.order_id}", amount=other.total
+        )
+        self.pay()
+        self.assertEqual(Payment.objects.filter(pidx__isnull=False).count(), 1)
+
+    def test_unreachable_gateway(self):
+        with override_settings(KHALTI_BASE_URL=f"http://127.0.0.1:{closed_port()}"):
+            response = self.client.post(
+                reverse("store:khalti_payment", args=[self.order.order_id])
+            )
+        self.assertRedirects(
+            response, reverse("store:order_page"), fetch_redirect_response=False
+        )
+        self.assertIsNone(Payment.objects.get(order=self.order).pidx)
@@ -7,15 +7,27 @@ urlpatterns = [
     path("", views.home, name="home_page"),
     # products
     path("products/", views.products, name="products_page"),
+    path(
+        "products/autocomplete/",
+        views.product_autocomplete,
+        name="product_autocomplete",
+    ),
     path("products/<int:pk>/detail/", views.product_detail, name="product_detail_page"),
     # cart
     path("cart/<int:pk>/add/", views.add_to_cart, name="add_to_cart"),
     path("cart/<int:pk>/remove/", views.remove_from_cart, name="remove_from_cart"),
     path("cart/<int:pk>/update/", views.update_cart, name="update_cart"),
+    path("cart/batch/", views.cart_batch, name="cart_batch"),
     path("cart/", views.cart, name="cart_page"),
     # order
     path("order/", views.place_order, name="place_order"),
+    path(
+        "order/<order_id>/processing/",
+        views.checkout_processing,
+        name="checkout_processing",
+    ),
     path("order/<int:pk>/cancel/", views.cancel_order, name="cancel_order"),
+    path("order/<int:pk>/reorder/", views.reorder, name="reorder"),
     path("order/view/", views.order, name="order_page"),
     # khalti-payment
     path(
@@ -26,6 +38,19 @@ urlpatterns = [
         views.khalti_payment_response,
         name="khalti_payment_response",
     ),
+    path(
+        "order/payment/khalti/metrics/",
+        views.khalti_metrics,
+        name="khalti_metrics",
+    ),
     # review
     path("order/<order_item_id>/review/", views.review, name="review"),
+    # exports
+    path(
+        "export/products/",
+        views.export,
+        {"kind": "products"},
+        name="export_products",
+    ),
+    path("export/orders/", views.export, {"kind": "orders"}, name="export_orders"),
 ]
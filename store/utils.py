@@ -1,6 +1,240 @@
-from datetime import datetime
+import atexit
+import os
+import random
+import socket
+import threading
+import time
+import uuid
+from datetime import timedelta
 
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import DatabaseError, IntegrityError, connection, transaction
+from django.utils import timezone
 
-def generate_order_id(user_id):
-    now = datetime.now()
-    return f"ORD-{now.year}{now.month}{now.day}-{user_id}-{now.hour}{now.minute}"
+# snowflake layout: milliseconds since EPOCH_MS, worker id, per-millisecond
+# sequence; 41 bits of milliseconds last until 2094
+EPOCH_MS = 1704067200000  # 2024-01-01T00:00:00Z
+WORKER_BITS = 10
+SEQUENCE_BITS = 12
+MAX_WORKER_ID = (1 << WORKER_BITS) - 1
+MAX_SEQUENCE = (1 << SEQUENCE_BITS) - 1
+
+
+class SnowflakeGenerator:
+    """
+    64-bit ids from the time, a worker id and a sequence counter, made in
+    memory. They increase with time, and two generators with different
+    worker ids never make the same id.
+    """
+
+    def __init__(self, worker_id):
+        if not 0 <= worker_id <= MAX_WORKER_ID:
+            raise ValueError(f"worker_id must be between 0 and {MAX_WORKER_ID}")
+        self.worker_id = worker_id
+        self._last_ms = -1
+        self._sequence = 0
+        self._lock = threading.Lock()
+
+    def _reserve(self, count):
+        """The first of up to ``count`` consecutive ids, and how many there are."""
+        with self._lock:
+            now = time.time_ns() // 1_000_000
+            if now < self._last_ms:
+                # the clock moved back; wait for it rather than reuse ids
+                time.sleep((self._last_ms - now) / 1000)
+                now = max(time.time_ns() // 1_000_000, self._last_ms)
+            if now == self._last_ms:
+                start = self._sequence + 1
+                if start > MAX_SEQUENCE:
+                    # this millisecond's ids are used up
+                    while now <= self._last_ms:
+                        now = time.time_ns() // 1_000_000
+                    start = 0
+            else:
+                start = 0
+            taken = min(count, MAX_SEQUENCE + 1 - start)
+            self._last_ms, self._sequence = now, start + taken - 1
+            return (
+                ((now - EPOCH_MS) << (WORKER_BITS + SEQUENCE_BITS))
+                | (self.worker_id << SEQUENCE_BITS)
+                | start
+            ), taken
+
+    def next_id(self):
+        return self._reserve(1)[0]
+
+    def next_ids(self, count):
+        """``count`` increasing ids, handed out a millisecond's worth at a time."""
+        ids = []
+        while len(ids) < count:
+            first, taken = self._reserve(count - len(ids))
+            ids.extend(range(first, first + taken))
+        return ids
+
+
+def lease_worker_id(holder):
+    """
+    Claim a worker id that no live process holds for ``holder``, for
+    ``ORDER_ID_WORKER_LEASE`` seconds: one never used, or one whose lease
+    ran out. Must be committed before the id is relied on.
+    """
+    from .models import WorkerIdLease
+
+    now = timezone.now()
+    expires_at = now + timedelta(seconds=settings.ORDER_ID_WORKER_LEASE)
+    held = set(
+        WorkerIdLease.objects.filter(expires_at__gt=now).values_list(
+            "worker_id", flat=True
+        )
+    )
+    # start somewhere random, so processes starting together rarely race
+    start = random.randrange(MAX_WORKER_ID + 1)
+    for offset in range(MAX_WORKER_ID + 1):
+        worker_id = (start + offset) % (MAX_WORKER_ID + 1)
+        if worker_id in held:
+            continue
+        if WorkerIdLease.objects.filter(
+            worker_id=worker_id, expires_at__lte=now
+        ).update(holder=holder, expires_at=expires_at):
+            return worker_id
+        try:
+            with transaction.atomic():
+                WorkerIdLease.objects.create(
+                    worker_id=worker_id, holder=holder, expires_at=expires_at
+                )
+            return worker_id
+        except IntegrityError:
+            # taken by another process in the meantime
+            continue
+    raise RuntimeError("Every order id worker id is leased")
+
+
+def renew_worker_id(worker_id, holder):
+    """Extend ``holder``'s lease; ``False`` if it ran out and was taken over."""
+    from .models import WorkerIdLease
+
+    return bool(
+        WorkerIdLease.objects.filter(worker_id=worker_id, holder=holder).update(
+            expires_at=timezone.now()
+            + timedelta(seconds=settings.ORDER_ID_WORKER_LEASE)
+        )
+    )
+
+
+def release_worker_id(worker_id, holder):
+    """Give ``holder``'s lease up, so the worker id can be leased again at once."""
+    from .models import WorkerIdLease
+
+    WorkerIdLease.objects.filter(worker_id=worker_id, holder=holder).delete()
+
+
+_generator = None
+_holder = None
+# when the lease is next renewed; 0 while it is not known to be committed
+_renew_at = 0
+_generator_lock = threading.RLock()
+
+
+def _forget_generator():
+    # a forked worker leases a worker id of its own
+    global _generator, _holder, _renew_at, _generator_lock
+
+    _generator, _holder, _renew_at = None, None, 0
+    _generator_lock = threading.RLock()
+
+
+os.register_at_fork(after_in_child=_forget_generator)
+
+
+def _lease_confirmed(holder):
+    """Renew the lease of ``holder`` again halfway through, once it is committed."""
+    renew_at = time.monotonic() + settings.ORDER_ID_WORKER_LEASE / 2
+
+    def confirm():
+        global _renew_at
+
+        with _generator_lock:
+            if _holder == holder:
+                _renew_at = renew_at
+
+    if connection.in_atomic_block:
+        # a rolled back lease is no lease; until the commit, every id
+        # checks the lease again
+        transaction.on_commit(confirm)
+    else:
+        confirm()
+
+
+def get_order_id_generator():
+    """
+    This process's generator, on a worker id leased from the database
+    (``WorkerIdLease``) so that no two processes share one. The lease is
+    renewed as ids are made; if it ran out and another process took the id
+    over, a new one is leased.
+    """
+    global _generator, _holder
+
+    if _generator is not None and time.monotonic() < _renew_at:
+        return _generator
+
+    with _generator_lock:
+        if _generator is not None and time.monotonic() >= _renew_at:
+            if renew_worker_id(_generator.worker_id, _holder):
+                _lease_confirmed(_holder)
+            else:
+                _generator = None
+        if _generator is None:
+            _holder = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+            _generator = SnowflakeGenerator(lease_worker_id(_holder))
+            _lease_confirmed(_holder)
+        return _generator
+
+
+def release_order_id_generator():
+    """
+    Give this process's worker id back instead of letting the lease run
+    out, which would keep the id from every new process for up to
+    ``ORDER_ID_WORKER_LEASE``. Runs at exit; ids made afterwards lease a
+    new one.
+    """
+    global _generator, _holder, _renew_at
+
+    with _generator_lock:
+        if _generator is None:
+            return
+        worker_id, holder = _generator.worker_id, _holder
+        _generator, _holder, _renew_at = None, None, 0
+        release_worker_id(worker_id, holder)
+
+
+def _release_at_exit():
+    try:
+        release_order_id_generator()
+    except DatabaseError:
+        # the lease runs out on its own
+        pass
+
+
+# also runs in forked children that exit normally, with their own lease
+atexit.register(_release_at_exit)
+
+
+def generate_order_id():
+    """
+    ``ORD-`` and a zero-padded snowflake id: unique across processes, and
+    sorting as text sorts orders by time. The database is only asked when
+    the worker id lease is taken or renewed, so make the first id of a
+    process outside a transaction.
+    """
+    return f"ORD-{get_order_id_generator().next_id():019d}"
+
+
+def cache_is_shared():
+    """
+    Whether the default cache is one store seen by every web and task
+    process (Redis, the database, ...) rather than a copy per process.
+    """
+    return not isinstance(caches["default"], (LocMemCache, DummyCache))
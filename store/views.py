@@ -1,110 +1,267 @@
-from django.shortcuts import render, get_object_or_404, redirect
-from .models import Product, Cart, CartProduct, Order, OrderItem, Payment, Review
-from django.core.paginator import Paginator
+from django.shortcuts import render, get_object_or_404, aget_object_or_404, redirect
+from .models import (
+    Product,
+    Order,
+    OrderItem,
+    Payment,
+    Review,
+    QueuedCheckout,
+)
+from django.core.paginator import Paginator, Page
 from .forms import ProductFilterForm, ReviewForm
 from django.urls import reverse, reverse_lazy
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
-from django.db.models import F, Sum, ExpressionWrapper, DecimalField
+from django.contrib.admin.views.decorators import staff_member_required
+from django.views.decorators.http import require_POST
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponseBadRequest, JsonResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.db.models import Q
 from .utils import generate_order_id
+from .idempotency import idempotent
 from django.db import transaction, IntegrityError
-import requests
 import json
+import os
 from decimal import Decimal
 from django.conf import settings
+from asgiref.sync import sync_to_async
 
-from django.views.decorators.cache import cache_page
-from django.core.cache import cache
 from . import signals
-
-
-def home(request):
-
-    featured_products = (
+from . import search
+from . import facets
+from .pagination import KeysetPaginator, KeysetPage
+from . import listing_cache
+from .snapshot import get_snapshot
+from . import fragments
+from . import recommendations
+from . import exports
+from . import autocomplete
+from . import carts
+from . import orders
+from . import inventory
+from . import khalti
+from .conditional import (
+    conditional_page,
+    conditional_api,
+    catalog_etag,
+    catalog_last_modified,
+    product_etag,
+    product_last_modified,
+)
+
+
+def featured_products():
+    snapshot = get_snapshot()
+    if snapshot is not None:
+        featured_ids = snapshot.featured_ids(8)
+        featured = Product.objects.only("updated_at").in_bulk(featured_ids)
+        return [featured[pk] for pk in featured_ids if pk in featured]
+
+    return (
         Product.objects.filter(featured=True)
         .order_by("-created_at")[:8]
-        .only("name", "price", "image")
+        .only("updated_at")
     )
 
-    context = {"products": featured_products}
+
+@conditional_page(catalog_etag, catalog_last_modified)
+def home(request):
+
+    context = {"featured_products": fragments.featured_strip(featured_products)}
 
     return render(request, "store/home.html", context)
 
 
-@cache_page(10)
-def products(request):
-    print("recomputing products----------------------------------")
+def product_listing(filters, page=1, cursor=None):
+    """
+    Compute one page of the products listing for the canonical ``filters``
+    (see ``listing_cache.canonical_filters``). Returns plain data so that it
+    can be cached: ``(pk, updated_at stamp)`` of the page's products, paging
+    state and facet counts.
+    """
     products = Product.objects.all()
+    ordering = ("pk",)
+    query = filters.get("name")
+    indexed = query and search.is_supported()
+    facet_filters = {}
+
+    if query and not indexed:
+        products = products.filter(
+            Q(name__icontains=query) | Q(description__icontains=query)
+        )
+        facet_filters["product_ids"] = list(products.values_list("pk", flat=True))
+
+    if filters.get("min_price"):
+        products = products.filter(price__gte=filters.get("min_price"))
+        facet_filters["min_price"] = Decimal(filters.get("min_price"))
+
+    if filters.get("max_price"):
+        products = products.filter(price__lte=filters.get("max_price"))
+        facet_filters["max_price"] = Decimal(filters.get("max_price"))
+
+    if filters.get("categories"):
+        # subquery instead of a join, so a product in several selected
+        # categories is listed once
+        products = products.filter(
+            pk__in=Product.categories.through.objects.filter(
+                category__in=filters.get("categories")
+            ).values("product_id")
+        )
+        facet_filters["category_ids"] = filters.get("categories")
+
+    if filters.get("min_rating"):
+        products = products.filter(rating_average__gte=filters.get("min_rating"))
+        facet_filters["min_rating"] = filters.get("min_rating")
+
+    # pk breaks ties so that every product has a fixed position
+    sorting_key = filters.get("sorting_key")
+    if sorting_key:
+        if sorting_key == "price_asc":
+            ordering = ("price", "pk")
+        elif sorting_key == "price_desc":
+            ordering = ("-price", "-pk")
+        elif sorting_key == "oldest":
+            ordering = ("created_at", "pk")
+        elif sorting_key == "latest":
+            ordering = ("-created_at", "-pk")
+        elif sorting_key == "top_rated":
+            ordering = ("-rating_average", "-pk")
+
+    listing = {"keyset": False}
+    snapshot = get_snapshot()
+    ranked = None
+    if indexed:
+        # the whole match list is only read for the facets, and in rank order
+        # for the snapshot, which pages in memory; otherwise a page is ranked
+        # and cut in the database
+        facet_filters["product_ids"] = search.search_product_ids(
+            query, ranked=snapshot is not None
+        )
+        ranked = search.RankedMatches(query, products)
+        products = products.filter(pk__in=search.matching_ids(query))
+
+    if snapshot is not None:
+        # filter and sort in memory
+        page_obj = Paginator(snapshot.select(ordering, **facet_filters), 16).get_page(
+            page
+        )
+    elif ranked is not None and ordering == ("pk",):
+        # best match first
+        page_obj = Paginator(ranked, 16).get_page(page)
+    elif settings.PRODUCTS_PAGINATION == "keyset":
+        page_obj = KeysetPaginator(
+            products.only(*[field.lstrip("-") for field in ordering]), 16, ordering
+        ).get_page(cursor)
+        listing.update(
+            keyset=True,
+            next_token=page_obj.next_token,
+            previous_token=page_obj.previous_token,
+        )
+    else:
+        products = products.order_by(*ordering)
+        page_obj = Paginator(products.values_list("pk", flat=True), 16).get_page(page)
 
+    if not listing["keyset"]:
+        listing["count"] = page_obj.paginator.count
+    listing["number"] = page_obj.number
+    ids = [getattr(item, "pk", item) for item in page_obj.object_list]
+    stamps = dict(Product.objects.filter(pk__in=ids).values_list("pk", "updated_at"))
+    listing["cards"] = [(pk, fragments.stamp(stamps[pk])) for pk in ids if pk in stamps]
+    listing["facets"] = facets.get_index().counts(**facet_filters)
+    return listing
+
+
+@conditional_page(catalog_etag, catalog_last_modified)
+def products(request):
     filter_form = ProductFilterForm(request.GET)
+    filters = {}
     if filter_form.is_valid():
-        if filter_form.cleaned_data.get("name"):
-            products = products.filter(
-                name__icontains=filter_form.cleaned_data.get("name")
-            )
-
-        if filter_form.cleaned_data.get("min_price"):
-            products = products.filter(
-                price__gte=filter_form.cleaned_data.get("min_price")
-            )
-
-        if filter_form.cleaned_data.get("max_price"):
-            products = products.filter(
-                price__lte=filter_form.cleaned_data.get("max_price")
-            )
-
-        if filter_form.cleaned_data.get("categories"):
-            products = products.filter(
-                categories__in=filter_form.cleaned_data.get("categories")
-            )
-
-        sorting_key = filter_form.cleaned_data.get("sorting_key")
-        if sorting_key:
-            if sorting_key == "price_asc":
-                products = products.order_by("price")
-            elif sorting_key == "price_desc":
-                products = products.order_by("-price")
-            elif sorting_key == "oldest":
-                products = products.order_by("created_at")
-            elif sorting_key == "latest":
-                products = products.order_by("-created_at")
-
-    products_paginator = Paginator(products, 16)
-    page_number = request.GET.get("page")
-    page_obj = products_paginator.get_page(page_number)
+        filters = listing_cache.canonical_filters(filter_form.cleaned_data)
+
+    page = listing_cache.canonical_page(request.GET.get("page"))
+    cursor = request.GET.get("cursor") or None
+    listing = listing_cache.get_or_compute(
+        listing_cache.listing_key(filters, page, cursor),
+        lambda: product_listing(filters, page, cursor),
+    )
+
+    cards = fragments.product_cards(listing["cards"])
+
+    if listing["keyset"]:
+        page_obj = KeysetPage(
+            cards,
+            listing["number"],
+            listing["next_token"],
+            listing["previous_token"],
+            KeysetPaginator,
+        )
+        page_range = page_obj.page_strip()
+    else:
+        paginator = Paginator(range(listing["count"]), 16)
+        page_obj = Page(cards, listing["number"], paginator)
+        page_range = paginator.get_elided_page_range(
+            page_obj.number, on_each_side=2, on_ends=1
+        )
+
+    facet_counts = listing["facets"]
+    filter_form.fields["categories"].label_from_instance = lambda category: (
+        f"{category.name} ({facet_counts['categories'].get(category.pk, 0)})"
+    )
 
     context = {
         "products": page_obj,
+        "page_range": page_range,
         "filter_form": filter_form,
+        "facets": facet_counts,
     }
     return render(request, "store/products.html", context)
 
 
+@conditional_api
+def product_autocomplete(request):
+    suggestions = autocomplete.get_index().suggest(request.GET.get("q", ""))
+    response = JsonResponse(
+        {
+            "results": [
+                {
+                    "id": pk,
+                    "name": name,
+                    "url": reverse("store:product_detail_page", args=[pk]),
+                }
+                for pk, name in suggestions
+            ]
+        }
+    )
+    response["Cache-Control"] = "max-age=60"
+    return response
+
+
+@conditional_page(product_etag, product_last_modified)
 def product_detail(request, pk):
     product = get_object_or_404(Product, pk=pk)
 
-    context = {"product": product}
+    context = {
+        "product": product,
+        "related_products": recommendations.related_products(product),
+    }
 
     return render(request, "store/product_detail.html", context)
 
 
-@login_required(login_url=reverse_lazy("accounts:login_page"))
 def add_to_cart(request, pk):
     try:
-        product = get_object_or_404(Product, pk=pk)
-        logged_in_user = request.user
-        cart, created = Cart.objects.get_or_create(user=logged_in_user)
-
-        if CartProduct.objects.filter(product=product, cart=cart).exists():
-            messages.success(request, "Product already in your cart")
-            return redirect("store:product_detail_page", pk=pk)
+        product = get_object_or_404(Product.objects.only("pk"), pk=pk)
 
         quantity = int(request.POST.get("quantity"))
         if quantity < 0:
             messages.error(request, "Quantify cannot be zero")
             return redirect("store:product_detail_page", pk=pk)
 
-        CartProduct.objects.create(product=product, cart=cart, quantity=quantity)
+        if not carts.for_request(request).add(request.user.pk, product.pk, quantity):
+            messages.success(request, "Product already in your cart")
+            return redirect("store:product_detail_page", pk=pk)
+
         messages.success(request, "Product added to cart successfully")
     except Exception as e:
         print(e)
@@ -113,71 +270,106 @@ def add_to_cart(request, pk):
     return redirect("store:product_detail_page", pk=pk)
 
 
-@login_required(login_url=reverse_lazy("accounts:login_page"))
 def remove_from_cart(request, pk):
     try:
-        cart_item = CartProduct.objects.get(pk=pk)
-    except CartProduct.DoesNotExist:
-        messages.error(request, "Cart item doesn't exists")
-
+        removed = carts.for_request(request).remove(request.user.pk, pk)
     except Exception as e:
         print(e)
         messages.error(request, "Removing item from cart failed")
     else:
-        cart_item.delete()
-        messages.success(request, "Cart item removed successful")
+        if removed:
+            messages.success(request, "Cart item removed successful")
+        else:
+            messages.error(request, "Cart item doesn't exists")
 
     return redirect("store:cart_page")
 
 
-@login_required(login_url=reverse_lazy("accounts:login_page"))
 def update_cart(request, pk):
     try:
-        cart_item = CartProduct.objects.get(pk=pk)
-    except CartProduct.DoesNotExist:
-        messages.error(request, "Cart item doesn't exists")
+        updated_quantity = int(request.POST.get("quantity"))
+    except (TypeError, ValueError):
+        messages.error(request, "Quantity must be a number")
+        return redirect("store:cart_page")
+
+    if updated_quantity < 1:
+        messages.error(request, "Quantity can't be less than 1")
+        return redirect("store:cart_page")
 
+    try:
+        updated = carts.for_request(request).set_quantity(
+            request.user.pk, pk, updated_quantity
+        )
     except Exception as e:
         print(e)
         messages.error(request, "Updating item from cart failed")
     else:
-        try:
-            updated_quantity = int(request.POST.get("quantity"))
-        except ValueError:
-            messages.error(request, "Quantity must be a number")
-        else:
-            if updated_quantity < 0:
-                messages.error(request, "Quantity can't be less than 1")
-
-            cart_item.quantity = updated_quantity
-            cart_item.save()
+        if updated:
             messages.success(request, "Cart item updated successful")
+        else:
+            messages.error(request, "Cart item doesn't exists")
 
     return redirect("store:cart_page")
 
 
+@require_POST
+def cart_batch(request):
+    """
+    Apply ``{"items": [{"product_id": .., "quantity": ..}], "mode": ..}`` to
+    the cart in one go. ``add`` (the default) adds the quantities, negative
+    ones taking away; ``set`` replaces them. Zero quantities remove.
+    """
+    try:
+        payload = json.loads(request.body)
+        mode = payload.get("mode", "add")
+    except (ValueError, AttributeError):
+        return JsonResponse({"error": "Body must be a JSON object"}, status=400)
+    if mode not in ("add", "set"):
+        return JsonResponse({"error": "mode must be add or set"}, status=400)
+
+    try:
+        changes = carts.parse_changes(payload.get("items"), replace=mode == "set")
+        items = carts.for_request(request).apply(
+            request.user.pk, changes, replace=mode == "set"
+        )
+    except carts.InvalidChanges as e:
+        return JsonResponse({"error": str(e)}, status=400)
+    except carts.CartLocked:
+        return JsonResponse({"error": "Cart is busy, try again"}, status=409)
+
+    return JsonResponse(
+        {
+            "items": [
+                {"product_id": product_id, "quantity": quantity}
+                for product_id, quantity in items.items()
+            ]
+        }
+    )
+
+
 @login_required(login_url=reverse_lazy("accounts:login_page"))
+@require_POST
+def reorder(request, pk):
+    order = get_object_or_404(Order.objects.only("pk"), pk=pk, user=request.user)
+    changes = {}
+    for product_id, quantity in order.items.values_list("product_id", "quantity"):
+        changes[product_id] = changes.get(product_id, 0) + quantity
+
+    try:
+        carts.get_backend().apply(request.user.pk, changes)
+    except Exception as e:
+        print(e)
+        messages.error(request, "Adding order items to cart failed")
+        return redirect("store:order_page")
+
+    messages.success(request, "Order items added to cart")
+    return redirect("store:cart_page")
+
+
 def cart(request):
     try:
-        user_cart = request.user.cart
-        if cart is not None:
-            # cart_products = CartProduct.objects.filter(cart=user_cart)
-            # cart_total = 0
-            # for cart_item in cart_products:
-            #     cart_total += cart_item.get_total_price
-
-            cart_products = (
-                CartProduct.objects.filter(cart=user_cart)
-                .select_related("product")
-                .annotate(
-                    subtotal=ExpressionWrapper(
-                        F("product__price") * F("quantity"),
-                        output_field=DecimalField(max_digits=10, decimal_places=2),
-                    )
-                )
-            )
-
-            cart_total = cart_products.aggregate(total=Sum("subtotal"))["total"] or 0
+        cart_products = carts.for_request(request).lines(request.user.pk)
+        cart_total = sum(line.get_total_price for line in cart_products)
 
     except Exception:
         messages.error(request, "Something went wrong, please try again later")
@@ -189,42 +381,30 @@ def cart(request):
 
 
 @login_required(login_url=reverse_lazy("accounts:login_page"))
+@require_POST
+@idempotent
 def place_order(request):
-    user_cart = request.user.cart
-
-    cart_products = CartProduct.objects.filter(cart=user_cart).annotate(
-        subtotal=ExpressionWrapper(
-            F("product__price") * F("quantity"),
-            output_field=DecimalField(max_digits=10, decimal_places=2),
-        )
-    )
-    cart_sub_total = cart_products.aggregate(total=Sum("subtotal"))["total"] or 0
-
+    # before the checkout transaction, which a worker id lease must not
+    # be rolled back with
+    order_id = generate_order_id()
     try:
-        order_id = generate_order_id(request.user.id)
-        with transaction.atomic():
-            # create new order
-            new_order = Order.objects.create(
-                user=request.user,
-                order_id=order_id,
-                subtotal=cart_sub_total,
-                total=cart_sub_total,
-            )
-
-            # create order items for newly created order
-            for cart_item in cart_products:
-                OrderItem.objects.create(
-                    order=new_order,
-                    product=cart_item.product,
-                    product_name=cart_item.product.name,
-                    price=cart_item.product.price,
-                    quantity=cart_item.quantity,
-                )
-
-            # remove ordered items from cart
-            for cart_item in cart_products:
-                cart_item.delete()
-
+        # the cart stays locked, and persisted to CartProduct, until the
+        # order is written
+        with carts.get_backend().checkout(request.user.pk) as items:
+            if settings.CHECKOUT_QUEUED:
+                checkout = orders.enqueue_order(request.user, order_id, items)
+            else:
+                orders.create_order(request.user, order_id)
+
+    except orders.EmptyCart:
+        messages.error(request, "Your cart is empty")
+        return redirect("store:cart_page")
+    except inventory.OutOfStock as e:
+        names = Product.objects.filter(pk__in=e.product_ids).values_list(
+            "name", flat=True
+        )
+        messages.error(request, f"Not enough stock for: {', '.join(names)}")
+        return redirect("store:cart_page")
     except IntegrityError:
         messages.error(request, "Failed to create an order")
         return redirect("store:cart_page")
@@ -232,19 +412,40 @@ def place_order(request):
         print("Unexpected behaviour: ", str(e))
         return redirect("store:cart_page")
     else:
+        if settings.CHECKOUT_QUEUED:
+            return redirect("store:checkout_processing", order_id=checkout.order_id)
         messages.success(request, "Order placed successful")
         return redirect("store:order_page")
 
 
+@login_required(login_url=reverse_lazy("accounts:login_page"))
+def checkout_processing(request, order_id):
+    checkout = get_object_or_404(
+        QueuedCheckout.objects.only("order_id", "status", "message"),
+        order_id=order_id,
+        user=request.user,
+    )
+    if checkout.status == QueuedCheckout.Status.PLACED:
+        messages.success(request, "Order placed successful")
+        return redirect("store:order_page")
+    if checkout.status == QueuedCheckout.Status.FAILED:
+        messages.error(request, checkout.message or "Failed to create an order")
+        return redirect("store:cart_page")
+
+    return render(request, "store/checkout_processing.html", {"checkout": checkout})
+
+
 @login_required(login_url=reverse_lazy("accounts:login_page"))
 def cancel_order(request, pk):
-    try:
-        order_to_delete = Order.objects.get(pk=pk)
-    except Order.DoesNotExist:
-        messages.error(request, "Failed to cancel the order")
-    else:
+    # only the owner's pending orders, so nobody releases stock of an order
+    # that is not theirs or already paid for
+    order_to_delete = get_object_or_404(
+        Order, pk=pk, user=request.user, status=Order.Status.PENDING
+    )
+    with transaction.atomic():
+        inventory.release(order_to_delete)
         order_to_delete.delete()
-        messages.success(request, "Order cancel successful")
+    messages.success(request, "Order cancel successful")
 
     return redirect("store:order_page")
 
@@ -262,12 +463,16 @@ def order(request):
 
 
 @login_required(login_url="accounts:login_page")
-def khalti_payment(request, order_id):
+@idempotent
+async def khalti_payment(request, order_id):
+    # async, so a slow gateway holds no worker thread while it answers
+    user = await request.auser()
+
     # 1. Fetch order securely (ownership check)
-    order = get_object_or_404(
+    order = await aget_object_or_404(
         Order,
         order_id=order_id,
-        user=request.user,
+        user=user,
     )
 
     if order.status == Order.Status.PAID:
@@ -277,7 +482,7 @@ def khalti_payment(request, order_id):
     purchase_order_id = f"TR-{order.order_id}"
 
     # 2. Create or reuse payment safely
-    payment, created = Payment.objects.get_or_create(
+    payment, created = await Payment.objects.aget_or_create(
         purchase_order_id=purchase_order_id,
         defaults={
             "order": order,
@@ -299,28 +504,15 @@ def khalti_payment(request, order_id):
         "purchase_order_id": payment.purchase_order_id,
         "purchase_order_name": str(order.order_id),
         "customer_info": {
-            "name": request.user.get_full_name() or request.user.email,
-            "email": request.user.email,
+            "name": user.get_full_name() or user.email,
+            "email": user.email,
             "phone": getattr(order, "phone", "no phone"),
         },
     }
 
-    headers = {
-        "Authorization": f"Key {settings.KHALTI_SECRET_KEY}",
-        "Content-Type": "application/json",
-    }
-
     try:
-        response = requests.post(
-            url=f"{settings.KHALTI_BASE_URL}/epayment/initiate/",
-            json=payload,
-            headers=headers,
-            timeout=10,
-        )
-
-        response.raise_for_status()
-        data = response.json()
-    except requests.RequestException as e:
+        data = await khalti.ainitiate(payload)
+    except khalti.KhaltiError:
         messages.error(request, "Payment service unavailable. Try again later.")
         return redirect("store:order_page")
 
@@ -332,13 +524,29 @@ def khalti_payment(request, order_id):
         return redirect("store:order_page")
 
     payment.pidx = pidx
-    payment.save(update_fields=["pidx"])
+    await payment.asave(update_fields=["pidx"])
 
     return redirect(payment_url)
 
 
+def confirm_payment(payment, transaction_id):
+    with transaction.atomic():
+        payment.transaction_id = transaction_id
+        payment.status = Payment.Status.SUCCESS
+        payment.save(update_fields=["transaction_id", "status"])
+
+        payment.order.status = Order.Status.PAID
+        payment.order.save(update_fields=["status"])
+
+
+async def fail_payment(payment):
+    payment.status = Payment.Status.FAILED
+    await payment.asave(update_fields=["status"])
+    await sync_to_async(inventory.release)(payment.order)
+
+
 @login_required(login_url="accounts:login_page")
-def khalti_payment_response(request):
+async def khalti_payment_response(request):
     pidx = request.GET.get("pidx")
 
     if not pidx:
@@ -346,7 +554,7 @@ def khalti_payment_response(request):
         return redirect("store:home_page")
 
     try:
-        payment = Payment.objects.select_related("order").get(pidx=pidx)
+        payment = await Payment.objects.select_related("order").aget(pidx=pidx)
     except Payment.DoesNotExist:
         messages.error(request, "Payment record not found.")
         return redirect("store:home_page")
@@ -357,37 +565,31 @@ def khalti_payment_response(request):
         return redirect("store:order_page")
 
     # 1. Verify with Khalti (server-to-server)
-    headers = {
-        "Authorization": f"Key {settings.KHALTI_SECRET_KEY}",
-        "Content-Type": "application/json",
-    }
-
     try:
-        response = requests.post(
-            url=f"{settings.KHALTI_BASE_URL}/epayment/lookup/",
-            json={"pidx": pidx},
-            headers=headers,
-            timeout=10,
-        )
-        response.raise_for_status()
-        data = response.json()
-    except requests.RequestException:
+        data = await khalti.alookup(pidx)
+    except khalti.KhaltiError:
         messages.error(request, "Payment verification failed.")
         return redirect("store:home_page")
 
     # 2. Validate response
-    if data.get("status") != "Completed":
-        payment.status = Payment.Status.FAILED
-        payment.save(update_fields=["status"])
+    status = data.get("status")
+    if status in khalti.FAILED_STATUSES:
+        await fail_payment(payment)
         messages.error(request, "Payment was not completed.")
         return redirect("store:home_page")
+    if status != "Completed":
+        # not final: the stock stays reserved until the payment settles
+        if status == "Pending":
+            payment.status = Payment.Status.PENDING
+            await payment.asave(update_fields=["status"])
+        messages.info(request, "Payment is still being processed.")
+        return redirect("store:order_page")
 
     total_amount_paisa = int(data.get("total_amount", 0))
     expected_amount_paisa = int(payment.amount * Decimal("100"))
 
     if total_amount_paisa != expected_amount_paisa:
-        payment.status = Payment.Status.FAILED
-        payment.save(update_fields=["status"])
+        await fail_payment(payment)
         messages.error(request, "Payment amount mismatch.")
         return redirect("store:home_page")
 
@@ -395,13 +597,7 @@ def khalti_payment_response(request):
 
     # 3. Finalize atomically
     try:
-        with transaction.atomic():
-            payment.transaction_id = transaction_id
-            payment.status = Payment.Status.SUCCESS
-            payment.save(update_fields=["transaction_id", "status"])
-
-            payment.order.status = Order.Status.PAID
-            payment.order.save(update_fields=["status"])
+        await sync_to_async(confirm_payment)(payment, transaction_id)
     except Exception:
         messages.error(request, "Payment verification failed.")
         return redirect("store:home_page")
@@ -410,6 +606,12 @@ def khalti_payment_response(request):
     return redirect("store:order_page")
 
 
+@staff_member_required(login_url=reverse_lazy("accounts:login_page"))
+def khalti_metrics(request):
+    """Latency and error counts of this worker's Khalti calls."""
+    return JsonResponse({"pid": os.getpid(), "operations": khalti.metrics.snapshot()})
+
+
 @login_required(login_url="accounts:login_page")
 def review(request, order_item_id):
     order_item = get_object_or_404(OrderItem, pk=order_item_id)
@@ -443,3 +645,28 @@ def review(request, order_item_id):
             "form": form,
         },
     )
+
+
+@staff_member_required(login_url=reverse_lazy("accounts:login_page"))
+def export(request, kind):
+    format = request.GET.get("format", "csv")
+    if format not in exports.FORMATS:
+        return HttpResponseBadRequest("format must be csv or jsonl")
+    try:
+        since = exports.parse_watermark(request.GET.get("since"))
+    except exports.InvalidWatermark:
+        return HttpResponseBadRequest("since must be an ISO 8601 timestamp")
+    until = timezone.now()
+
+    # under ASGI a sync iterator would be read into memory whole
+    stream = exports.astream if isinstance(request, ASGIRequest) else exports.stream
+    response = StreamingHttpResponse(
+        stream(kind, format, since, until),
+        content_type=exports.FORMATS[format],
+    )
+    response["Content-Disposition"] = (
+        f'attachment; filename="{kind}-{until:%Y%m%dT%H%M%S}.{format}"'
+    )
+    # pass back as ?since= to export only what changed after this export
+    response["X-Export-Watermark"] = until.isoformat()
+    return response